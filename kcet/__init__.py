@@ -1,9 +1,14 @@
 from .ct_by_phase_parser import CTParserByPhase
 from .kcet_parser import KcetParser
 from .kcet_dataset_generator import KcetDatasetGenerator
-from .kcet_random_forest import KcetRandomForest
-from .wordvec2cosine import Wordvec2Cosine
+from .kcet_random_forest import KcetRandomForest, load_model, save_model
+from .wordvec2cosine import Wordvec2Cosine, SimilarityCache
 from .drugcentral_pk_pki_parser import DrugCentralPkPkiParser
+from .embedding_store import EmbeddingStore
+from .link_set import KinaseCancerGrid, LinkSet
+from .execution_config import ExecutionConfig
+from .ivf_index import IvfIndex
+from .universe_scorer import ScoreWriter, read_scores, score_universe, score_universe_top_k
 
 __all__ = [
     "CTParserByPhase",
@@ -11,5 +16,17 @@ __all__ = [
     "KcetParser",
     "KcetRandomForest",
     "DrugCentralPkPkiParser",
-    "Wordvec2Cosine"
+    "EmbeddingStore",
+    "ExecutionConfig",
+    "IvfIndex",
+    "KinaseCancerGrid",
+    "LinkSet",
+    "ScoreWriter",
+    "SimilarityCache",
+    "Wordvec2Cosine",
+    "load_model",
+    "read_scores",
+    "save_model",
+    "score_universe",
+    "score_universe_top_k"
 ]
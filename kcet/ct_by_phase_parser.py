@@ -1,13 +1,13 @@
-from .clinical_trial import ClinicalTrial
-from .kinase_inhibitor import KinaseInhibitor
 from .drugcentral_pk_pki_parser import DrugCentralPkPkiParser
+from . import input_registry
+from .first_occurrence_index import FirstOccurrenceIndex, PHASES
+from .link_set import KinaseCancerGrid
 
 import os
+import csv
+import numpy as np
 import pandas as pd
 from pathlib import Path
-from collections import defaultdict
-import copy
-from typing import List, Dict
 import logging
 
 logging.basicConfig(format='%(asctime)s,%(msecs)d %(levelname)-8s [%(filename)s:%(lineno)d] %(message)s',
@@ -16,6 +16,75 @@ logging.basicConfig(format='%(asctime)s,%(msecs)d %(levelname)-8s [%(filename)s:
                     level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
+CT_BY_PHASE_HEADER = ['disease', 'mesh_id', 'drug', 'phase', 'start_date', 'completion_date', 'nct_id']
+# columns of the kinase/cancer link tables (one row per trial and kinase)
+LINK_COLUMNS = ['cancer', 'mesh_id', 'kinase', 'gene_id', 'pki', 'nct', 'phase', 'year']
+
+
+def parse_clinical_trials_by_phase(path: str) -> pd.DataFrame:
+    """
+    parse the clinical_trials_by_phase.tsv file in one vectorized pass
+    Return a data frame with one row per line and the columns cancer, mesh_id, pki, phase, year, nct
+    """
+    if not os.path.exists(path):
+        raise FileNotFoundError("Could not find the clinical_trials_by_phase.tsv file")
+    try:
+        trials = pd.read_csv(path, sep='\t', dtype=str, keep_default_na=False, quoting=csv.QUOTE_NONE)
+    except pd.errors.ParserError as e:
+        raise ValueError("Bad line in clinical_trials_by_phase.tsv file: %s" % str(e))
+    # should be disease	mesh_id	drug	phase	start_date	completion_date	nct_id
+    if list(trials.columns) != CT_BY_PHASE_HEADER:
+        raise ValueError("Bad header line in clinical_trials_by_phase.tsv file")
+    # lines with too few fields have missing values
+    bad_lines = (trials.isna() | (trials == '')).any(axis=1)
+    if bad_lines.any():
+        raise ValueError("Bad line in clinical_trials_by_phase.tsv file: %s" % "\t".join(
+            trials[bad_lines].iloc[0].fillna('').astype(str)))
+    bad_phases = ~trials['phase'].isin(PHASES)
+    if bad_phases.any():
+        raise ValueError("Bad value for phase -- '%s'" % trials.loc[bad_phases, 'phase'].iloc[0])
+    try:
+        years = trials['start_date'].astype(np.int64)
+    except ValueError:
+        raise ValueError("Bad start_date in clinical_trials_by_phase.tsv file")
+    mesh = trials['mesh_id']
+    return pd.DataFrame({'cancer': trials['disease'],
+                         'mesh_id': "mesh" + mesh.str[0].str.lower() + mesh.str[1:],
+                         'pki': trials['drug'],
+                         'phase': trials['phase'],
+                         'year': years,
+                         'nct': trials['nct_id']})
+
+
+def _get_ranked_pk_pki_table() -> pd.DataFrame:
+    """
+    Return the PK/PKI links ranked by affinity (see DrugCentralPkPkiParser.get_ranked_pk_pki) with the columns
+    pki, kinase, gene_id (NaN if the kinase is not in prot_kinase.tsv), pk_rank, n_pk_links and pk_position
+    """
+    ranked = DrugCentralPkPkiParser().get_ranked_pk_pki()
+    ranked = ranked.rename(columns={'pk': 'kinase'})
+    # kinases that are not in prot_kinase.tsv have no gene id; this is an error only if they are selected
+    ranked['gene_id'] = ranked['kinase'].map(input_registry.get_symbol_to_id_map())
+    return ranked[['pki', 'kinase', 'gene_id', 'pk_rank', 'n_pk_links', 'pk_position']]
+
+
+def expand_ranked_trial_links(path: str) -> pd.DataFrame:
+    """
+    Map the PKI of each trial of the clinical_trials_by_phase.tsv file to all of the protein kinases it inhibits
+    with a single join. Return a pandas dataframe with one row for each trial and kinase, with the link columns,
+    the index of the trial (trial) and the affinity rank of the kinase (pk_rank, n_pk_links and pk_position, see
+    DrugCentralPkPkiParser.get_ranked_pk_pki)
+    """
+    trials = input_registry.get_registry().get(path, parse_clinical_trials_by_phase, snapshot=True)
+    pk_pki_table = _get_ranked_pk_pki_table()
+    unknown = ~trials['pki'].isin(pk_pki_table['pki'])
+    if unknown.any():
+        # should never happen
+        raise ValueError("Could not find " + trials.loc[unknown, 'pki'].iloc[0] + " in pki to pk dict")
+    trials = trials.assign(trial=np.arange(len(trials), dtype=np.int64))
+    df = trials.merge(pk_pki_table, on='pki', how='inner', sort=False)
+    return df[LINK_COLUMNS + ['trial', 'pk_rank', 'n_pk_links', 'pk_position']]
+
 
 class Entry:
     """
@@ -69,154 +138,111 @@ class CTParserByPhase:
         base_path = Path(dir_path).parent  # parent directory -- the base of the project
         # file consisting of protein kinases their gene symbols, ncbi gene ids and ensembl gene ids
         self.prot_kinase_path = os.path.join(base_path, 'input', 'prot_kinase.tsv')
-        self.gene_symbol_to_ncbigene_map = self._parse_prot_kinase()  # map gene symbols to their ncbi gene ids
+        # map gene symbols to their ncbi gene ids (parsed once per process, see input_registry)
+        self.gene_symbol_to_ncbigene_map = input_registry.get_symbol_to_id_map(self.prot_kinase_path)
         self._clinical_trials_data_path = clinical_trials
         if not os.path.isfile(self._clinical_trials_data_path):
             raise FileNotFoundError("Could not find %s" % self._clinical_trials_data_path)
         self.drug_kinase_links_data_path = os.path.join(base_path, 'input', 'drug_kinase_links.tsv')
         # _genesymbol_to_id map has entries like {CDK20:ncbigene23552}
-        self._genesymbol_to_id_map = self._parse_prot_kinase()
-
-        self.all_phases_df = None
-        drug_central_parser = DrugCentralPkPkiParser()
-        # both of the following variables have entries like {abemaciclib:[CDK4,CDK6]}
-        # the thresholded version is used for training.
-        # the 'all links' version has all links from DrugCentral, regardless of threshold -- we do not want
-        # to test against this because it would not be fair.
-        self._thresholded_pk_pki_links = drug_central_parser.get_pk_pki_with_threshold(n_pki_limit=n_pk)
-        self._all_pk_pki_links = drug_central_parser.get_all_pk_pki()
+        self._genesymbol_to_id_map = self.gene_symbol_to_ncbigene_map
+
+        self._n_pk = n_pk
+        self._first_occurrence_index = None
         self._ingest_kinase_cancer_links()
 
-    def _parse_prot_kinase(self) -> Dict:
-        """
-        parse prot_kinase.tsv and map gene symbols to ncbigene ids
-        return a dictionary with key being a gene symbol and value being the corresponding NCBI gene id
-        e.g., for the line
-        CDK20	cyclin dependent kinase 20	23552	ENSG00000156345
-        we would have {'CDK20' => 23552}
-        """
-        symbol2ncbigene = defaultdict(str)
-        with open(self.prot_kinase_path) as f:
-            # Note this file has no header
-            for line in f:
-                fields = line.rstrip().split('\t')
-                if len(fields) != 4:
-                    # should never happen
-                    raise ValueError("Malformed line: %s" % line)
-                sym = fields[0].strip()
-                ncbigene = fields[2].strip()
-                ncbi_gene_id = "ncbigene" + str(
-                    ncbigene)  # We add "ncbigene" because in pubmed_cr.tsv, genes are represented in this way
-                symbol2ncbigene[sym] = ncbi_gene_id
-        return symbol2ncbigene
-
-    def _get_ct_by_phase(self) -> List:
-        """
-        parse the clinical_trials_by_phase.tsv file
+    def _get_ct_by_phase(self) -> pd.DataFrame:
+        """
+        Return the parsed clinical_trials_by_phase.tsv file (a copy of the cached table)
         """
         if not os.path.exists(self._clinical_trials_data_path):
             raise FileNotFoundError("Could not find the clinical_trials_by_phase.tsv file")
-        trials = []
-        with open(self._clinical_trials_data_path) as f:
-            header = next(f)
-            # should be disease	mesh_id	drug	phase	start_date	completion_date	nct_id
-            if not header.startswith("disease"):
-                raise ValueError("Bad header line in clinical_trials_by_phase.tsv file")
-            for line in f:
-                fields = line.rstrip().split('\t')
-                if len(fields) != 7:
-                    raise ValueError("Bad line in clinical_trials_by_phase.tsv file:" + line)
-                disease = fields[0]
-                mesh = fields[1]
-                mesh_id_first_letter = mesh[0].lower()
-                mesh_id = "mesh" + mesh_id_first_letter + mesh[1:]
-                drug = fields[2]
-                phase = fields[3]
-                start = int(fields[4])
-                end = int(fields[5])
-                nct = fields[6]
-                ct = ClinicalTrial(disease=disease, mesh_id=mesh_id, drug=drug, phase=phase,
-                                   start_date=start, completion_date=end, nct_id=nct)
-                trials.append(ct)
-        return trials
+        return input_registry.get_registry().get(self._clinical_trials_data_path, parse_clinical_trials_by_phase,
+                                                 snapshot=True)
 
     def _ingest_kinase_cancer_links(self) -> None:
         """
         We first use the clinical_trials_by_phase.tsv to extract disease-drug information for a specific phase,
         e.g. Phase 1 before a specific date (year). The phase and date are specified by the user.
-        Then, we use the drug_kinase_links.tsv to obtain drug-kinase links and finally we generate disease_kinase links.
-        """
-        trials = self._get_ct_by_phase()
-        # sanity check-make a set of the medications
-        medications = {t.drug for t in trials}
-        logging.info("Parsed data for %d medications." % len(medications))
-        pki_dict = defaultdict(KinaseInhibitor)
-        for t in trials:
-            med = t.drug
-            if med not in pki_dict:
-                ki = KinaseInhibitor(name=med)
-                pki_dict[med] = ki
-            ki = pki_dict.get(med)
-            ki.add_study(cancer=t.disease, mesh_id=t.mesh_id, nct=t.nct_id, year=t.start_date, phase=t.phase)
-        self._pki_dict = pki_dict
-
-    def _get_data_frame(self, dict_list: List, remove_redundant_entries: bool = False) -> pd.DataFrame:
+        Then, we use the DrugCentral PK/PKI links to obtain drug-kinase links and finally we generate disease_kinase
+        links. The links are ranked by affinity once per clinical trials file (see get_ranked_links); the links
+        for n_pk are selected from the ranked links.
         """
-        Return a pandas dataframe with data for all trials and all phases
-        Constructs the dataframe from a list of dictionaries
-        """
-        extended_dict_list = []  ## The dictionaries where we map the PKIs to kinases/genes ids
-        for dct in dict_list:
-            medication = dct['pki']
-            if medication is None:
-                raise ValueError("Could not extract PKI")  # should never happen
-            if medication not in self._thresholded_pk_pki_links:
+        self._trials = self._get_ct_by_phase()
+        logging.info("Parsed data for %d medications." % self._trials['pki'].nunique())
+        dependencies = [self.prot_kinase_path, input_registry.get_input_path(input_registry.DRUG_CENTRAL_PK_PKI)]
+        self._ranked_links_df = input_registry.get_registry().get(self._clinical_trials_data_path,
+                                                                  expand_ranked_trial_links, snapshot=True,
+                                                                  dependencies=dependencies)
+        self._n_pk_links = {}
+        self._all_phases_df = self._select_n_pk(self._n_pk)
+
+    def _select_n_pk(self, n_pk: int) -> pd.DataFrame:
+        """
+        Return the links of all trials for n_pk, i.e., the links whose PK is among the n_pk PKs with the highest
+        affinity to the PKI (see DrugCentralPkPkiParser.get_ranked_pk_pki). The rows of each trial stay in the
+        order of the PK/PKI links
+        """
+        if n_pk not in self._n_pk_links:
+            ranked = self._ranked_links_df
+            selected = ranked[ranked['pk_rank'] <= n_pk]
+            unknown = selected['gene_id'].isna()
+            if unknown.any():
                 # should never happen
-                raise ValueError("Could not find " + medication + " in pki to pk dict")
-            lst = self._thresholded_pk_pki_links[medication]
-            for kinase in lst:
-                if kinase not in self._genesymbol_to_id_map:
-                    # should never happen
-                    raise ValueError("Could not find " + kinase + " in gene id map")
-                gene_id = self._genesymbol_to_id_map[kinase]
-                extended_d = copy.deepcopy(dct)
-                extended_d['kinase'] = kinase
-                extended_d['gene_id'] = gene_id
-                extended_dict_list.append(extended_d)
-        if remove_redundant_entries:
-            unique_list = []
-            seen_entries = set()
-            for entry in extended_dict_list:
-                # form a key that is unique for the gene/kinase combination
-                key = entry['mesh_id'] + entry['gene_id']
-                if key not in seen_entries:
-                    seen_entries.add(key)
-                    unique_list.append(entry)
-            df = pd.DataFrame.from_records([d for d in unique_list])
-        else:
-            df = pd.DataFrame.from_records([d for d in extended_dict_list])
-        # reorder the columns
-        newcols = ['cancer', 'mesh_id', 'kinase', 'gene_id', 'pki', 'nct', 'phase', 'year']
-        return df[newcols]
-
-    def get_all_phases(self, remove_redundant_entries: bool = False):
+                raise ValueError("Could not find " + selected.loc[unknown, 'kinase'].iloc[0] + " in gene id map")
+            order = np.where(selected['n_pk_links'] <= n_pk, selected['pk_position'], selected['pk_rank'])
+            selected = selected.iloc[np.lexsort((order, selected['trial'].values))]
+            self._n_pk_links[n_pk] = selected[LINK_COLUMNS].reset_index(drop=True)
+        return self._n_pk_links[n_pk]
+
+    def get_ranked_links(self, max_n_pk: int = None) -> pd.DataFrame:
+        """
+        Return the links of all trials and all PKs of the PKIs (one row per trial and kinase) with the column pk_rank,
+        the affinity rank of the kinase among the kinases inhibited by the PKI. The links for an n_pk are the rows
+        with pk_rank <= n_pk, so that a sweep over n_pk values can filter this table instead of parsing again.
+        If max_n_pk is given, return only the rows with pk_rank <= max_n_pk
+        """
+        ranked = self._ranked_links_df
+        if max_n_pk is not None:
+            ranked = ranked[ranked['pk_rank'] <= max_n_pk]
+        return ranked[LINK_COLUMNS + ['pk_rank']].reset_index(drop=True)
+
+    @staticmethod
+    def _remove_redundant_entries(df: pd.DataFrame) -> pd.DataFrame:
+        """
+        keep only the first entry for each kinase/cancer combination
+        """
+        return df.drop_duplicates(subset=['mesh_id', 'gene_id'], keep='first').reset_index(drop=True)
+
+    def get_all_phases(self, remove_redundant_entries: bool = False, n_pk: int = None):
         """
         Return a pandas dataframe with data for all trials and all phases
+        (for the n_pk of this parser, or for another n_pk if given)
         """
-        dict_list = []
-        for _, v in self._pki_dict.items():
-            dict_list.extend(v.get_data_frame_all_phases())
-        df = self._get_data_frame(dict_list=dict_list, remove_redundant_entries=remove_redundant_entries)
-        return df
+        df = self._all_phases_df if n_pk is None else self._select_n_pk(n_pk)
+        if remove_redundant_entries:
+            return CTParserByPhase._remove_redundant_entries(df)
+        return df.copy()
 
-    def get_phase_4(self, remove_redundant_entries: bool = False):
+    def get_phase_4(self, remove_redundant_entries: bool = False, n_pk: int = None):
         """
         Return a pandas dataframe with data for all trials in phase 4
+        (for the n_pk of this parser, or for another n_pk if given)
+        """
+        df = self._all_phases_df if n_pk is None else self._select_n_pk(n_pk)
+        df = df[df['phase'] == 'Phase 4']
+        if remove_redundant_entries:
+            return CTParserByPhase._remove_redundant_entries(df)
+        return df.reset_index(drop=True)
+
+    def get_first_occurrence_index(self, grid: KinaseCancerGrid) -> FirstOccurrenceIndex:
+        """
+        Return the index of the earliest trial year of each kinase/cancer pair by phase (see FirstOccurrenceIndex).
+        The index is built once from all trials and kinases and reused for subsequent calls with the same grid.
         """
-        dict_list = []
-        for _, v in self._pki_dict.items():
-            dict_list.extend(v.get_data_frame_phase_4())
-        return self._get_data_frame(dict_list=dict_list, remove_redundant_entries=remove_redundant_entries)
+        if self._first_occurrence_index is None or self._first_occurrence_index.grid is not grid:
+            self._first_occurrence_index = FirstOccurrenceIndex(grid=grid, links=self.get_all_phases())
+        return self._first_occurrence_index
 
     def get_year(self):
         return self._year
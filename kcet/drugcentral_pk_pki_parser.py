@@ -1,7 +1,8 @@
-import os
-import csv
+from . import input_registry
+
 from collections import defaultdict
 from typing import List, Dict
+import numpy as np
 import pandas as pd
 import logging
 
@@ -12,6 +13,10 @@ logging.basicConfig(format='%(asctime)s,%(msecs)d %(levelname)-8s [%(filename)s:
 logger = logging.getLogger(__name__)
 
 
+# affinity cutoffs (micromolar) for PKIs with no PKs below the previous cutoff: 30 nM, 300 nM, 3 uM
+AFFINITY_LADDER = [0.03, 0.3, 3.0]
+
+
 class PkPkiLink:
     """
     This class models a protein kinase (PKs) to protein kinase inhibitor (PKI) link
@@ -96,48 +101,82 @@ class DrugCentralPkPkiParser:
     no kinases, go to 3 uM.  I doubt that would be the case - and I would certainly not see the value in the 3 uM scenario.
     We use a file with Kds from DrugCentral.
     Note that the Act_Value is micromolar, and thus, the appropriate cut-off is 0.03, i.e., 0.03 micromolar = 30 nanomolar.
+    get_pk_pki_ladder implements the relaxation (AFFINITY_LADDER); get_pk_pki_with_threshold uses a single cutoff.
     """
 
     def __init__(self):
         """
         Note that we assume that the DrugCentral file is in the input directory.
+        The file is parsed once per process and the links are shared by all instances (see input_registry)
         """
-        current_dir = os.path.dirname(__file__)
-        parent_dir = os.path.dirname(os.path.normpath(current_dir))
-        drug_central_pk_pki_file = os.path.join(parent_dir, 'input', "DrugCentralPKIPK.csv")
-        self._pk_pki_list = []
+        drug_central_pk_pki_file = input_registry.get_input_path(input_registry.DRUG_CENTRAL_PK_PKI)
         logger.info("Reading PK/PKI data from %s", drug_central_pk_pki_file)
-        with open(drug_central_pk_pki_file) as f:
-            rdr = csv.DictReader(f, delimiter='\t')
-            for row in rdr:
-                pki = row['PKI']
-                pk = row['PK']
-                pmid = row['PMID']
-                act_value = row['ACT_VALUE (uM)']
-                if act_value == '':
-                    act_value = None
-                else:
-                    act_value = float(row['ACT_VALUE (uM)'])
-                act_type = row['ACT_TYPE']
-                if act_type is not None and len(act_type) > 1:
-                    if act_type != 'Kd' and act_type != 'Ki' and act_type != 'IC50' and act_type != 'EC50':
-                        raise ValueError("Unrecognized ACT_TYPE: %s" % act_type)
-                pk_pki = PkPkiLink(pki=pki, pk=pk, act_val=act_value, pmid=pmid)
-                self._pk_pki_list.append(pk_pki)
-        logger.info("Ingested %d pk pki links with Kd data", len(self._pk_pki_list))
-
-    def _get_max_affinity_links(self, pk_pki, n_pki_limit: int) -> List:
-        if not isinstance(pk_pki, list):
-            raise ValueError("pk_pki must be a list")
-        if len(pk_pki) == 0:
-            raise ValueError("pk_pki cannot be empty")
-        if len(pk_pki) <= n_pki_limit:
-            # no problem, there are not too many PKIs
-            return pk_pki
-        # If we get here, then there are more PKs than desired at the indicated threshold
-        # We want to reduce the Kd threshold to get a smaller number of higher affinity PKI<->PK links
-        sorted_pk_pki = sorted(pk_pki)
-        return sorted_pk_pki[:n_pki_limit]
+        self._pk_pki_df = input_registry.get_drug_central_pk_pki_df(drug_central_pk_pki_file)
+        logger.info("Ingested %d pk pki links with Kd data", len(self._pk_pki_df))
+
+    def get_ranked_pk_pki(self, threshold: float = 0.03, ladder: List[float] = None) -> pd.DataFrame:
+        """
+        Compute the thresholded links of every PKI and the affinity rank of every PK within its PKI in one
+        vectorized pass.
+        A link is valid at a cutoff if its activity value is not higher than the cutoff or if there is no activity
+        value. If a ladder of increasing cutoffs is given (e.g., AFFINITY_LADDER), each PKI uses the first cutoff
+        (rung) at which it has at least one valid link; otherwise the ladder consists of the threshold only.
+        Return a data frame in the order of the DrugCentral file with the columns
+        pki, pk, act_value, rung (index of the cutoff used for the PKI), cutoff,
+        pk_rank (1 = highest affinity; links without activity value are ranked last),
+        n_pk_links (number of valid links of the PKI) and pk_position (1-based position of the link in the file
+        among the valid links of the PKI).
+        The links for any n_pki_limit are the links with pk_rank <= n_pki_limit, i.e., n_pki_limit values can
+        be compared by filtering on pk_rank instead of thresholding again
+        """
+        if ladder is None:
+            ladder = [threshold]
+        cutoffs = np.asarray(ladder, dtype=np.float64)
+        if len(cutoffs) == 0 or np.any(np.diff(cutoffs) <= 0):
+            raise ValueError("The affinity ladder must be a non-empty list of increasing cutoffs")
+        act_value = self._pk_pki_df['act_value'].values
+        # the first rung at which each link is valid (links without activity value are valid at every rung)
+        link_rung = np.searchsorted(cutoffs, act_value, side='left')
+        link_rung[np.isnan(act_value)] = 0
+        pki_rung = pd.Series(link_rung).groupby(self._pk_pki_df['pki'].values, sort=False).transform('min').values
+        selected = (link_rung <= pki_rung) & (pki_rung < len(cutoffs))
+        ranked = self._pk_pki_df.loc[selected, ['pki', 'pk', 'act_value']].reset_index(drop=True)
+        ranked['rung'] = pki_rung[selected].astype(np.int64)
+        ranked['cutoff'] = cutoffs[ranked['rung'].values]
+        by_pki = ranked.groupby('pki', sort=False)
+        ranked['n_pk_links'] = by_pki['pk'].transform('size').astype(np.int64)
+        ranked['pk_position'] = by_pki.cumcount().astype(np.int64) + 1
+        # stable sort: links with the same affinity keep the order of the file
+        by_affinity = ranked.sort_values(by='act_value', kind='mergesort', na_position='last')
+        ranked['pk_rank'] = by_affinity.groupby('pki', sort=False).cumcount().reindex(ranked.index).astype(np.int64) + 1
+        return ranked[['pki', 'pk', 'act_value', 'rung', 'cutoff', 'pk_rank', 'n_pk_links', 'pk_position']]
+
+    @staticmethod
+    def select_n_pk(ranked: pd.DataFrame, n_pki_limit: int) -> pd.DataFrame:
+        """
+        Select the links of a ranked table (see get_ranked_pk_pki) for the n_pki_limit, i.e., all links of PKIs with
+        at most n_pki_limit links (in file order) and the n_pki_limit links with the highest affinity of the other
+        PKIs (in order of affinity). The rows of each PKI stay together, in the order in which the PKIs appear
+        """
+        selected = ranked[ranked['pk_rank'] <= n_pki_limit]
+        order = np.where(selected['n_pk_links'] <= n_pki_limit, selected['pk_position'], selected['pk_rank'])
+        pki_order = pd.factorize(selected['pki'])[0]
+        return selected.iloc[np.lexsort((order, pki_order))]
+
+    def get_pk_pki_ladder(self, ladder: List[float] = None, n_pki_limits: List[int] = None) -> pd.DataFrame:
+        """
+        Return the thresholded PK/PKI links for an affinity ladder (default: AFFINITY_LADDER, i.e., 30 nM, 300 nM
+        and 3 uM) and several n_pki_limit values (default: [5]) as one table. The table has the columns of
+        get_ranked_pk_pki and a column n_pki_limit; the rows with n_pki_limit == n are the links for n.
+        """
+        if ladder is None:
+            ladder = AFFINITY_LADDER
+        if n_pki_limits is None:
+            n_pki_limits = [5]
+        ranked = self.get_ranked_pk_pki(ladder=ladder)
+        tables = [DrugCentralPkPkiParser.select_n_pk(ranked, n_pki_limit=n).assign(n_pki_limit=n)
+                  for n in n_pki_limits]
+        return pd.concat(tables, ignore_index=True)
 
     def get_pk_pki_with_threshold(self, n_pki_limit: int = 5, threshold: float = 0.03) -> Dict:
         """
@@ -146,20 +185,15 @@ class DrugCentralPkPkiParser:
         a PK and a cancer treated by that PKI becomes tenuous
         Return a map with entries like this {abemaciclib:[CDK4,CDK6]}
         """
-        valid_pki_dict = defaultdict(list)
-        for pk_pki in self._pk_pki_list:
-            if pk_pki.is_valid_or_not_provided(act_threshold=threshold):
-                valid_pki_dict[pk_pki.pki].append(pk_pki)
-        valid_pk_pki = []
+        ranked = self.get_ranked_pk_pki(threshold=threshold)
+        for pki, n_links in ranked.loc[ranked['n_pk_links'] > n_pki_limit, ['pki', 'n_pk_links']].drop_duplicates(
+                subset='pki').itertuples(index=False):
+            logger.warning("Adjusting threshold for PKI {} because it inhibits too many PKs ({})".format(pki, n_links))
+        selected = DrugCentralPkPkiParser.select_n_pk(ranked, n_pki_limit=n_pki_limit)
         thresholded_pk_pki = defaultdict(list)
-        for k, v in valid_pki_dict.items():
-            logger.info("Processing %s", k)
-            if len(v) > n_pki_limit:
-                logger.warning("Adjusting threshold for PKI {} because it inhibits too many PKs ({})".format(k, len(v)))
-                v = self._get_max_affinity_links(pk_pki=v, n_pki_limit=n_pki_limit)
-            thresholded_pk_pki[k] = [item.pk for item in v]
-            logger.info("PKI: %s, number of inhibited PKs %d", k, len(v))
-        logger.info("Extracted %d PKI<->PK interactions", len(valid_pk_pki))
+        for pki, pk in zip(selected['pki'], selected['pk']):
+            thresholded_pk_pki[pki].append(pk)
+        logger.info("Extracted %d PKI<->PK interactions", len(selected))
         return thresholded_pk_pki
 
     def get_all_pk_pki(self, threshold: float = 0.03) -> Dict:
@@ -169,10 +203,8 @@ class DrugCentralPkPkiParser:
         within the n_pki_limit used for training/historical validation or not
         Return a map with entries like this {abemaciclib:[CDK4,CDK6]}
         """
+        ranked = self.get_ranked_pk_pki(threshold=threshold)
         valid_pki_dict = defaultdict(list)
-        for pk_pki in self._pk_pki_list:
-            if pk_pki.is_valid_or_not_provided(act_threshold=threshold):
-                valid_pki_dict[pk_pki.pki].append(pk_pki.pk)
+        for pki, pk in zip(ranked['pki'], ranked['pk']):
+            valid_pki_dict[pki].append(pk)
         return valid_pki_dict
-
-
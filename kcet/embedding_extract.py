@@ -0,0 +1,69 @@
+from .kcet_parser import KcetParser
+from .embedding_store import EmbeddingStore
+
+import os
+import numpy as np
+import pandas as pd
+from typing import Tuple
+import logging
+
+logging.basicConfig(format='%(asctime)s,%(msecs)d %(levelname)-8s [%(filename)s:%(lineno)d] %(message)s',
+                    datefmt='%Y-%m-%d:%H:%M:%S',
+                    filename='kcet.log',
+                    level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# e.g., embedding_SG_dim100_upto2010.npy => embedding_SG_dim100_upto2010.kinase_cancer.npz
+EXTRACT_SUFFIX = '.kinase_cancer.npz'
+
+
+def get_extract_path(embeddings: str) -> str:
+    """
+    Return the default path of the kinase/cancer extract of an embedding file
+    """
+    return os.path.splitext(embeddings)[0] + EXTRACT_SUFFIX
+
+
+def _coverage_row(category: str, requested: list, found: np.ndarray) -> dict:
+    n_requested = len(requested)
+    n_found = int(np.sum(found))
+    missing = [w for w, ok in zip(requested, found) if not ok]
+    if len(missing) > 0:
+        logger.info("Could not find %d %s ids in the embeddings, e.g., %s" % (len(missing), category, missing[0]))
+    return {'category': category,
+            'requested': n_requested,
+            'found': n_found,
+            'missing': n_requested - n_found,
+            'coverage': n_found / n_requested if n_requested > 0 else 0.0}
+
+
+def extract_kinase_cancer_embeddings(embeddings: str, words: str, extract: str = None,
+                                     overwrite: bool = False) -> Tuple[str, pd.DataFrame]:
+    """
+    The classifier only uses the embeddings of the protein kinases (ncbigene ids from input/prot_kinase.tsv)
+    and cancers (meshd ids from input/neoplasms_labels.tsv), i.e., about 1,200 of the about 293,000 rows.
+    This function writes these rows to a compact extract that KcetDatasetGenerator can load instead of the full
+    embedding. An existing extract is reused if it was made from the same embedding and words files.
+    Return the path of the extract and a data frame with the coverage of kinases and cancers by the embedding
+    """
+    if extract is None:
+        extract = get_extract_path(embeddings)
+    kcet_parser = KcetParser()
+    kinase_ids = list(dict.fromkeys(kcet_parser.get_symbol_to_id_map().values()))
+    mesh_ids = list(dict.fromkeys(kcet_parser.get_mesh_id_list()))
+    found = None
+    if os.path.exists(extract) and not overwrite:
+        try:
+            # validated with the recorded modification times and sizes, so a warm run does not hash the embeddings
+            extract_store = EmbeddingStore.from_extract(extract, embeddings=embeddings, words=words)
+            logger.info("Reusing embedding extract at %s" % extract)
+            found = extract_store.get_row_indices(kinase_ids + mesh_ids) >= 0
+        except ValueError:
+            logger.info("Rebuilding stale embedding extract %s" % extract)
+    if found is None:
+        store = EmbeddingStore(embeddings=embeddings, words=words)
+        found = store.write_extract(words=kinase_ids + mesh_ids, extract=extract)
+    n_kinases = len(kinase_ids)
+    coverage = [_coverage_row('protein kinase', kinase_ids, found[:n_kinases]),
+                _coverage_row('cancer', mesh_ids, found[n_kinases:])]
+    return extract, pd.DataFrame(coverage)
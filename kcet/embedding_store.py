@@ -0,0 +1,341 @@
+import os
+import hashlib
+import numpy as np
+import pandas as pd
+from typing import List, Iterable, Iterator, Tuple
+import logging
+
+logging.basicConfig(format='%(asctime)s,%(msecs)d %(levelname)-8s [%(filename)s:%(lineno)d] %(message)s',
+                    datefmt='%Y-%m-%d:%H:%M:%S',
+                    filename='kcet.log',
+                    level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# The compiled vocabulary is written next to the embedding file, e.g., embedding_SG_dim100_upto2010.vocab.npz
+VOCABULARY_SUFFIX = '.vocab.npz'
+
+
+def read_words_file(words: str) -> List[str]:
+    """
+    Read the words file that accompanies an embedding file (e.g., words_SG_upto2010.txt).
+    Each line holds one word/concept label; the label is the slice line[2:-3] of the line.
+    The i'th word labels the i'th row of the embedding matrix.
+    """
+    word_list = []
+    with open(words) as f:
+        for line in f:
+            word = line[2:-3]
+            word_list.append(word)
+    return word_list
+
+
+def encode_words(words: Iterable[str]) -> np.ndarray:
+    """
+    Encode words as a NumPy bytes array (UTF-8), which is the representation we use for the vocabulary index
+    """
+    return np.array([w.encode('utf-8') for w in words], dtype=np.bytes_)
+
+
+def get_vocabulary_path(embeddings: str) -> str:
+    """
+    Return the path of the compiled vocabulary sidecar that belongs to an embedding file
+    """
+    return os.path.splitext(embeddings)[0] + VOCABULARY_SUFFIX
+
+
+def file_checksum(path: str, block_size: int = 1 << 20) -> str:
+    """
+    Return the SHA-1 hex digest of a file, read in blocks of block_size bytes
+    """
+    sha = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def get_source_checksum(embeddings: str, words: str = None) -> str:
+    """
+    Return a checksum that identifies an embedding file and (if given) its words file
+    """
+    checksum = file_checksum(embeddings)
+    if words is not None:
+        checksum = hashlib.sha1((checksum + file_checksum(words)).encode('ascii')).hexdigest()
+    return checksum
+
+
+def get_source_stamp(embeddings: str, words: str = None) -> np.ndarray:
+    """
+    Return the modification time (ns) and size of an embedding file and (if given) its words file. An extract
+    records the stamp of its source files, so that it can be validated without reading them (see from_extract)
+    """
+    stamp = []
+    for path in (embeddings, words):
+        if path is not None:
+            st = os.stat(path)
+            stamp.extend([st.st_mtime_ns, st.st_size])
+    return np.array(stamp, dtype=np.int64)
+
+
+def iter_row_blocks(embeddings: str, block_rows: int = 65536) -> Iterator[Tuple[int, np.ndarray]]:
+    """
+    Read the rows of an embedding file (.npy) in blocks of block_rows rows with plain file reads into one reused
+    buffer, so that memory use does not depend on the size of the file (unlike a memory map, whose pages stay
+    resident). Yield (first row, block) for each block; the block is overwritten by the next block, so it must be
+    copied if it is to be kept
+    """
+    if block_rows < 1:
+        raise ValueError("block_rows must be at least 1 but was %d" % block_rows)
+    with open(embeddings, 'rb') as f:
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        if len(shape) != 2 or fortran_order or dtype.hasobject:
+            raise ValueError("Expected a two-dimensional C-order numeric array in %s" % embeddings)
+        n_rows, dimension = shape
+        buffer = np.empty((min(block_rows, n_rows), dimension), dtype=dtype)
+        for start in range(0, n_rows, block_rows):
+            block = buffer[:min(block_rows, n_rows - start)]
+            if f.readinto(memoryview(block).cast('B')) != block.nbytes:
+                raise ValueError("Unexpected end of file in %s" % embeddings)
+            yield start, block
+
+
+def _build_vocabulary_index(word_array: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Sort the vocabulary and return the sorted words together with the row of each sorted word.
+    A stable sort guarantees that a duplicated word resolves to its first row
+    """
+    sorted_rows = np.argsort(word_array, kind='stable')
+    return word_array[sorted_rows], sorted_rows
+
+
+def compile_vocabulary(embeddings: str, words: str, vocabulary: str = None) -> str:
+    """
+    Parse the words file once and write a binary vocabulary sidecar next to the embedding file.
+    The sidecar holds the sorted vocabulary (UTF-8 bytes array), the embedding row of each sorted word,
+    the number of rows and the SHA-1 checksum of the words file, which is used to detect a stale sidecar.
+    EmbeddingStore uses the sidecar automatically if it is present.
+    Return the path of the sidecar
+    """
+    if not os.path.exists(embeddings):
+        raise FileNotFoundError("Could not find embedding file at %s" % embeddings)
+    if not os.path.exists(words):
+        raise FileNotFoundError("Could not find words file at %s" % words)
+    if vocabulary is None:
+        vocabulary = get_vocabulary_path(embeddings)
+    n_rows = np.load(embeddings, mmap_mode='r', allow_pickle=False).shape[0]
+    word_array = encode_words(read_words_file(words))
+    if len(word_array) != n_rows:
+        raise ValueError("Number of words (%d) in %s does not match number of embeddings (%d) in %s" % (
+            len(word_array), words, n_rows, embeddings))
+    sorted_words, sorted_rows = _build_vocabulary_index(word_array)
+    # write to an open file handle so that numpy does not append a second .npz suffix
+    with open(vocabulary, 'wb') as f:
+        np.savez(f, sorted_words=sorted_words, sorted_rows=sorted_rows, n_rows=np.int64(n_rows),
+                 words_checksum=np.array(file_checksum(words)))
+    logger.info("Wrote compiled vocabulary with %d words to %s" % (n_rows, vocabulary))
+    return vocabulary
+
+
+def load_vocabulary(vocabulary: str, words: str, n_rows: int):
+    """
+    Load a compiled vocabulary sidecar in one bulk read.
+    Return the sorted words and their rows, or None if the sidecar does not match the words file or embedding
+    """
+    with np.load(vocabulary, allow_pickle=False) as data:
+        if str(data['words_checksum']) != file_checksum(words):
+            logger.warning("Ignoring stale vocabulary %s (checksum does not match %s)" % (vocabulary, words))
+            return None
+        if int(data['n_rows']) != n_rows:
+            logger.warning("Ignoring vocabulary %s (%d rows, but the embedding has %d)" % (
+                vocabulary, int(data['n_rows']), n_rows))
+            return None
+        return data['sorted_words'], data['sorted_rows']
+
+
+class EmbeddingStore:
+    """
+    Read-only store for the word/concept embeddings produced by embiggen (e.g., embedding_SG_dim100_upto2010.npy).
+    The embedding matrix is memory-mapped rather than read into RAM, so that construction is nearly instantaneous
+    and several processes that open the same file share the same pages. Words are mapped to row numbers by
+    a sorted vocabulary array that is searched with np.searchsorted, which lets us resolve batches of words
+    to row indices without a Python loop. If a compiled vocabulary (see compile_vocabulary) is found next to
+    the embedding file, the sorted vocabulary is read from it instead of parsing the words file.
+    A store can also be loaded from a compact extract of selected rows (see write_extract and from_extract).
+    Attributes:
+        _matrix  read-only memory-mapped embedding matrix (n_words x dimension)
+        _sorted_words  vocabulary (UTF-8 bytes) in sorted order
+        _sorted_rows  row of the embedding matrix for each entry of _sorted_words
+    """
+
+    def __init__(self, embeddings: str, words: str) -> None:
+        if not os.path.exists(embeddings):
+            raise FileNotFoundError("Could not find embedding file at %s" % embeddings)
+        if not os.path.exists(words):
+            raise FileNotFoundError("Could not find words file at %s" % words)
+        self._embeddings_path = embeddings
+        self._words_path = words
+        self._matrix = np.load(embeddings, mmap_mode='r', allow_pickle=False)
+        if self._matrix.ndim != 2:
+            raise ValueError("Expected a two-dimensional embedding matrix in %s but got shape %s" % (
+                embeddings, str(self._matrix.shape)))
+        n_rows = self._matrix.shape[0]
+        index = None
+        vocabulary = get_vocabulary_path(embeddings)
+        if os.path.exists(vocabulary):
+            index = load_vocabulary(vocabulary=vocabulary, words=words, n_rows=n_rows)
+            if index is not None:
+                logger.info("Read compiled vocabulary from %s" % vocabulary)
+        if index is None:
+            word_array = encode_words(read_words_file(words))
+            if len(word_array) != n_rows:
+                raise ValueError("Number of words (%d) in %s does not match number of embeddings (%d) in %s" % (
+                    len(word_array), words, n_rows, embeddings))
+            index = _build_vocabulary_index(word_array)
+        self._sorted_words, self._sorted_rows = index
+        self._words = None
+        self._checksum = None
+        logger.info("Memory-mapped %d x %d embeddings from %s" % (
+            self._matrix.shape[0], self._matrix.shape[1], embeddings))
+
+    @classmethod
+    def from_extract(cls, extract: str, embeddings: str = None, words: str = None) -> 'EmbeddingStore':
+        """
+        Load a store from an extract written by write_extract. Extracts are small, so the matrix is read into RAM.
+        If the embedding (and words) file that the extract was made from are given, raise a ValueError if the extract
+        is stale, i.e., if its recorded source checksum differs from that of these files. The files are only hashed
+        if their modification time or size differ from the ones recorded in the extract. Without them, the extract
+        is not validated, and the caller must make sure that it belongs to the intended embeddings
+        """
+        if not os.path.exists(extract):
+            raise FileNotFoundError("Could not find embedding extract at %s" % extract)
+        with np.load(extract, allow_pickle=False) as data:
+            matrix = data['matrix']
+            word_array = data['words']
+            source_checksum = str(data['source_checksum'])
+            source_stamp = data['source_stamp'] if 'source_stamp' in data.files else None
+        if embeddings is not None:
+            stamp = get_source_stamp(embeddings, words)
+            if (source_stamp is None or not np.array_equal(source_stamp, stamp)) and \
+                    source_checksum != get_source_checksum(embeddings, words):
+                raise ValueError("Embedding extract %s was not made from %s" % (extract, embeddings))
+        if matrix.shape[0] != len(word_array):
+            raise ValueError("Malformed embedding extract %s (%d rows, %d words)" % (
+                extract, matrix.shape[0], len(word_array)))
+        matrix.setflags(write=False)
+        store = cls.__new__(cls)
+        store._embeddings_path = extract
+        store._words_path = None
+        store._matrix = matrix
+        store._sorted_words, store._sorted_rows = _build_vocabulary_index(word_array)
+        store._words = None
+        store._checksum = None
+        logger.info("Loaded %d x %d embeddings from extract %s" % (matrix.shape[0], matrix.shape[1], extract))
+        return store
+
+    def write_extract(self, words: Iterable[str], extract: str) -> np.ndarray:
+        """
+        Write the rows of the given words to a compact extract file that can be loaded with from_extract.
+        Words that are not in the vocabulary are skipped. The extract records the checksums of the source files.
+        Return a boolean array that indicates which of the words were found
+        """
+        words = list(words)
+        rows = self.get_row_indices(words)
+        found = rows >= 0
+        with open(extract, 'wb') as f:
+            np.savez(f, matrix=np.ascontiguousarray(self._matrix[rows[found]]),
+                     words=encode_words([w for w, ok in zip(words, found) if ok]),
+                     source_checksum=np.array(self.get_source_checksum()),
+                     source_stamp=get_source_stamp(self._embeddings_path, self._words_path))
+        logger.info("Wrote extract with %d/%d words to %s" % (int(np.sum(found)), len(words), extract))
+        return found
+
+    def get_source_checksum(self) -> str:
+        """
+        Return a checksum that identifies the embedding and words files that this store was loaded from
+        """
+        if self._checksum is None:
+            self._checksum = get_source_checksum(self._embeddings_path, self._words_path)
+        return self._checksum
+
+    def __len__(self) -> int:
+        return self._matrix.shape[0]
+
+    def __contains__(self, word: str) -> bool:
+        return self.get_row_indices([word])[0] >= 0
+
+    @property
+    def dimension(self) -> int:
+        return self._matrix.shape[1]
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """
+        The read-only, memory-mapped embedding matrix
+        """
+        return self._matrix
+
+    @property
+    def words(self) -> np.ndarray:
+        """
+        Return the vocabulary (str) in the order of the rows of the embedding matrix
+        """
+        if self._words is None:
+            word_array = np.empty_like(self._sorted_words)
+            word_array[self._sorted_rows] = self._sorted_words
+            self._words = np.char.decode(word_array, 'utf-8')
+        return self._words
+
+    def get_row_indices(self, words: Iterable[str]) -> np.ndarray:
+        """
+        Resolve words to rows of the embedding matrix in one vectorized pass.
+        Return an int64 array with the row of each word, or -1 if the word is not in the vocabulary
+        """
+        keys = encode_words(words)
+        if len(keys) == 0 or len(self._sorted_words) == 0:
+            return np.full(len(keys), -1, dtype=np.int64)
+        pos = np.searchsorted(self._sorted_words, keys)
+        pos = np.minimum(pos, len(self._sorted_words) - 1)
+        found = self._sorted_words[pos] == keys
+        return np.where(found, self._sorted_rows[pos], -1).astype(np.int64)
+
+    def get_vector(self, word: str) -> np.ndarray:
+        """
+        Return the embedding of a single word as a (zero-copy) view of the memory-mapped matrix
+        """
+        row = self.get_row_indices([word])[0]
+        if row < 0:
+            raise KeyError("Could not find '%s' in the embeddings" % word)
+        return self._matrix[row]
+
+    def get_vectors(self, words: Iterable[str]) -> np.ndarray:
+        """
+        Return the embeddings of a batch of words as an n_words x dimension array. The rows are gathered from
+        the memory-mapped matrix; only the pages that contain the requested rows are read.
+        Raises a KeyError if any of the words are not in the vocabulary
+        """
+        words = list(words)
+        rows = self.get_row_indices(words)
+        if np.any(rows < 0):
+            missing = [w for w, r in zip(words, rows) if r < 0]
+            raise KeyError("Could not find %d words in the embeddings, e.g., '%s'" % (len(missing), missing[0]))
+        return self.get_rows(rows)
+
+    def get_rows(self, rows: np.ndarray) -> np.ndarray:
+        """
+        Return the rows of the embedding matrix with the given indices. A contiguous range of rows is returned
+        as a view of the memory-mapped file, other index sets are gathered into a new array.
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        if len(rows) > 0 and np.all(np.diff(rows) == 1):
+            return self._matrix[rows[0]:rows[-1] + 1]
+        return self._matrix[rows]
+
+    def to_data_frame(self) -> pd.DataFrame:
+        """
+        return a Pandas dataframe whose index is the words, and whose columns are the dimensions of the embeddings
+        """
+        return pd.DataFrame(data=self._matrix, index=self.words)
@@ -0,0 +1,145 @@
+import os
+import tempfile
+import numpy as np
+import joblib
+from contextlib import contextmanager
+
+
+class ExecutionConfig:
+    """
+    Settings for parallel execution with joblib that are shared by the classes that train or score models.
+    Attributes:
+        _n_jobs  number of parallel jobs (None: one job, -1: all cores). For the random forest, this parallelizes the
+                 hyperparameter search (candidates x folds), while each forest is trained with one job, so that the
+                 two levels do not oversubscribe the machine. Scoring uses n_jobs workers (see universe_scorer)
+        _backend  joblib backend ('loky', 'threading' or 'multiprocessing'; None: the joblib default)
+        _pre_dispatch  number of jobs that are dispatched ahead of time, e.g., '2*n_jobs'
+        _mmap_data  if True, large input matrices are written to a file and memory-mapped, so that worker processes
+                    share one copy instead of receiving a pickled copy each
+        _temp_folder  folder for the memory-mapped files (None: the system temporary folder)
+        _n_iter  number of parameter settings that are sampled in the hyperparameter search
+        _cv  number of cross-validation folds of the hyperparameter search
+        _random_state  seed of the hyperparameter search
+        _search  'random' (randomized search with n_iter candidates) or 'halving' (successive halving: many candidates
+                 are evaluated with few resources and only the best are promoted to the next rung)
+        _halving_factor  proportion of candidates that are promoted in each rung of the successive halving (1/factor)
+        _halving_resource  resource that is increased from rung to rung, 'n_samples' (fraction of the training data)
+                           or 'n_estimators' (number of trees)
+    """
+
+    def __init__(self, n_jobs: int = None, backend: str = None, pre_dispatch: str = '2*n_jobs',
+                 mmap_data: bool = False, temp_folder: str = None, n_iter: int = 1, cv: int = 10,
+                 random_state: int = 42, search: str = 'random', halving_factor: int = 3,
+                 halving_resource: str = 'n_samples') -> None:
+        if backend is not None and backend not in ('loky', 'threading', 'multiprocessing'):
+            raise ValueError("Unrecognized joblib backend: %s" % backend)
+        if n_iter < 1:
+            raise ValueError("n_iter must be at least 1 but was %d" % n_iter)
+        if cv < 2:
+            raise ValueError("cv must be at least 2 but was %d" % cv)
+        if search not in ('random', 'halving'):
+            raise ValueError("Unrecognized search mode: %s (must be 'random' or 'halving')" % search)
+        if halving_factor < 2:
+            raise ValueError("halving_factor must be at least 2 but was %d" % halving_factor)
+        if halving_resource not in ('n_samples', 'n_estimators'):
+            raise ValueError("Unrecognized halving resource: %s" % halving_resource)
+        self._n_jobs = n_jobs
+        self._backend = backend
+        self._pre_dispatch = pre_dispatch
+        self._mmap_data = mmap_data
+        self._temp_folder = temp_folder
+        self._n_iter = n_iter
+        self._cv = cv
+        self._random_state = random_state
+        self._search = search
+        self._halving_factor = halving_factor
+        self._halving_resource = halving_resource
+
+    @property
+    def n_jobs(self) -> int:
+        return self._n_jobs
+
+    @property
+    def n_workers(self) -> int:
+        """
+        Number of workers for n_jobs in the scikit-learn convention (None: 1, -1: all cores, -2: all cores but one, ...)
+        """
+        if self._n_jobs is None:
+            return 1
+        if self._n_jobs < 0:
+            return max(1, (os.cpu_count() or 1) + 1 + self._n_jobs)
+        return max(1, self._n_jobs)
+
+    @property
+    def backend(self) -> str:
+        return self._backend
+
+    @property
+    def pre_dispatch(self) -> str:
+        return self._pre_dispatch
+
+    @property
+    def mmap_data(self) -> bool:
+        return self._mmap_data
+
+    @property
+    def temp_folder(self) -> str:
+        return self._temp_folder
+
+    @property
+    def n_iter(self) -> int:
+        return self._n_iter
+
+    @property
+    def cv(self) -> int:
+        return self._cv
+
+    @property
+    def random_state(self) -> int:
+        return self._random_state
+
+    @property
+    def search(self) -> str:
+        return self._search
+
+    @property
+    def halving_factor(self) -> int:
+        return self._halving_factor
+
+    @property
+    def halving_resource(self) -> str:
+        return self._halving_resource
+
+    @contextmanager
+    def parallel_backend(self):
+        """
+        Context in which scikit-learn (and joblib) use the backend of this configuration
+        """
+        if self._backend is None:
+            yield
+        else:
+            with joblib.parallel_backend(self._backend, n_jobs=self._n_jobs):
+                yield
+
+    @contextmanager
+    def shared_array(self, X: np.ndarray):
+        """
+        Context that provides X as a read-only memory-mapped array if mmap_data is True (the file is deleted when
+        the context is left), and X itself otherwise
+        """
+        if not self._mmap_data:
+            yield X
+            return
+        with tempfile.TemporaryDirectory(dir=self._temp_folder) as tmpdir:
+            path = os.path.join(tmpdir, 'data.joblib')
+            joblib.dump(np.ascontiguousarray(X), path)
+            X_mmap = joblib.load(path, mmap_mode='r')
+            try:
+                yield X_mmap
+            finally:
+                del X_mmap
+
+    def __str__(self) -> str:
+        return "ExecutionConfig(n_jobs=%s, backend=%s, pre_dispatch=%s, mmap_data=%s, n_iter=%d, cv=%d, search=%s)" % (
+            str(self._n_jobs), str(self._backend), str(self._pre_dispatch), str(self._mmap_data), self._n_iter,
+            self._cv, self._search)
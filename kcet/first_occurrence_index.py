@@ -0,0 +1,73 @@
+from .link_set import KinaseCancerGrid, LinkSet
+
+import numpy as np
+import pandas as pd
+
+PHASES = ['Phase 1', 'Phase 2', 'Phase 3', 'Phase 4']
+# Marks kinase/cancer/phase combinations that were never tested in a clinical trial
+NEVER = np.iinfo(np.uint16).max
+
+
+class FirstOccurrenceIndex:
+    """
+    Dense index of the earliest clinical trial year of every kinase/cancer pair by phase.
+    The index is a uint16 array with shape (kinases, cancers, phases) whose entries are the start year of the
+    first trial of the pair in the phase, or NEVER if there was no such trial. With the index, queries such as
+    "all positive links up to year Y" or "new positive links in the years a..b" are single vectorized comparisons.
+    Attributes:
+        _grid  the kinase/cancer grid that defines the first two axes of the index
+        _years  uint16 array (n_kinases x n_cancers x 4) with the earliest trial year per phase
+    """
+
+    def __init__(self, grid: KinaseCancerGrid, links: pd.DataFrame) -> None:
+        """
+        :param grid: the kinase/cancer grid
+        :param links: data frame with the columns gene_id, mesh_id, phase and year (one row per trial and kinase)
+        """
+        for column in ['gene_id', 'mesh_id', 'phase', 'year']:
+            if column not in links.columns:
+                raise ValueError("Input dataframe must contain a column called %s" % column)
+        self._grid = grid
+        self._years = np.full((grid.n_kinases, grid.n_cancers, len(PHASES)), NEVER, dtype=np.uint16)
+        pair_ids = grid.encode(gene_ids=links['gene_id'].values, mesh_ids=links['mesh_id'].values)
+        phase_idx = pd.Categorical(links['phase'], categories=PHASES).codes
+        years = links['year'].values.astype(np.int64)
+        if np.any((years < 0) | (years >= NEVER)):
+            raise ValueError("Trial years must be between 0 and %d" % (NEVER - 1))
+        keep = (pair_ids >= 0) & (phase_idx >= 0)
+        flat_years = self._years.reshape(-1, len(PHASES))
+        np.minimum.at(flat_years, (pair_ids[keep], phase_idx[keep]), years[keep].astype(np.uint16))
+
+    @property
+    def grid(self) -> KinaseCancerGrid:
+        return self._grid
+
+    @property
+    def years(self) -> np.ndarray:
+        return self._years
+
+    def get_first_years(self, phase4: bool = False) -> np.ndarray:
+        """
+        Return a (kinases x cancers) array with the earliest trial year of each pair in any phase,
+        or in phase 4 only if phase4 is True
+        """
+        if phase4:
+            return self._years[:, :, PHASES.index('Phase 4')]
+        return self._years.min(axis=2)
+
+    def get_links_up_to(self, year: int, phase4: bool = False) -> LinkSet:
+        """
+        Return all links with a trial (of any phase, or of phase 4 if phase4 is True) that started up to and
+        including the year
+        """
+        return LinkSet.from_mask(grid=self._grid, mask=self.get_first_years(phase4=phase4) <= year)
+
+    def get_new_links(self, target_year: int, begin_year: int, end_year: int, phase4: bool = False) -> LinkSet:
+        """
+        Return the links whose first trial (of any phase, or of phase 4 if phase4 is True) started between
+        begin_year and end_year (inclusive), excluding links with a trial of any phase up to the target year
+        """
+        first_years = self.get_first_years(phase4=phase4)
+        in_window = (first_years >= begin_year) & (first_years <= end_year)
+        known_at_target = self.get_first_years(phase4=False) <= target_year
+        return LinkSet.from_mask(grid=self._grid, mask=in_window & ~known_at_target)
@@ -0,0 +1,222 @@
+from . import snapshot_cache
+
+import os
+import csv
+import threading
+import numpy as np
+import pandas as pd
+from types import MappingProxyType
+from typing import Callable, List, Tuple
+import logging
+
+logging.basicConfig(format='%(asctime)s,%(msecs)d %(levelname)-8s [%(filename)s:%(lineno)d] %(message)s',
+                    datefmt='%Y-%m-%d:%H:%M:%S',
+                    filename='kcet.log',
+                    level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+PROT_KINASE_TSV = 'prot_kinase.tsv'
+NEOPLASMS_LABELS_TSV = 'neoplasms_labels.tsv'
+TARGET_LEVEL_TSV = 'target_develop_levels.tsv.csv'
+DRUG_CENTRAL_PK_PKI = 'DrugCentralPKIPK.csv'
+
+
+def get_input_path(filename: str) -> str:
+    """
+    Return the path of a file in the ``input`` subfolder of the project
+    """
+    d = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return os.path.join(d, 'input', filename)
+
+
+class InputRegistry:
+    """
+    Process-wide cache of parsed input files. Each file is parsed once per process and the result is shared by
+    all callers (KcetParser, CTParserByPhase, DrugCentralPkPkiParser). Entries are keyed by the real path of the
+    file and the name of the loader, and are re-parsed if the modification time or size of the file changes.
+    The cached values are immutable (MappingProxyType, tuple) or pandas DataFrames, which are returned as copies so
+    that a caller that modifies its table does not change the cached one.
+    Tables can additionally be stored in an on-disk snapshot cache that is shared between processes.
+    Attributes:
+        _entries  map from (path, loader name) to (file stamps, parsed value)
+        _n_parsed  number of times a loader was run, i.e., number of cache misses
+    """
+
+    def __init__(self) -> None:
+        self._entries = {}
+        self._n_parsed = 0
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def _get_stamp(path: str) -> Tuple[int, int]:
+        if not os.path.exists(path):
+            raise FileNotFoundError("Could not find file at %s" % path)
+        st = os.stat(path)
+        return st.st_mtime_ns, st.st_size
+
+    def get(self, path: str, loader: Callable, snapshot: bool = False, dependencies: List[str] = None):
+        """
+        Return the value loader(path), parsing the file only if it was not parsed before or has changed since.
+        If snapshot is True, the loader returns a data frame that is also stored in the on-disk snapshot cache
+        (if enabled, see snapshot_cache), so that other processes can read it instead of parsing the file.
+        dependencies are other files that the loader reads; the value is rebuilt if any of them change.
+        A data frame is returned as a copy of the cached one
+        """
+        path = os.path.realpath(path)
+        key = (path, loader.__name__)
+        sources = [path] + [os.path.realpath(d) for d in (dependencies or [])]
+        stamp = tuple(InputRegistry._get_stamp(s) for s in sources)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == stamp:
+                return InputRegistry._copy(entry[1])
+            logger.info("Parsing %s with %s" % (path, loader.__name__))
+            if snapshot:
+                value = snapshot_cache.get_frame(name=loader.__name__, sources=sources, builder=lambda: loader(path))
+            else:
+                value = loader(path)
+            self._entries[key] = (stamp, value)
+            self._n_parsed += 1
+            return InputRegistry._copy(value)
+
+    @staticmethod
+    def _copy(value):
+        return value.copy() if isinstance(value, pd.DataFrame) else value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    @property
+    def n_parsed(self) -> int:
+        return self._n_parsed
+
+
+_REGISTRY = InputRegistry()
+
+
+def get_registry() -> InputRegistry:
+    return _REGISTRY
+
+
+def _mesh_to_meshd(mesh: str) -> str:
+    """
+    e.g., D000008 => meshd000008
+    """
+    return "mesh" + mesh[0].lower() + mesh[1:]
+
+
+def parse_prot_kinase(path: str) -> pd.DataFrame:
+    """
+    parse prot_kinase.tsv and map gene symbols to ncbigene ids
+    e.g., for the line
+    CDK20	cyclin dependent kinase 20	23552	ENSG00000156345
+    we would have the row symbol=CDK20, gene_id=ncbigene23552
+    Return a data frame with the columns symbol and gene_id
+    """
+    rows = []
+    with open(path) as f:
+        # Note this file has no header
+        for line in f:
+            fields = line.rstrip().split('\t')
+            if len(fields) != 4:
+                # should never happen
+                raise ValueError("Malformed line: %s" % line)
+            sym = fields[0].strip()
+            ncbigene = fields[2].strip()
+            # We add "ncbigene" because in pubmed_cr.tsv, genes are represented in this way
+            rows.append((sym, "ncbigene" + ncbigene))
+    return pd.DataFrame.from_records(rows, columns=['symbol', 'gene_id'])
+
+
+def parse_neoplasms_labels(path: str) -> pd.DataFrame:
+    """
+    parse neoplasms_labels.tsv
+    Return a data frame with the columns mesh_id and disease in file order, e.g., meshd000008, Abdominal Neoplasms
+    """
+    mesh_disease = []
+    with open(path) as f:
+        for line in f:
+            fields = line.rstrip().split('\t')
+            if len(fields) < 2 or len(fields) > 3:
+                # At a minimum, there is MeSH id and label. Most lines have a third field (synonyms)
+                raise ValueError("Bad line in neoplasms_labels,tsv file: %s" % line)
+            mesh_disease.append((_mesh_to_meshd(fields[0]), fields[1]))
+    return pd.DataFrame.from_records(mesh_disease, columns=['mesh_id', 'disease'])
+
+
+def parse_target_level(path: str) -> pd.DataFrame:
+    """
+    Read the target development level file that relates proteins to the levels Tdark, Tchem, Tbio, Tclin
+    """
+    predictions = pd.read_csv(path, sep="\t")
+    columns = ['Sym', 'UniProt', 'Description', 'GeneID', 'TDL']
+    return predictions[columns]
+
+
+def parse_drug_central_pk_pki(path: str) -> pd.DataFrame:
+    """
+    parse the DrugCentral PK/PKI file
+    Return a data frame with the columns pki, pk, act_value (micromolar, NaN if not provided) and pmid
+    """
+    with open(path) as f:
+        rdr = csv.DictReader(f, delimiter='\t')
+        rows = []
+        for row in rdr:
+            act_type = row['ACT_TYPE']
+            if act_type is not None and len(act_type) > 1:
+                if act_type not in ('Kd', 'Ki', 'IC50', 'EC50'):
+                    raise ValueError("Unrecognized ACT_TYPE: %s" % act_type)
+            act_value = row['ACT_VALUE (uM)']
+            rows.append((row['PKI'], row['PK'], np.nan if act_value == '' else float(act_value), row['PMID']))
+    return pd.DataFrame.from_records(rows, columns=['pki', 'pk', 'act_value', 'pmid'])
+
+
+def _symbol_to_id_map(path: str) -> MappingProxyType:
+    kinases = _REGISTRY.get(path, parse_prot_kinase, snapshot=True)
+    return MappingProxyType(dict(zip(kinases['symbol'], kinases['gene_id'])))
+
+
+def _mesh_disease_pairs(path: str) -> Tuple[Tuple[str, str], ...]:
+    neoplasms = _REGISTRY.get(path, parse_neoplasms_labels, snapshot=True)
+    return tuple(zip(neoplasms['mesh_id'], neoplasms['disease']))
+
+
+def get_symbol_to_id_map(path: str = None) -> MappingProxyType:
+    """
+    Return the shared, read-only map from gene symbols to NCBI gene ids, e.g., {'CDK20': 'ncbigene23552'}
+    """
+    return _REGISTRY.get(path or get_input_path(PROT_KINASE_TSV), _symbol_to_id_map)
+
+
+def get_mesh_disease_pairs(path: str = None) -> Tuple[Tuple[str, str], ...]:
+    """
+    Return the shared tuple of (MeSH id, disease) pairs of the cancers in neoplasms_labels.tsv
+    """
+    return _REGISTRY.get(path or get_input_path(NEOPLASMS_LABELS_TSV), _mesh_disease_pairs)
+
+
+def get_target_level_df(path: str = None) -> pd.DataFrame:
+    """
+    Return a copy of the cached target development level table
+    """
+    return _REGISTRY.get(path or get_input_path(TARGET_LEVEL_TSV), parse_target_level, snapshot=True)
+
+
+def get_drug_central_pk_pki_df(path: str = None) -> pd.DataFrame:
+    """
+    Return a copy of the cached table of DrugCentral PK/PKI links
+    """
+    return _REGISTRY.get(path or get_input_path(DRUG_CENTRAL_PK_PKI), parse_drug_central_pk_pki, snapshot=True)
+
+
+def _parse_symbol_to_tdl(path: str) -> MappingProxyType:
+    predictions = get_target_level_df(path)
+    return MappingProxyType(dict(zip(predictions['Sym'], predictions['TDL'])))
+
+
+def get_symbol_to_tdl_map(path: str = None) -> MappingProxyType:
+    """
+    Return the shared, read-only map from gene symbols to target development levels, e.g., {'CDK20': 'Tchem'}
+    """
+    return _REGISTRY.get(path or get_input_path(TARGET_LEVEL_TSV), _parse_symbol_to_tdl)
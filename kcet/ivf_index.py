@@ -0,0 +1,179 @@
+import os
+import json
+import numpy as np
+from typing import Tuple
+import logging
+
+logging.basicConfig(format='%(asctime)s,%(msecs)d %(levelname)-8s [%(filename)s:%(lineno)d] %(message)s',
+                    datefmt='%Y-%m-%d:%H:%M:%S',
+                    filename='kcet.log',
+                    level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# Increment if the layout of the saved index changes
+IVF_INDEX_VERSION = 1
+IVF_INDEX_METADATA = 'index.json'
+# number of rows that are assigned to centroids at once while building the index
+ASSIGN_BLOCK_SIZE = 65536
+
+
+def _assign(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """
+    Return the index of the most similar centroid (highest inner product) of each vector, in blocks of rows
+    """
+    labels = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), ASSIGN_BLOCK_SIZE):
+        block = slice(start, start + ASSIGN_BLOCK_SIZE)
+        labels[block] = np.argmax(np.asarray(vectors[block], dtype=np.float32) @ centroids.T, axis=1)
+    return labels
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+class IvfIndex:
+    """
+    Approximate nearest-neighbour index for cosine similarity (inverted file, IVF) in pure NumPy.
+    The unit-length vectors are clustered with spherical k-means into n_lists lists; a query is compared with the
+    centroids, and only the vectors of the n_probe most similar lists are scored exactly. More probes give higher
+    recall at the cost of more work (n_probe = n_lists is an exact search).
+    The vectors are stored grouped by list, so that the vectors of a list are contiguous, and a saved index can be
+    memory-mapped (see save and load).
+    Attributes:
+        _centroids  unit-length centroids (n_lists x dimension, float32)
+        _offsets  the vectors of list i are _vectors[_offsets[i]:_offsets[i+1]] (n_lists + 1)
+        _ids  id of each vector (e.g., the row of the embedding matrix), in list order
+        _vectors  unit-length vectors in list order (float32)
+        _metadata  additional information that is saved with the index (e.g., a checksum of the embeddings)
+    """
+
+    def __init__(self, centroids: np.ndarray, offsets: np.ndarray, ids: np.ndarray, vectors: np.ndarray,
+                 metadata: dict = None) -> None:
+        if len(offsets) != len(centroids) + 1 or offsets[-1] != len(ids) or len(ids) != len(vectors):
+            raise ValueError("Inconsistent IVF index: %d centroids, %d offsets, %d ids and %d vectors" % (
+                len(centroids), len(offsets), len(ids), len(vectors)))
+        self._centroids = centroids
+        self._offsets = offsets
+        self._ids = ids
+        self._vectors = vectors
+        self._metadata = dict(metadata) if metadata is not None else {}
+
+    @classmethod
+    def build(cls, vectors: np.ndarray, ids: np.ndarray = None, n_lists: int = None, n_iter: int = 10,
+              sample_size: int = None, random_state: int = 42, metadata: dict = None) -> 'IvfIndex':
+        """
+        Build an index of the vectors (which are normalized to unit length). ids are the ids that search returns
+        (default: the row numbers of vectors). n_lists defaults to the square root of the number of vectors. The
+        centroids are trained with n_iter iterations of spherical k-means on a random sample of sample_size vectors
+        (default: 256 per list), and then all vectors are assigned to their nearest centroid
+        """
+        vectors = _normalize(np.asarray(vectors, dtype=np.float32))
+        n = len(vectors)
+        if n == 0:
+            raise ValueError("Cannot build an index of zero vectors")
+        if ids is None:
+            ids = np.arange(n, dtype=np.int64)
+        ids = np.asarray(ids, dtype=np.int64)
+        if n_lists is None:
+            n_lists = max(1, int(round(np.sqrt(n))))
+        n_lists = min(n_lists, n)
+        if sample_size is None:
+            sample_size = 256 * n_lists
+        rng = np.random.default_rng(random_state)
+        sample = vectors[np.sort(rng.choice(n, size=min(n, sample_size), replace=False))]
+        centroids = sample[rng.choice(len(sample), size=n_lists, replace=False)].copy()
+        for _ in range(n_iter):
+            labels = _assign(sample, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            counts = np.bincount(labels, minlength=n_lists)
+            # lists without vectors are re-seeded with random vectors of the sample
+            empty = np.flatnonzero(counts == 0)
+            sums[empty] = sample[rng.choice(len(sample), size=len(empty), replace=False)]
+            centroids = _normalize(sums)
+        labels = _assign(vectors, centroids)
+        order = np.argsort(labels, kind='stable')
+        offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(labels, minlength=n_lists))
+        logger.info("Built IVF index with %d lists for %d vectors (largest list: %d)" % (
+            n_lists, n, int(np.max(np.diff(offsets)))))
+        return cls(centroids=centroids, offsets=offsets, ids=ids[order], vectors=vectors[order], metadata=metadata)
+
+    @property
+    def n_lists(self) -> int:
+        return len(self._centroids)
+
+    @property
+    def metadata(self) -> dict:
+        return self._metadata
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def search(self, query: np.ndarray, k: int, n_probe: int = 8) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Return the ids and cosine similarities of the (approximately) k most similar vectors to the query, sorted by
+        decreasing similarity. Only the vectors of the n_probe lists with the most similar centroids are scored, so
+        fewer than k results are returned if these lists have fewer than k vectors
+        """
+        query = np.asarray(query, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm > 0:
+            query = query / norm
+        n_probe = min(max(1, n_probe), self.n_lists)
+        centroid_scores = self._centroids @ query
+        if n_probe < self.n_lists:
+            probes = np.argpartition(-centroid_scores, n_probe - 1)[:n_probe]
+        else:
+            probes = np.arange(self.n_lists)
+        ids = []
+        scores = []
+        for probe in probes:
+            lo, hi = self._offsets[probe], self._offsets[probe + 1]
+            if hi > lo:
+                ids.append(self._ids[lo:hi])
+                scores.append(self._vectors[lo:hi] @ query)
+        if not ids:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        ids = np.concatenate(ids)
+        scores = np.concatenate(scores)
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return ids[top], scores[top]
+
+    def save(self, path: str) -> None:
+        """
+        Save the index to the directory path (one .npy file per array and a JSON file with the metadata)
+        """
+        os.makedirs(path, exist_ok=True)
+        for name in ('centroids', 'offsets', 'ids', 'vectors'):
+            np.save(os.path.join(path, name + '.npy'), getattr(self, '_' + name))
+        metadata = dict(self._metadata)
+        metadata.update({'version': IVF_INDEX_VERSION, 'n_lists': self.n_lists, 'n_vectors': len(self)})
+        with open(os.path.join(path, IVF_INDEX_METADATA), 'w') as f:
+            json.dump(metadata, f)
+        logger.info("Saved IVF index with %d lists to %s" % (self.n_lists, path))
+
+    @classmethod
+    def load(cls, path: str, mmap_mode: str = 'r') -> 'IvfIndex':
+        """
+        Load an index that was saved with save. By default the arrays are memory-mapped, so that loading is nearly
+        instantaneous and only the pages of the probed lists are read
+        """
+        metadata_path = os.path.join(path, IVF_INDEX_METADATA)
+        if not os.path.exists(metadata_path):
+            raise FileNotFoundError("Could not find IVF index at %s" % path)
+        with open(metadata_path) as f:
+            metadata = json.load(f)
+        if metadata.get('version') != IVF_INDEX_VERSION:
+            raise ValueError("Unsupported IVF index version in %s" % metadata_path)
+        arrays = {name: np.load(os.path.join(path, name + '.npy'), mmap_mode=mmap_mode, allow_pickle=False)
+                  for name in ('centroids', 'offsets', 'ids', 'vectors')}
+        # the centroids are compared with every query, so they are kept in RAM
+        arrays['centroids'] = np.asarray(arrays['centroids'])
+        arrays['offsets'] = np.asarray(arrays['offsets'])
+        return cls(metadata=metadata, **arrays)
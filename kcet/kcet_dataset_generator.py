@@ -1,12 +1,12 @@
-import random
-
 from .kcet_parser import KcetParser, DrugCentralPkPkiParser
 from .ct_by_phase_parser import CTParserByPhase
+from .embedding_store import EmbeddingStore
+from .link_set import Link, KinaseCancerGrid, LinkSet
 
 import pandas as pd
 import numpy as np
 import datetime
-from typing import Set, Tuple, List
+from typing import Tuple, List, Iterator
 import os
 import logging
 
@@ -17,76 +17,34 @@ logging.basicConfig(format='%(asctime)s,%(msecs)d %(levelname)-8s [%(filename)s:
 logger = logging.getLogger(__name__)
 
 
-class Link:
-    """
-    Simple class that is intended for use to keep track of positive and negative links using a Hash
-    For our use case, the _kinase field is NCBI Gene IDs for protein kinases and the _cancer field is
-    a MeSH Id for a cancer (descendant of neoplasms)
-    """
-
-    def __init__(self, kinase: str, cancer: str) -> None:
-        self._kinase = kinase
-        self._cancer = cancer
-
-    def __hash__(self):
-        return hash((self._kinase, self._cancer))
-
-    def __eq__(self, other):
-        return self.__class__ == other.__class__ and self._kinase == other.kinase and self._cancer == other.cancer
-
-    @property
-    def kinase(self):
-        return self._kinase
-
-    @property
-    def cancer(self):
-        return self._cancer
-
-    def to_dict(self):
-        return {'mesh_id': self._cancer, 'gene_id': self._kinase}
-
-    def __str__(self):
-        return Link.getLinkKey(cancer_mesh_id=self._cancer, kinase_ncbi_gene_id=self._kinase)
-
-    @staticmethod
-    def getLinkKey(cancer_mesh_id: str, kinase_ncbi_gene_id: str) -> str:
-        return kinase_ncbi_gene_id + "-" + cancer_mesh_id
-
-    @staticmethod
-    def fromDataFrameToLinkSet(df: pd.DataFrame) -> Set:
-        linkset = set()
-        for index, row in df.iterrows():
-            m = row['mesh_id']
-            g = row['gene_id']
-            L = Link(kinase=g, cancer=m)
-            linkset.add(L)
-        return linkset
-
-    @staticmethod
-    def fromEmbeddingsToLinkSet(df: pd.DataFrame) -> Set:
-        """
-        This method goes from the indices of the concept embeddings to Link objects.
-        """
-        linkset = set()
-        for i, row in df.iterrows():
-            # i (the index) is like this ncbigene7010-meshd018195
-            k, c = i.split("-")
-            if not k.startswith('ncbigene'):
-                raise ValueError("Malformed word line, we were expecting the first element to be ncbigene but got {}",
-                                 i)
-            if not c.startswith('meshd'):
-                raise ValueError("Malformed word line, we were expecting the second element to be meshd but got {}", i)
-            L = Link(kinase=k, cancer=c)
-            linkset.add(L)
-        return linkset
-
-
 def get_current_year():
     now = datetime.datetime.now()  # default to current year
     year = now.year
     return year
 
 
+def iter_difference_vector_chunks(kinase_idx: np.ndarray, kinase_vectors: np.ndarray, cancer_idx: np.ndarray,
+                                  cancer_vectors: np.ndarray, n_cancers: int, excluded: np.ndarray,
+                                  chunk_size: int) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Generate the difference vectors (kinase - cancer) of all pairs of the given kinases and cancers (grid indices and
+    float32 embeddings) except for the pairs whose ids are in excluded (sorted pair ids). The pairs are yielded in
+    chunks of at most chunk_size pairs (but at least one kinase) as tuples (pair_ids, vectors), where the pair id of
+    kinase i and cancer j is i * n_cancers + j (see KinaseCancerGrid)
+    """
+    n_kinases_per_chunk = max(1, chunk_size // len(cancer_idx))
+    for start in range(0, len(kinase_idx), n_kinases_per_chunk):
+        block = slice(start, start + n_kinases_per_chunk)
+        vectors = (kinase_vectors[block, None, :] - cancer_vectors[None, :, :]).reshape(-1, cancer_vectors.shape[1])
+        pair_ids = (kinase_idx[block, None] * n_cancers + cancer_idx[None, :]).ravel()
+        if len(excluded) > 0:
+            # excluded is sorted, so membership is a binary search
+            pos = np.minimum(np.searchsorted(excluded, pair_ids), len(excluded) - 1)
+            keep = excluded[pos] != pair_ids
+            pair_ids, vectors = pair_ids[keep], vectors[keep]
+        yield pair_ids, vectors
+
+
 class KcetDatasetGenerator:
     """
     Class to generate test, training, and prediction files.
@@ -98,46 +56,64 @@ class KcetDatasetGenerator:
     and use subsequent years for testing (e.g., data from after 2010).
     For some experiments, we restrict our analysis to phase 4 clinical trials. For others, we take all phases.
     Functions such as get_training_and_test_embeddings refer to all phases; get_training_and_test_emebddings_phase4 is restricted to phase 4.
+    The embeddings are either a full embedding (.npy) with its words file, or, if words is None, a kinase/cancer
+    extract made with extract_kinase_cancer_embeddings (see embedding_extract.py), which loads much faster.
+    Negative examples are drawn with a NumPy random generator seeded with random_state, so that datasets are reproducible.
     """
 
-    def __init__(self, clinical_trials: str, embeddings: str, words: str, n_pk: int = 5) -> None:
+    def __init__(self, clinical_trials: str, embeddings: str, words: str = None, n_pk: int = 5,
+                 random_state: int = 42) -> None:
         kcetParser = KcetParser()
         #self._pki_to_kinase_df = kcetParser._get_pki_to_kinase_list_dict_max_pk(n_pk=n_pk)
         #if not isinstance(self._pki_to_kinase_df, pd.DataFrame):
         #    raise ValueError("_pki_to_kinase_dict needs to be a DataFrame")
         self._symbol_to_id_map = kcetParser.get_symbol_to_id_map()
         self._mesh_list = kcetParser.get_mesh_id_list()
-        parser = CTParserByPhase(clinical_trials=clinical_trials)
+        parser = CTParserByPhase(clinical_trials=clinical_trials, n_pk=n_pk)
+        self._ct_parser = parser
         self._df_allphases = parser.get_all_phases(remove_redundant_entries=True)  # all positive data, phase 1,2,3,4
         self._df_phase4 = parser.get_phase_4(remove_redundant_entries=True)  # all positive data, phase 4 only
         self._n_pk = n_pk
-        # add the embeddings
-        if not os.path.exists(embeddings):
-            raise FileNotFoundError("Could not find embedding file at %s" % embeddings)
-        if not os.path.exists(words):
-            raise FileNotFoundError("Could not find words file at %s" % words)
-        embedding = np.load(embeddings, mmap_mode=None, allow_pickle=False, fix_imports=True, encoding='ASCII')
-        word_list = []
-        with open(words) as f:
-            for line in f:
-                word = line[2:-3]
-                word_list.append(word)
-        self._embeddings_df = pd.DataFrame(data=embedding, index=word_list)
+        # add the embeddings (memory-mapped, see EmbeddingStore)
+        if words is None:
+            self._embeddings = EmbeddingStore.from_extract(embeddings)
+        else:
+            self._embeddings = EmbeddingStore(embeddings=embeddings, words=words)
         logger.info(
-            "We ingested %d labeled word vectors from %s and %s" % (len(self._embeddings_df), embeddings, words))
+            "We ingested %d labeled word vectors from %s and %s" % (len(self._embeddings), embeddings, words))
         self._ncbigene2symbol_map = kcetParser.get_id_to_symbol_map()
         logger.info("We ingested %d symbol/NCBI gene id mappings" % (len(self._ncbigene2symbol_map)))
         self._meshid2disease_map = kcetParser.get_mesh_to_disease_map()
         logger.info("We ingested %d meshId/disease mapping" % (len(self._meshid2disease_map)))
+        # The grid of all kinase/cancer pairs; pairs are encoded as kinase index * number of cancers + cancer index
+        self._grid = KinaseCancerGrid(kinase_ids=self._symbol_to_id_map.values(), cancer_ids=self._mesh_list)
+        # earliest trial year of each kinase/cancer pair by phase, used to select positive links for any year range
+        self._first_occurrence = parser.get_first_occurrence_index(grid=self._grid)
+        self._kinase_has_embedding = self._embeddings.get_row_indices(self._grid.kinase_ids) >= 0
+        self._cancer_has_embedding = self._embeddings.get_row_indices(self._grid.cancer_ids) >= 0
+        # random numbers for negative sampling, seeded for reproducibility
+        self._random_state = random_state
+        self._rng = np.random.default_rng(random_state)
+
+    @property
+    def n_pk(self) -> int:
+        return self._n_pk
+
+    @property
+    def random_state(self) -> int:
+        return self._random_state
 
     def get_words(self):
-        return self._embeddings_df.index
+        return pd.Index(self._embeddings.words)
 
     def get_embeddings(self) -> pd.DataFrame:
         """
         return a Pandas dataframe whose index is the words, and whose columns are the dimensions of the embeddings
         """
-        return self._embeddings_df
+        return self._embeddings.to_data_frame()
+
+    def get_embedding_store(self) -> EmbeddingStore:
+        return self._embeddings
 
     def get_training_and_test_embeddings(self, target_year: int, begin_year: int, end_year: int, factor: int = 10) -> \
             Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame]:
@@ -157,15 +133,11 @@ class KcetDatasetGenerator:
         factor : int
             We randomly choose factor-times as many negative training examples as there is positive training examples
         """
-
-        positive_training_df = self.get_pos_training_embeddings(target_year=target_year)
-        n_pos_train = len(positive_training_df)
-        n_neg_train = n_pos_train * factor
-        negative_training_df = self.get_neg_training_embeddings(target_year=target_year, n_neg_examples=n_neg_train)
-        pos_test = self.get_positive_test_embeddings(target_year=target_year, begin_year=begin_year, end_year=end_year)
-        n_neg_test = factor * len(pos_test)
-        neg_test = self.get_negative_test_embeddings(negative_df=negative_training_df, year=target_year,
-                                                     n_negative_test=n_neg_test)
+        positive_training_df, negative_training_df = self.get_training_embeddings(target_year=target_year,
+                                                                                  factor=factor)
+        pos_test, neg_test = self.get_test_embeddings(target_year=target_year, begin_year=begin_year,
+                                                      end_year=end_year, negative_training_df=negative_training_df,
+                                                      factor=factor)
         return positive_training_df, negative_training_df, pos_test, neg_test
 
     def get_training_and_test_embeddings_phase_4(self, target_year: int, begin_year: int, end_year: int,
@@ -174,21 +146,43 @@ class KcetDatasetGenerator:
         """
         The function is analogous to get_training_and_test_data (see this for documehtation) but is limited to phase 4 clinical studies
         """
-        positive_training_df = self.get_pos_training_embeddings(target_year=target_year)
-        n_pos_train = len(positive_training_df)
-        n_neg_train = n_pos_train * factor
-        negative_training_df = self.get_neg_training_embeddings(target_year=target_year, n_neg_examples=n_neg_train)
+        positive_training_df, negative_training_df = self.get_training_embeddings(target_year=target_year,
+                                                                                  factor=factor)
         if end_year < begin_year:
             raise ValueError("End year cannot be before start year")
         if begin_year < target_year:
             raise ValueError("Begin year cannot be before target year")
+        positive_test_df, negative_test_df = self.get_test_embeddings(target_year=target_year, begin_year=begin_year,
+                                                                      end_year=end_year,
+                                                                      negative_training_df=negative_training_df,
+                                                                      factor=factor, phase4=True)
+        return positive_training_df, negative_training_df, positive_test_df, negative_test_df
+
+    def get_training_embeddings(self, target_year: int, factor: int = 10) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """
+        Get the positive training embeddings for the target year and factor-times as many negative training
+        embeddings. The training data does not depend on the test years, so it can be reused for several test
+        windows (see get_test_embeddings)
+        """
+        positive_training_df = self.get_pos_training_embeddings(target_year=target_year)
+        n_neg_train = len(positive_training_df) * factor
+        negative_training_df = self.get_neg_training_embeddings(target_year=target_year, n_neg_examples=n_neg_train)
+        return positive_training_df, negative_training_df
+
+    def get_test_embeddings(self, target_year: int, begin_year: int, end_year: int,
+                            negative_training_df: pd.DataFrame, factor: int = 10,
+                            phase4: bool = False) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """
+        Get the positive test embeddings for the links that were first tested from begin_year to end_year
+        (phase 4 only if phase4 is True) and factor-times as many negative test embeddings, which are disjoint
+        from the negative training embeddings
+        """
         positive_test_df = self.get_positive_test_embeddings(target_year=target_year, begin_year=begin_year,
-                                                             end_year=end_year, phase4=True)
-        n_pos_test = factor * len(positive_test_df)
+                                                             end_year=end_year, phase4=phase4)
+        n_neg_test = factor * len(positive_test_df)
         negative_test_df = self.get_negative_test_embeddings(negative_df=negative_training_df, year=target_year,
-                                                             n_negative_test=n_pos_test)
-
-        return positive_training_df, negative_training_df, positive_test_df, negative_test_df
+                                                             n_negative_test=n_neg_test)
+        return positive_test_df, negative_test_df
 
     def get_pos_training_embeddings(self, target_year: int) -> pd.DataFrame:
         """
@@ -206,39 +200,10 @@ class KcetDatasetGenerator:
         We take Random non-links that were not listed in any of phase 1,2,3,4 in the year up
         to and including self._year
         """
-        kinase_list = [geneid for _, geneid in self._symbol_to_id_map.items()]
-        cancer_id_list = self._mesh_list
-        # The following help to keep track of positive examples
-        positive_links = Link.fromDataFrameToLinkSet(self._df_allphases[self._df_allphases['year'] <= target_year])
-        negative_links = set()
-        n_skipped_link = 0
-        i = 0  # use i to limit the number of attempts in case there is some problem
-        df = pd.DataFrame(columns=self._embeddings_df.columns)
-        while len(df) < n_neg_examples and i < 1e6:
-            i += 1
-            mesh_id = random.choice(cancer_id_list)
-            ncbigene_id = random.choice(kinase_list)
-            randomLink = Link(kinase=ncbigene_id, cancer=mesh_id)
-            # Do not add a link from the positive set to the negative set 
-            # Note that this can happen by chance and is not worrisome, but we log it
-            if randomLink in positive_links or randomLink in negative_links:
-                n_skipped_link += 1
-                continue
-            negative_links.add(randomLink)
-            ncbigene_id_embedding = None
-            mesh_id_embedding = None
-            if ncbigene_id in self._embeddings_df.index:
-                ncbigene_id_embedding = self._embeddings_df.loc[ncbigene_id]
-            if mesh_id in self._embeddings_df.index:
-                mesh_id_embedding = self._embeddings_df.loc[mesh_id]
-            if ncbigene_id_embedding is not None and mesh_id_embedding is not None:
-                diff_kinase_mesh = np.subtract(ncbigene_id_embedding, mesh_id_embedding)
-                label = "%s-%s" % (ncbigene_id, mesh_id)
-                df.loc[label] = diff_kinase_mesh
-            i += 1
-            if i % 10000 == 0 and i > 0:
-                logger.info(
-                    "Created %d/%d (%.1f%%) difference vectors" % (i, n_neg_examples, 100.0 * i / n_neg_examples))
+        positive_links = self.get_all_phases_all_pk_pki(target_year=target_year)
+        negative_pairs = self._sample_negative_pairs(n_pairs=n_neg_examples, excluded_links=positive_links)
+        gene_ids, mesh_ids = self._grid.decode(negative_pairs)
+        df, _, _ = self.get_difference_vectors(gene_ids=gene_ids, mesh_ids=mesh_ids)
         logger.info("Extracted %s kinase-cancer difference vectors" % len(df))
         return df
 
@@ -247,52 +212,15 @@ class KcetDatasetGenerator:
         """
         Get all of the positive examples from begin_year to end_year (inclusive).
         -- used for test in historical experiments
+        A kinase/cancer link is a positive test example if its first trial (of phase 4 if phase4 is True, otherwise
+        of any phase) started from begin_year to end_year, and it had no trial of any phase up to the target year.
         """
-
-        if phase4:
-            within_valid_year_range = (self._df_phase4['year'] >= begin_year) & (self._df_phase4['year'] <= end_year)
-            df_pos_test = self._df_phase4[within_valid_year_range]
-        else:
-            within_valid_year_range = (self._df_allphases['year'] >= begin_year) & (
-                    self._df_allphases['year'] <= end_year)
-            df_pos_test = self._df_allphases[within_valid_year_range]
-        all_positive_links_up_to_target = self.get_all_phases_all_pk_pki(target_year=target_year)
-        positive_test_links = set()
-        n_skipped = 0
-        for _, row in df_pos_test.iterrows():
-            cancer_mesh_id = row['mesh_id']
-            kinase_ncbi_gene_id = row['gene_id']
-            candidate = Link(cancer=cancer_mesh_id, kinase=kinase_ncbi_gene_id)
-            if candidate not in all_positive_links_up_to_target:
-                positive_test_links.add(candidate)
-            else:
-                n_skipped += 1
-        logger.info("{} candidate PK/cancer pairs were skipped for the positive test set".format(n_skipped))
-        kinase_list = []
-        cancer_list = []
-        n_skipped_link = 0
-        df = pd.DataFrame(columns=self._embeddings_df.columns)
-        for link in positive_test_links:
-            if link in all_positive_links_up_to_target:
-                # do not include a positive example if it was already known at training time!
-                n_skipped_link += 1
-                continue
-            ncbigene_id = link.kinase
-            mesh_id = link.cancer
-            kinase_list.append(ncbigene_id)
-            cancer_list.append(mesh_id)
-            ncbigene_id_embedding = None
-            mesh_id_embedding = None
-            if ncbigene_id in self._embeddings_df.index:
-                ncbigene_id_embedding = self._embeddings_df.loc[ncbigene_id]
-            if mesh_id in self._embeddings_df.index:
-                mesh_id_embedding = self._embeddings_df.loc[mesh_id]
-            if ncbigene_id_embedding is not None and mesh_id_embedding is not None:
-                diff_kinase_mesh = np.subtract(ncbigene_id_embedding, mesh_id_embedding)
-                label = Link.getLinkKey(cancer_mesh_id=mesh_id, kinase_ncbi_gene_id=ncbigene_id)
-                df.loc[label] = diff_kinase_mesh
-        logger.info(
-            "Skipped %d links for testing that were already present in training data (expected behavior)" % n_skipped_link)
+        positive_test_links = self._first_occurrence.get_new_links(target_year=target_year, begin_year=begin_year,
+                                                                   end_year=end_year, phase4=phase4)
+        logger.info("Found %d new positive PK/cancer links from %d to %d" % (len(positive_test_links), begin_year,
+                                                                            end_year))
+        gene_ids, mesh_ids = self._grid.decode(positive_test_links.pair_ids)
+        df, _, _ = self.get_difference_vectors(gene_ids=gene_ids, mesh_ids=mesh_ids)
         return df
 
     def get_negative_test_embeddings(self, negative_df: pd.DataFrame, year: int, n_negative_test) -> pd.DataFrame:
@@ -303,63 +231,45 @@ class KcetDatasetGenerator:
         examples than positive examples, and this function chooses a set that is distinct
         from the set of examples use prior to the target year (negative_df).
         """
-
-        kinase_list = [geneid for _, geneid in self._symbol_to_id_map.items()]
-        cancer_id_list = self._mesh_list
-        positive_links = Link.fromDataFrameToLinkSet(self._df_allphases[self._df_allphases['year'] <= year])
-        pretarget_negative_links = Link.fromEmbeddingsToLinkSet(negative_df)
-        negative_links = set()
-        n_skipped_link = 0
-        df = pd.DataFrame(columns=self._embeddings_df.columns)
-        i = 0  # use i to limit the number of attempts in case there is some problem
-        while len(df) < n_negative_test and i < 1e6:
-            i += 1
-            mesh_id = random.choice(cancer_id_list)
-            ncbigene_id = random.choice(kinase_list)
-            randomLink = Link(kinase=ncbigene_id, cancer=mesh_id)
-            if randomLink in positive_links:
-                n_skipped_link += 1
-                continue
-            if randomLink in pretarget_negative_links:
-                n_skipped_link += 1
-                continue
-            if randomLink in negative_links:
-                n_skipped_link += 1
-                continue
-            negative_links.add(randomLink)
-            ncbigene_id_embedding = None
-            mesh_id_embedding = None
-            if ncbigene_id in self._embeddings_df.index:
-                ncbigene_id_embedding = self._embeddings_df.loc[ncbigene_id]
-            if mesh_id in self._embeddings_df.index:
-                mesh_id_embedding = self._embeddings_df.loc[mesh_id]
-            if ncbigene_id_embedding is not None and mesh_id_embedding is not None:
-                diff_kinase_mesh = np.subtract(ncbigene_id_embedding, mesh_id_embedding)
-                label = Link.getLinkKey(cancer_mesh_id=mesh_id, kinase_ncbi_gene_id=ncbigene_id)
-                df.loc[label] = diff_kinase_mesh
-
-        logger.info("Skipped %d links that were found previously (expected behavior)" % n_skipped_link)
+        positive_links = self.get_all_phases_all_pk_pki(target_year=year)
+        pretarget_negative_links = LinkSet.from_labels(grid=self._grid, labels=negative_df.index)
+        negative_pairs = self._sample_negative_pairs(n_pairs=n_negative_test,
+                                                     excluded_links=positive_links | pretarget_negative_links)
+        gene_ids, mesh_ids = self._grid.decode(negative_pairs)
+        df, _, _ = self.get_difference_vectors(gene_ids=gene_ids, mesh_ids=mesh_ids)
         logger.info("We generated a negative test set with %d examples (the positive set has %d)" % (
-            len(negative_links), len(positive_links)))
+            len(df), len(positive_links)))
         return df
 
-    def get_all_phases_all_pk_pki(self, target_year: int):
+    def get_grid(self) -> KinaseCancerGrid:
+        """
+        return the grid of all protein kinase/cancer pairs, which defines the integer pair ids
+        """
+        return self._grid
+
+    def _sample_negative_pairs(self, n_pairs: int, excluded_links: LinkSet) -> np.ndarray:
+        """
+        Draw n_pairs distinct kinase/cancer pairs (as integer pair ids) without replacement and without rejection
+        sampling. The candidates are all pairs of the kinase x cancer grid for which both embeddings are available,
+        minus the excluded pairs (e.g., known positives or previously used negatives).
+        """
+        candidates = np.outer(self._kinase_has_embedding, self._cancer_has_embedding).ravel()
+        candidates[excluded_links.pair_ids] = False
+        candidate_pairs = np.flatnonzero(candidates)
+        if n_pairs > len(candidate_pairs):
+            logger.warning("Requested %d negative pairs but only %d candidates are available" % (
+                n_pairs, len(candidate_pairs)))
+            n_pairs = len(candidate_pairs)
+        return self._rng.choice(candidate_pairs, size=n_pairs, replace=False)
+
+    def get_all_phases_all_pk_pki(self, target_year: int) -> LinkSet:
         """
         It is a conservative estimate to assume that all connections between a PK and PK are valid for the testing set
         In contrast, for training, we use only validated items (phase 4)
-        This method returns a data frame with cancer/PK links that are derived from all studies up to the target year,
+        This method returns a set with cancer/PK links that are derived from all studies up to the target year,
         and all PK/PKI links (i.e., not limited to the n_pk_pki parameter that is used for the training set)
         """
-        all_links = set()
-        all_phases = self._df_allphases[self._df_allphases['year'] <= target_year]
-        for _, row in all_phases.iterrows():
-            kinase_gene_id = row['gene_id']  # e.g., NCBI Gene id corresponding to CDK4
-            cancer_mesh_id = row['mesh_id']  # e.g., MeSH ID of a cancer that can be treated with a PKI that targets CDK4
-            link = Link(cancer=cancer_mesh_id, kinase=kinase_gene_id)
-            all_links.add(link)
-        if len(all_links) == 0:
-            raise ValueError("TO DO COULD NOT FIND ALL LINKS")
-        return all_links
+        return self._first_occurrence.get_links_up_to(year=target_year)
 
     def get_data_for_novel_prediction(self, target_year: int, factor: int = 10) -> Tuple[
         pd.DataFrame, pd.DataFrame, pd.DataFrame]:
@@ -367,46 +277,111 @@ class KcetDatasetGenerator:
         This method creates positive and negative training sets including everything up to the current year
         It then creates examples for all other predictions that we will use for the novel predictions
         It returns three dataframes with embeddings.
+        For large numbers of kinases and cancers, use iter_novel_prediction_chunks to process the
+        prediction examples in chunks of bounded size.
         """
         positive_training_df = self.get_pos_training_embeddings(target_year=target_year)
         n_neg = factor * len(positive_training_df)
         negative_training_df = self.get_neg_training_embeddings(target_year=target_year, n_neg_examples=n_neg)
-        prediction_df = pd.DataFrame(columns=self._embeddings_df.columns)
-        kinase_list = [gene_id for _, gene_id in self._symbol_to_id_map.items()]
-        cancer_id_list = self._mesh_list
-        i = 0
-        total = len(kinase_list) * len(cancer_id_list)
-        logger.info("Links to be extracted: {}".format(total))
-        # We remove all positive protein-kinase/cancer associations regardless of phase
-        positive_links = self.get_all_phases_all_pk_pki(target_year=target_year)
-        negative_links = Link.fromEmbeddingsToLinkSet(negative_training_df)
-        for ncbi_gene_id in kinase_list:
-            for mesh_id in cancer_id_list:
-                i += 1
-                if i % 2000 == 0:
-                    print("\r{}/{} links extracted ({:.2f}%)".format(i, total, 100 * i / total), end="")
-                randomLink = Link(kinase=ncbi_gene_id, cancer=mesh_id)
-                if randomLink in positive_links or randomLink in negative_links:
-                    continue
-                ncbigene_id_embedding = None
-                mesh_id_embedding = None
-                if ncbi_gene_id in self._embeddings_df.index:
-                    ncbigene_id_embedding = self._embeddings_df.loc[ncbi_gene_id]
-                if mesh_id in self._embeddings_df.index:
-                    mesh_id_embedding = self._embeddings_df.loc[mesh_id]
-                if ncbigene_id_embedding is not None and mesh_id_embedding is not None:
-                    diff_kinase_mesh = np.subtract(ncbigene_id_embedding, mesh_id_embedding)
-                    label = "%s-%s" % (ncbi_gene_id, mesh_id)
-                    prediction_df.loc[label] = diff_kinase_mesh
+        pair_id_chunks = []
+        vector_chunks = []
+        for pair_ids, vectors in self.iter_novel_prediction_chunks(target_year=target_year,
+                                                                   negative_training_df=negative_training_df):
+            pair_id_chunks.append(pair_ids)
+            vector_chunks.append(vectors)
+        pair_ids = np.concatenate(pair_id_chunks) if pair_id_chunks else np.empty(0, dtype=np.int64)
+        vectors = np.concatenate(vector_chunks) if vector_chunks else \
+            np.empty((0, self._embeddings.dimension), dtype=np.float32)
+        prediction_df = pd.DataFrame(data=vectors, index=self.get_pair_labels(pair_ids))
         return positive_training_df, negative_training_df, prediction_df
 
+    def iter_novel_prediction_chunks(self, target_year: int, negative_training_df: pd.DataFrame = None,
+                                     chunk_size: int = 100000) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Generate the difference vectors of all kinase/cancer pairs that are candidates for novel predictions, i.e.,
+        all pairs with embeddings except for the positive links of any phase up to the target year and the
+        negative training examples (negative_training_df). The pairs are yielded in chunks of at most chunk_size
+        pairs (but at least one kinase) as tuples (pair_ids, vectors), where pair_ids are integer pair ids (see
+        get_pair_labels) and vectors is a float32 matrix computed by broadcasting a block of kinase embeddings
+        against all cancer embeddings. Memory use is bounded by the chunk size.
+        """
+        kinase_idx, cancer_idx, excluded_links = self.get_novel_prediction_candidates(
+            target_year=target_year, negative_training_df=negative_training_df)
+        if len(kinase_idx) == 0 or len(cancer_idx) == 0:
+            return
+        kinase_vectors = np.asarray(
+            self._embeddings.get_rows(self._embeddings.get_row_indices(self._grid.kinase_ids[kinase_idx])),
+            dtype=np.float32)
+        cancer_vectors = np.asarray(
+            self._embeddings.get_rows(self._embeddings.get_row_indices(self._grid.cancer_ids[cancer_idx])),
+            dtype=np.float32)
+        total = len(kinase_idx) * len(cancer_idx)
+        logger.info("Links to be extracted: {}".format(total))
+        yield from iter_difference_vector_chunks(kinase_idx=kinase_idx, kinase_vectors=kinase_vectors,
+                                                 cancer_idx=cancer_idx, cancer_vectors=cancer_vectors,
+                                                 n_cancers=self._grid.n_cancers,
+                                                 excluded=np.asarray(excluded_links.pair_ids, dtype=np.int64),
+                                                 chunk_size=chunk_size)
+
+    def get_novel_prediction_candidates(self, target_year: int, negative_training_df: pd.DataFrame = None) -> \
+            Tuple[np.ndarray, np.ndarray, LinkSet]:
+        """
+        Return the grid indices of the kinases and cancers with embeddings, whose pairs are the candidates for novel
+        predictions, and the links that are excluded from the candidates (the positive links of any phase up to the
+        target year and the negative training examples)
+        """
+        excluded_links = self.get_all_phases_all_pk_pki(target_year=target_year)
+        if negative_training_df is not None:
+            excluded_links = excluded_links | LinkSet.from_labels(grid=self._grid, labels=negative_training_df.index)
+        kinase_idx = np.flatnonzero(self._kinase_has_embedding)
+        cancer_idx = np.flatnonzero(self._cancer_has_embedding)
+        return kinase_idx, cancer_idx, excluded_links
+
+    def get_pair_labels(self, pair_ids: np.ndarray) -> List[str]:
+        """
+        Convert integer pair ids to labels such as ncbigene5599-meshd000074723
+        """
+        return self._grid.to_labels(pair_ids)
+
     def _get_positive_training_data_set(self, year: int) -> pd.DataFrame:
         """
         Positive training set: all links of phase 4 up to the year given in the constructor
         """
         if not isinstance(year, int):
             raise ValueError("year must be an integer")
-        return self._df_phase4[self._df_phase4['year'] <= year]
+        return self._first_occurrence.get_links_up_to(year=year, phase4=True).to_data_frame()
+
+    def get_difference_vectors(self, gene_ids, mesh_ids) -> Tuple[pd.DataFrame, np.ndarray, np.ndarray]:
+        """
+        Compute the difference vectors (kinase embedding minus cancer embedding) for the pairs
+        (gene_ids[i], mesh_ids[i]) in one batch. All ids are resolved to rows of the embedding matrix at once,
+        and the vectors are computed with a single fancy-indexing operation into a contiguous float32 array.
+        Returns a data frame with one row per pair for which both embeddings were found (index: labels such as
+        ncbigene5599-meshd000074723), as well as arrays with the unique gene ids and MeSH ids that could not be found.
+        """
+        gene_ids = np.asarray(gene_ids, dtype=object)
+        mesh_ids = np.asarray(mesh_ids, dtype=object)
+        if len(gene_ids) != len(mesh_ids):
+            raise ValueError("gene_ids and mesh_ids must have the same length")
+        gene_rows = self._embeddings.get_row_indices(gene_ids)
+        mesh_rows = self._embeddings.get_row_indices(mesh_ids)
+        found = (gene_rows >= 0) & (mesh_rows >= 0)
+        matrix = self._embeddings.matrix
+        vectors = np.subtract(matrix[gene_rows[found]], matrix[mesh_rows[found]], dtype=np.float32)
+        labels = [Link.getLinkKey(cancer_mesh_id=c, kinase_ncbi_gene_id=k)
+                  for k, c in zip(gene_ids[found], mesh_ids[found])]
+        df = pd.DataFrame(data=vectors, index=labels)
+        unidentified_genes = np.unique(gene_ids[gene_rows < 0].astype(str))
+        unidentified_cancers = np.unique(mesh_ids[mesh_rows < 0].astype(str))
+        return df, unidentified_genes, unidentified_cancers
+
+    def get_difference_vectors_for_labels(self, labels: List[str]) -> pd.DataFrame:
+        """
+        Compute the difference vectors for pair labels such as ncbigene5599-meshd000074723 (see get_difference_vectors)
+        """
+        pairs = [label.split("-") for label in labels]
+        df, _, _ = self.get_difference_vectors(gene_ids=[p[0] for p in pairs], mesh_ids=[p[1] for p in pairs])
+        return df
 
     def get_disease_kinase_difference_vectors(self, examples: pd.DataFrame) -> pd.DataFrame:
         """
@@ -416,37 +391,17 @@ class KcetDatasetGenerator:
         This method assumees that the input dataframe contains columns called gene_id and mesh_id and will
         fail if this is not the case
         """
-        unidentified_genes = set()
-        unidentified_cancers = set()
         if "gene_id" not in examples.columns:
             raise ValueError("Input dataframe must contain a column called gene_id")
         if "mesh_id" not in examples.columns:
             raise ValueError("Input dataframe must contain a column called mesh_id")
-        df = pd.DataFrame(columns=self._embeddings_df.columns)
         total = len(examples.index)
         if total == 0:
             raise ValueError("Attempt to get difference vectors from empty data frame")
-        i = 0
-        for _, row in examples.iterrows():
-            ncbigene_id = row["gene_id"]
-            mesh_id = row["mesh_id"]
-            ncbigene_id_embedding = None
-            mesh_id_embedding = None
-            if ncbigene_id in self._embeddings_df.index:
-                ncbigene_id_embedding = self._embeddings_df.loc[ncbigene_id]
-            else:
-                unidentified_genes.add(ncbigene_id)
-            if mesh_id in self._embeddings_df.index:
-                mesh_id_embedding = self._embeddings_df.loc[mesh_id]
-            else:
-                unidentified_cancers.add(mesh_id)
-            if ncbigene_id_embedding is not None and mesh_id_embedding is not None:
-                diff_kinase_mesh = np.subtract(ncbigene_id_embedding, mesh_id_embedding)
-                label = "%s-%s" % (ncbigene_id, mesh_id)
-                df.loc[label] = diff_kinase_mesh
-            i += 1
-            if i % 10000 == 0 and i > 0:
-                logger.info("Created %d/%d (%.1f%%) difference vectors" % (i, total, 100.0 * i / total))
+        # each kinase/cancer pair yields one difference vector
+        pairs = examples[['gene_id', 'mesh_id']].drop_duplicates()
+        df, unidentified_genes, unidentified_cancers = self.get_difference_vectors(gene_ids=pairs['gene_id'].values,
+                                                                                   mesh_ids=pairs['mesh_id'].values)
         logger.info("Extracted %s kinase-cancer difference vectors" % len(df))
         logger.info("Initial data: %d examples" % len(examples))
         logger.info("Could not identify %d gene ids" % len(unidentified_genes))
@@ -479,6 +434,6 @@ class KcetDatasetGenerator:
             n = len(self._df_allphases[self._df_allphases['phase'] == phase])
             message = 'Phase {} trials included in this analysis'.format(i)
             data.append([message, "{:d}".format(n)])
-        n_embeddings = len(self._embeddings_df)
+        n_embeddings = len(self._embeddings)
         data.append(['word/concept embeddings', "{:d}".format(n_embeddings)])
         return pd.DataFrame(data, columns=['Item', 'Value'])
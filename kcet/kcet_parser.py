@@ -1,4 +1,5 @@
 from .drugcentral_pk_pki_parser import DrugCentralPkPkiParser
+from . import input_registry
 import os
 import pandas as pd
 import numpy as np
@@ -21,46 +22,32 @@ class KcetParser:
         Input the various files into data structures
         """
         # Check that we can find all of the files we need before we start.
-        d = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        self._prot_kinase_tsv_path = os.path.join(d, 'input', 'prot_kinase.tsv')
+        self._prot_kinase_tsv_path = input_registry.get_input_path(input_registry.PROT_KINASE_TSV)
         if not os.path.exists(self._prot_kinase_tsv_path):
             raise FileNotFoundError("Could not find file at %s" % self._prot_kinase_tsv_path)
-        self._neoplasms_labels_tsv_path = os.path.join(d, 'input', 'neoplasms_labels.tsv')
+        self._neoplasms_labels_tsv_path = input_registry.get_input_path(input_registry.NEOPLASMS_LABELS_TSV)
         if not os.path.exists(self._neoplasms_labels_tsv_path):
             raise FileNotFoundError("Could not find file at %s" % self._neoplasms_labels_tsv_path)
-        self._target_level_tsv_path = os.path.join(d, 'input', 'target_develop_levels.tsv.csv')
+        self._target_level_tsv_path = input_registry.get_input_path(input_registry.TARGET_LEVEL_TSV)
         if not os.path.exists(self._target_level_tsv_path):
             raise FileNotFoundError("Could not find file at %s" % self._target_level_tsv_path)
-        # Ingest data
-        self._symbol_to_id_map = self._ingest_symbol_to_id_map()
+        # Ingest data. Each file is parsed once per process and shared by all parsers (see input_registry)
+        self._symbol_to_id_map = input_registry.get_symbol_to_id_map(self._prot_kinase_tsv_path)
         logging.info("ingested symbol_to_id_map with %d entries such as {'NCBIGene:2870': 'GRK6'}" % len(
             self._symbol_to_id_map))
         # Get reverse map
         self._id_to_symbol_map = {v: k for k, v in self._symbol_to_id_map.items()}
-        self._mesh_list = self._ingest_mesh_id_list()
+        mesh_disease = input_registry.get_mesh_disease_pairs(self._neoplasms_labels_tsv_path)
+        self._mesh_list = [mesh_id for mesh_id, _ in mesh_disease]
         logging.info("Ingested mesh_id list with %d entries such as 'meshd000008' and 'meshd000069293', " % len(
             self._mesh_list))
-        self._meshid2disease_map = self._ingest_mesh_to_disease_map()
+        self._meshid2disease_map = dict(mesh_disease)
         logging.info("Ingested _meshid2disease_map with %d entries" % len(self._meshid2disease_map))
-        self._sym2tdl = self._ingest_symbol_to_tdl_map()
+        self._sym2tdl = defaultdict(str, input_registry.get_symbol_to_tdl_map(self._target_level_tsv_path))
         logging.info("Ingested meshid2disease_map with %d entries" % len(self._sym2tdl))
         #self._pki_to_kinase = self._ingest_pki_to_kinase_list_dict()
         self._drug_central = DrugCentralPkPkiParser()
 
-    def _ingest_symbol_to_id_map(self) -> Dict:
-        """
-        returns a dictionary like this: {'NCBIGene:2870': 'GRK6', 'NCBIGene:140609': 'NEK7', ... }
-        """
-        logging.info("Reading protein kinase information from %s" % self._prot_kinase_tsv_path)
-        kinase_data = pd.read_csv(self._prot_kinase_tsv_path, sep="\t", header=None)
-        symbol_to_id_map = defaultdict(str)
-        for i in range(kinase_data.shape[0]):
-            gene_symbol = kinase_data.iloc[i][0]
-            ncbi_id = kinase_data.iloc[i][2]
-            ncbigene_id = "ncbigene%d" % ncbi_id
-            symbol_to_id_map[gene_symbol] = ncbigene_id
-        return symbol_to_id_map
-
     def get_symbol_to_id_map(self) -> Dict:
         return self._symbol_to_id_map
 
@@ -70,45 +57,9 @@ class KcetParser:
     def get_mesh_id_list(self) -> List:
         return self._mesh_list
 
-    def _ingest_mesh_id_list(self) -> List:
-        """
-        Return a list of the MeSH ids that correspond to cancers from the 
-        inputs/neoplasms_labels,tsv file
-        """
-        mesh_list = []
-        with open(self._neoplasms_labels_tsv_path) as f:
-            for line in f:
-                fields = line.rstrip().split('\t')
-                if len(fields) < 2 or len(fields) > 3:
-                    # At a minimum, there is MeSH id and label. Most lines have a third field (synonyms)
-                    raise ValueError("Bad line in neoplasms_labels,tsv file: %s" % line)
-                mesh = fields[0]
-                mesh_id_first_letter = mesh[0].lower()
-                mesh_id = "mesh" + mesh_id_first_letter + mesh[1:]
-                mesh_list.append(mesh_id)
-        return mesh_list
-
     def get_mesh_to_disease_map(self) -> Dict:
         return self._meshid2disease_map
 
-    def _ingest_mesh_to_disease_map(self) -> Dict:
-        """
-        return a map with 'meshd000008': 'Abdominal Neoplasms', 'meshd000069293': 'Plasmablastic Lymphoma', ...
-        """
-        meshid2disease_map = defaultdict()
-        with open(self._neoplasms_labels_tsv_path) as f:
-            for line in f:
-                fields = line.rstrip().split('\t')
-                if len(fields) < 2 or len(fields) > 3:
-                    # At a minimum, there is MeSH id and label. Most lines have a third field (synonyms)
-                    raise ValueError("Bad line in neoplasms_labels,tsv file: %s" % line)
-                mesh = fields[0]
-                mesh_id_first_letter = mesh[0].lower()
-                mesh_id = "mesh" + mesh_id_first_letter + mesh[1:]
-                disease = fields[1]
-                meshid2disease_map[mesh_id] = disease
-        return meshid2disease_map
-
     def decode_predictions(self, vectors: pd.DataFrame, probabilities: np.ndarray,
                            deleteEmbeddings: bool = True) -> pd.DataFrame:
         """
@@ -146,18 +97,7 @@ class KcetParser:
         Read the target development level file that related proteins to the levels
         Tdark, Tchem, Tbio, Tclin
         """
-        predictions = pd.read_csv(self._target_level_tsv_path, sep="\t")
-        columns = ['Sym', 'UniProt', 'Description', 'GeneID', 'TDL']
-        return predictions[columns]
-
-    def _ingest_symbol_to_tdl_map(self) -> Dict:
-        predictions = self.read_target_level_df()
-        sym2tdl = defaultdict(str)
-        for _, row in predictions.iterrows():
-            symbol = row['Sym']
-            tdl = row['TDL']
-            sym2tdl[symbol] = tdl
-        return sym2tdl
+        return input_registry.get_target_level_df(self._target_level_tsv_path)
 
     def get_symbol_to_tdl_map(self) -> Dict:
         return self._sym2tdl
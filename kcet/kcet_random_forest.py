@@ -1,15 +1,28 @@
 from .kcet_dataset_generator import KcetDatasetGenerator
+from .execution_config import ExecutionConfig
+from .universe_scorer import score_universe, score_universe_top_k
 
 import pandas as pd
 import numpy as np
 import os
+import json
+import time
+import joblib
+import sklearn
+from typing import Dict, Tuple
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.model_selection import RandomizedSearchCV
+# HalvingRandomSearchCV is experimental in scikit-learn and must be enabled explicitly
+from sklearn.experimental import enable_halving_search_cv  # noqa
+from sklearn.model_selection import HalvingRandomSearchCV
 
 import logging
 
 logging.basicConfig(filename='kcet.log', level=logging.INFO)
 
+# Increment if the layout of the saved metadata changes
+MODEL_FORMAT_VERSION = 1
+
 
 class KcetRandomForest:
     """
@@ -21,7 +34,11 @@ class KcetRandomForest:
                  embedddingfile: str,
                  wordsfile: str,
                  target: int,
-                 factor: int = 10) -> None:
+                 factor: int = 10,
+                 config: ExecutionConfig = None) -> None:
+        """
+        config: settings for the parallel hyperparameter search and training (default: one job, n_iter=1, cv=10)
+        """
         self._data_generator = data_gen
         self._target_year = target
         self._factor = factor
@@ -29,68 +46,230 @@ class KcetRandomForest:
             raise FileNotFoundError("Could not find embedding file at " + embedddingfile)
         if not os.path.isfile(wordsfile):
             raise FileNotFoundError("Could not find embedding/words file at " + wordsfile)
+        if config is None:
+            config = ExecutionConfig()
+        self._config = config
+        # fitted models by (target year, factor), each with the negative training data and the numbers of examples
+        # (and the labels of the positive training pairs, see save)
+        self._models = {}
+        # summary of the hyperparameter search by (target year, factor), see get_search_report
+        self._search_reports = {}
 
-    def classify(self, begin_year: int, end_year: int, phase4: bool = False):
+    @property
+    def config(self) -> ExecutionConfig:
+        return self._config
+
+    def fit(self) -> RandomForestClassifier:
         """
-        Perform random forest learning. From the vectors extracted from the data from the target year, predict
-        clinical trials starting at midyear and going num_years_later
-        For instance, 
-        target_year = 2010
-        mid_year = 2019
-        num_years_after_the_mid_year = 1
-        creates test tests from 2019 to 2020.
-        """
-        # The following four data frames contain the names of the cancers and protein kinases and other columns.
-        #
-        """
-        if phase4:
-            logging.info("classify-getting data for phase 4")
-            pos_train_df, neg_train_df, pos_test_df, neg_test_df = \
-                self._data_generator.get_training_and_test_data_phase_4(target_year=self._target_year, begin_year=begin_year,
-                                                                end_year=end_year)
-        else:
-            logging.info("classify-getting data for all phases")
-            pos_train_df, neg_train_df, pos_test_df, neg_test_df = \
-                self._data_generator.get_training_and_test_data(target_year=self._target_year,
-                                                                        begin_year=begin_year, end_year=end_year)
-       
-        # Now we need to extract the corresponding embedded vectors
-        logging.info(
-            "classify examples: pos train: {}, neg train {}, pos test {}, neg test {}"
-                .format(len(pos_train_df), len(neg_train_df), len(pos_test_df), len(neg_test_df)))
-        """
-        if phase4:
-            pos_train_vectors, neg_train_vectors, pos_test_vectors, neg_test_vectors = self._data_generator.get_training_and_test_embeddings_phase_4(
-                self._target_year, begin_year=begin_year,
-                end_year=end_year)
-        else:
-            pos_train_vectors, neg_train_vectors, pos_test_vectors, neg_test_vectors = self._data_generator.get_training_and_test_embeddings(
-                self._target_year, begin_year=begin_year,
-                end_year=end_year)
-
-        n_pos_train = pos_train_vectors.shape[0]
-        n_neg_train = neg_train_vectors.shape[0]
-        X_train = pd.concat([pos_train_vectors, neg_train_vectors])
-        y_train = np.concatenate((np.ones(n_pos_train), np.zeros(n_neg_train)))
+        Train the random forest for the target year and factor, or return the cached model if it was trained before.
+        The training data depends only on the target year and the factor (it is the same for phase 4 and for all
+        phases), so that one model can be evaluated for any number of test windows (see evaluate)
+        """
+        key = (self._target_year, self._factor)
+        if key not in self._models:
+            pos_train_vectors, neg_train_vectors = self._data_generator.get_training_embeddings(
+                target_year=self._target_year, factor=self._factor)
+            n_pos_train = pos_train_vectors.shape[0]
+            n_neg_train = neg_train_vectors.shape[0]
+            logging.info("Training RF with pos train (difference vectors): {}, neg train {}".format(n_pos_train,
+                                                                                                    n_neg_train))
+            X_train = pd.concat([pos_train_vectors, neg_train_vectors])
+            y_train = np.concatenate((np.ones(n_pos_train), np.zeros(n_neg_train)))
+            # Perform random grid search for best parameters using the training data
+            config = self._config
+            logging.info("Grid search with {}".format(config))
+            search = self._get_search()
+            start = time.perf_counter()
+            with config.parallel_backend(), config.shared_array(X_train.values) as X:
+                search.fit(X, y_train)
+            elapsed = time.perf_counter() - start
+            self._search_reports[key] = KcetRandomForest._get_search_report(search, n_samples=len(y_train))
+            logging.info("Grid search took {:.1f} seconds, best parameters: {}".format(elapsed, search.best_params_))
+            for row in self._search_reports[key].itertuples(index=False):
+                logging.info("Rung {}: {} candidates with {} resources, fit {:.1f} s, score {:.1f} s".format(
+                    row.rung, row.n_candidates, row.n_resources, row.fit_time, row.score_time))
+            self._models[key] = (search.best_estimator_, neg_train_vectors, n_pos_train, n_neg_train,
+                                 list(pos_train_vectors.index))
+        return self._models[key][0]
+
+    def _get_search(self):
+        """
+        Return the hyperparameter search for the search mode of the configuration: RandomizedSearchCV with n_iter
+        candidates, or HalvingRandomSearchCV (successive halving) with n_iter candidates (all candidates that can
+        be eliminated down to one if n_iter is 1)
+        """
+        config = self._config
+        random_grid = KcetRandomForest._init_random_grid()
+        # only the search is parallel (see ExecutionConfig); parallel forests within parallel search jobs would start
+        # n_jobs x n_jobs workers
+        rf = RandomForestClassifier(n_jobs=1)
+        if config.search == 'random':
+            return RandomizedSearchCV(estimator=rf, param_distributions=random_grid, n_iter=config.n_iter,
+                                      cv=config.cv, random_state=config.random_state, n_jobs=config.n_jobs,
+                                      pre_dispatch=config.pre_dispatch)
+        max_resources = 'auto'
+        if config.halving_resource == 'n_estimators':
+            # the number of trees is the resource of the rungs, not a parameter of the candidates
+            max_resources = max(random_grid.pop('n_estimators'))
+        n_candidates = 'exhaust' if config.n_iter == 1 else config.n_iter
+        return HalvingRandomSearchCV(estimator=rf, param_distributions=random_grid, n_candidates=n_candidates,
+                                     factor=config.halving_factor, resource=config.halving_resource,
+                                     max_resources=max_resources, cv=config.cv, random_state=config.random_state,
+                                     n_jobs=config.n_jobs)
+
+    @staticmethod
+    def _get_search_report(search, n_samples: int) -> pd.DataFrame:
+        """
+        Summarize the rungs of a search (a randomized search has a single rung that uses all n_samples). The times are the sums of the fit
+        and score times of all candidates and folds of the rung, i.e., CPU time rather than wall-clock time if the
+        search ran in parallel
+        """
+        results = pd.DataFrame(search.cv_results_)
+        n_splits = search.n_splits_
+        if 'iter' not in results.columns:
+            results['iter'] = 0
+            results['n_resources'] = n_samples
+        rows = []
+        for rung, df in results.groupby('iter'):
+            rows.append({'rung': rung,
+                         'n_candidates': len(df),
+                         'n_resources': int(df['n_resources'].iloc[0]),
+                         'fit_time': float(df['mean_fit_time'].sum() * n_splits),
+                         'score_time': float(df['mean_score_time'].sum() * n_splits),
+                         'best_score': float(df['mean_test_score'].max()),
+                         'n_failed': int(df['mean_test_score'].isna().sum())})
+        return pd.DataFrame(rows)
+
+    def get_search_report(self) -> pd.DataFrame:
+        """
+        Return a data frame with one row per rung of the hyperparameter search of the model for the target year and
+        factor, with the columns rung, n_candidates, n_resources, fit_time, score_time (seconds), best_score and
+        n_failed (number of candidates whose fits failed, i.e., whose score is NaN)
+        """
+        key = (self._target_year, self._factor)
+        if key not in self._search_reports:
+            raise ValueError("The model for target year %d has not been trained yet" % self._target_year)
+        return self._search_reports[key]
+
+    def get_metadata(self) -> Dict:
+        """
+        Return the metadata of the model for the target year and factor (trained if necessary), i.e., everything
+        that is needed to check that a saved model matches the data it is applied to
+        """
+        model = self.fit()
+        _, neg_train_vectors, n_pos_train, n_neg_train, pos_train_labels = self._models[
+            (self._target_year, self._factor)]
+        best_params = {k: v for k, v in model.get_params().items() if k in KcetRandomForest._init_random_grid()}
+        return {'model_format_version': MODEL_FORMAT_VERSION,
+                'sklearn_version': sklearn.__version__,
+                'target_year': self._target_year,
+                'n_pk': self._data_generator.n_pk,
+                'factor': self._factor,
+                'embedding_checksum': self._data_generator.get_embedding_store().get_source_checksum(),
+                'random_state': self._config.random_state,
+                'sampling_random_state': self._data_generator.random_state,
+                'best_params': best_params,
+                'n_pos_train': n_pos_train,
+                'n_neg_train': n_neg_train,
+                'positive_training_pairs': pos_train_labels,
+                'negative_training_pairs': list(neg_train_vectors.index)}
+
+    def save(self, path: str) -> None:
+        """
+        Save the model for the target year and factor (trained if necessary) to path (uncompressed joblib file)
+        and its metadata (see get_metadata) to path + '.json'
+        """
+        save_model(path=path, model=self.fit(), metadata=self.get_metadata())
+
+    def load(self, path: str) -> RandomForestClassifier:
+        """
+        Load a model that was saved with save instead of training it. The target year, n_pk, factor and embedding
+        files must be the same as for the saved model; the negative training examples are restored from the
+        metadata so that evaluate excludes them from the negative test examples
+        """
+        model, metadata = load_model(path=path)
+        expected = {'target_year': self._target_year,
+                    'n_pk': self._data_generator.n_pk,
+                    'factor': self._factor,
+                    'embedding_checksum': self._data_generator.get_embedding_store().get_source_checksum()}
+        for name, value in expected.items():
+            if metadata[name] != value:
+                raise ValueError("The model at %s has %s=%s, but %s was expected" % (
+                    path, name, str(metadata[name]), str(value)))
+        neg_train_vectors = self._data_generator.get_difference_vectors_for_labels(
+            metadata['negative_training_pairs'])
+        self._models[(self._target_year, self._factor)] = (model, neg_train_vectors, metadata['n_pos_train'],
+                                                           metadata['n_neg_train'],
+                                                           metadata['positive_training_pairs'])
+        return model
+
+    def score_universe(self, output: str, chunk_size: int = 100000) -> Dict:
+        """
+        Score all candidate pairs for novel predictions with the model for the target year (trained if necessary)
+        and write the scores to the score directory output, using the workers of the configuration
+        (see universe_scorer.score_universe). The negative training examples are excluded.
+        Return the throughput statistics of score_universe
+        """
+        model = self.fit()
+        neg_train_vectors = self._models[(self._target_year, self._factor)][1]
+        return score_universe(data_gen=self._data_generator, model=model, target_year=self._target_year,
+                              output=output, negative_training_df=neg_train_vectors, chunk_size=chunk_size,
+                              config=self._config)
+
+    def score_universe_top_k(self, output: str, k: int = 1000, memory_budget: int = 2 ** 30,
+                             n_shards: int = None) -> pd.DataFrame:
+        """
+        Return the k candidate pairs for novel predictions with the highest probabilities for the model for the
+        target year, scoring within a memory budget (bytes) and checkpointing the shards in the directory output
+        (see universe_scorer.score_universe_top_k)
+        """
+        model = self.fit()
+        neg_train_vectors = self._models[(self._target_year, self._factor)][1]
+        return score_universe_top_k(data_gen=self._data_generator, model=model, target_year=self._target_year,
+                                    output=output, k=k, memory_budget=memory_budget,
+                                    negative_training_df=neg_train_vectors, n_shards=n_shards, config=self._config)
+
+    def evaluate(self, begin_year: int, end_year: int, phase4: bool = False):
+        """
+        Estimate the performance of the model for the target year (see fit) on the clinical trials that started
+        from begin_year to end_year (phase 4 only if phase4 is True). Only the test data is generated for each
+        call; the model is trained once. The negative test examples are disjoint from the negative training examples.
+        Return y_pred, y_test, yproba, n_pos_train, n_neg_train, n_pos_test, n_neg_test
+        """
+        if end_year < begin_year:
+            raise ValueError("End year cannot be before start year")
+        if begin_year < self._target_year:
+            raise ValueError("Begin year cannot be before target year")
+        best_model = self.fit()
+        _, neg_train_vectors, n_pos_train, n_neg_train, _ = self._models[(self._target_year, self._factor)]
+        pos_test_vectors, neg_test_vectors = self._data_generator.get_test_embeddings(
+            target_year=self._target_year, begin_year=begin_year, end_year=end_year,
+            negative_training_df=neg_train_vectors, factor=self._factor, phase4=phase4)
         # Prepare for random forest testing
         n_pos_test = pos_test_vectors.shape[0]
         n_neg_test = neg_test_vectors.shape[0]
-        logging.info(
-            "Setting up RF classification with pos train (difference vectors): {}, neg train {}, pos test {}, neg test {}"
-                .format(n_pos_train, n_neg_train, n_pos_test, n_neg_test))
+        logging.info("Testing RF with pos test (difference vectors): {}, neg test {}".format(n_pos_test, n_neg_test))
         X_test = pd.concat([pos_test_vectors, neg_test_vectors])
         y_test = np.concatenate((np.ones(n_pos_test), np.zeros(n_neg_test)))
-        # Perform random grid search for best parameters using the training data
-        random_grid = KcetRandomForest._init_random_grid()
-        rf = RandomForestClassifier()
-        rf_random = RandomizedSearchCV(estimator=rf, param_distributions=random_grid, n_iter=1, cv=10, random_state=42)
-        rf_random.fit(X_train, y_train)
-        best_model = rf_random.best_estimator_
         # Now estimate the performance on the held out testing data
-        y_pred = best_model.predict(X_test)
-        yproba = best_model.predict_proba(X_test)[::, 1]
+        with self._config.parallel_backend():
+            y_pred = best_model.predict(X_test.values)
+            yproba = best_model.predict_proba(X_test.values)[::, 1]
         return y_pred, y_test, yproba, n_pos_train, n_neg_train, n_pos_test, n_neg_test
 
+    def classify(self, begin_year: int, end_year: int, phase4: bool = False):
+        """
+        Perform random forest learning. From the vectors extracted from the data from the target year, predict
+        clinical trials starting at begin_year and going up to end_year
+        For instance, 
+        target_year = 2010
+        begin_year = 2019
+        end_year = 2020
+        creates test sets from 2019 to 2020.
+        The model is trained at the first call and reused for the following calls (see fit and evaluate)
+        """
+        return self.evaluate(begin_year=begin_year, end_year=end_year, phase4=phase4)
+
     @staticmethod
     def _init_random_grid():
         """
@@ -99,8 +278,9 @@ class KcetRandomForest:
         """
         # Number of trees in random forest
         n_estimators = [100, 200, 300, 400, 500]
-        # Number of features to consider at every split
-        max_features = ['auto', 'sqrt']
+        # Number of features to consider at every split ('auto', which was the same as 'sqrt' for classifiers, was
+        # removed from scikit-learn; 1.0 considers all features)
+        max_features = ['sqrt', 1.0]
         # Maximum number of levels in tree
         max_depth = [10, 20, 30, 40, 50, None]
         # Minimum number of samples required to split a node
@@ -117,3 +297,32 @@ class KcetRandomForest:
                        'min_samples_leaf': min_samples_leaf,
                        'bootstrap': bootstrap}
         return random_grid
+
+
+def save_model(path: str, model: RandomForestClassifier, metadata: Dict) -> None:
+    """
+    Write a fitted model to path with joblib and the metadata to path + '.json'
+    """
+    joblib.dump(model, path)
+    with open(path + '.json', 'w') as f:
+        json.dump(metadata, f, indent=2)
+    logging.info("Saved model for target year {} to {}".format(metadata.get('target_year'), path))
+
+
+def load_model(path: str) -> Tuple[RandomForestClassifier, Dict]:
+    """
+    Read a model and its metadata that were written by save_model. The model is not memory-mapped: scikit-learn
+    copies the node arrays of each tree when the tree is unpickled, so every process that loads the model holds its
+    own copy of the trees.
+    Return the model and the metadata
+    """
+    if not os.path.isfile(path):
+        raise FileNotFoundError("Could not find model file at " + path)
+    with open(path + '.json') as f:
+        metadata = json.load(f)
+    if metadata.get('model_format_version') != MODEL_FORMAT_VERSION:
+        raise ValueError("Unsupported model format version in %s.json" % path)
+    if metadata.get('sklearn_version') != sklearn.__version__:
+        logging.warning("Model at {} was saved with scikit-learn {} but {} is installed".format(
+            path, metadata.get('sklearn_version'), sklearn.__version__))
+    return joblib.load(path), metadata
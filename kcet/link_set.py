@@ -0,0 +1,257 @@
+import numpy as np
+import pandas as pd
+from typing import Set, Tuple, List, Iterable
+
+
+class Link:
+    """
+    Simple class that is intended for use to keep track of positive and negative links using a Hash
+    For our use case, the _kinase field is NCBI Gene IDs for protein kinases and the _cancer field is
+    a MeSH Id for a cancer (descendant of neoplasms)
+    """
+
+    def __init__(self, kinase: str, cancer: str) -> None:
+        self._kinase = kinase
+        self._cancer = cancer
+
+    def __hash__(self):
+        return hash((self._kinase, self._cancer))
+
+    def __eq__(self, other):
+        return self.__class__ == other.__class__ and self._kinase == other.kinase and self._cancer == other.cancer
+
+    @property
+    def kinase(self):
+        return self._kinase
+
+    @property
+    def cancer(self):
+        return self._cancer
+
+    def to_dict(self):
+        return {'mesh_id': self._cancer, 'gene_id': self._kinase}
+
+    def __str__(self):
+        return Link.getLinkKey(cancer_mesh_id=self._cancer, kinase_ncbi_gene_id=self._kinase)
+
+    @staticmethod
+    def getLinkKey(cancer_mesh_id: str, kinase_ncbi_gene_id: str) -> str:
+        return kinase_ncbi_gene_id + "-" + cancer_mesh_id
+
+    @staticmethod
+    def fromDataFrameToLinkSet(df: pd.DataFrame) -> Set:
+        linkset = set()
+        for index, row in df.iterrows():
+            m = row['mesh_id']
+            g = row['gene_id']
+            L = Link(kinase=g, cancer=m)
+            linkset.add(L)
+        return linkset
+
+    @staticmethod
+    def fromEmbeddingsToLinkSet(df: pd.DataFrame) -> Set:
+        """
+        This method goes from the indices of the concept embeddings to Link objects.
+        """
+        linkset = set()
+        for i, row in df.iterrows():
+            # i (the index) is like this ncbigene7010-meshd018195
+            k, c = i.split("-")
+            if not k.startswith('ncbigene'):
+                raise ValueError("Malformed word line, we were expecting the first element to be ncbigene but got {}",
+                                 i)
+            if not c.startswith('meshd'):
+                raise ValueError("Malformed word line, we were expecting the second element to be meshd but got {}", i)
+            L = Link(kinase=k, cancer=c)
+            linkset.add(L)
+        return linkset
+
+
+class KinaseCancerGrid:
+    """
+    The grid of all pairs of protein kinases (NCBI gene ids) and cancers (MeSH ids).
+    Each pair is encoded as an integer pair id, kinase index * number of cancers + cancer index.
+    Ids that are not part of the grid are encoded as -1.
+    """
+
+    def __init__(self, kinase_ids: Iterable[str], cancer_ids: Iterable[str]) -> None:
+        self._kinase_index = pd.Index(list(dict.fromkeys(kinase_ids)))
+        self._cancer_index = pd.Index(list(dict.fromkeys(cancer_ids)))
+        # int32 is enough for the kinase x cancer grid, but not necessarily for all genes x all diseases
+        if self.size <= np.iinfo(np.int32).max:
+            self._dtype = np.int32
+        else:
+            self._dtype = np.int64
+
+    @property
+    def kinase_ids(self) -> pd.Index:
+        return self._kinase_index
+
+    @property
+    def cancer_ids(self) -> pd.Index:
+        return self._cancer_index
+
+    @property
+    def n_kinases(self) -> int:
+        return len(self._kinase_index)
+
+    @property
+    def n_cancers(self) -> int:
+        return len(self._cancer_index)
+
+    @property
+    def size(self) -> int:
+        return self.n_kinases * self.n_cancers
+
+    @property
+    def dtype(self):
+        return self._dtype
+
+    def encode(self, gene_ids, mesh_ids) -> np.ndarray:
+        """
+        Encode kinase/cancer pairs (gene_ids[i], mesh_ids[i]) as integer pair ids
+        """
+        kinase_idx = self._kinase_index.get_indexer(np.asarray(gene_ids, dtype=object))
+        cancer_idx = self._cancer_index.get_indexer(np.asarray(mesh_ids, dtype=object))
+        pair_ids = kinase_idx.astype(np.int64) * self.n_cancers + cancer_idx
+        pair_ids[(kinase_idx < 0) | (cancer_idx < 0)] = -1
+        return pair_ids
+
+    def encode_labels(self, labels: Iterable[str]) -> np.ndarray:
+        """
+        Encode labels such as ncbigene7010-meshd018195 as integer pair ids
+        """
+        pairs = [label.split("-") for label in labels]
+        return self.encode(gene_ids=[k for k, _ in pairs], mesh_ids=[c for _, c in pairs])
+
+    def decode(self, pair_ids) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Return the NCBI gene ids and MeSH ids of the integer pair ids
+        """
+        kinase_idx, cancer_idx = np.divmod(np.asarray(pair_ids, dtype=np.int64), self.n_cancers)
+        return self._kinase_index.values[kinase_idx], self._cancer_index.values[cancer_idx]
+
+    def to_labels(self, pair_ids) -> List[str]:
+        """
+        Convert integer pair ids to labels such as ncbigene5599-meshd000074723
+        """
+        gene_ids, mesh_ids = self.decode(pair_ids)
+        return [Link.getLinkKey(cancer_mesh_id=c, kinase_ncbi_gene_id=k) for k, c in zip(gene_ids, mesh_ids)]
+
+
+class LinkSet:
+    """
+    A compact set of kinase/cancer links backed by a sorted array of unique integer pair ids on a KinaseCancerGrid.
+    Membership, union, difference and intersection are vectorized. Links outside of the grid are ignored.
+    """
+
+    def __init__(self, grid: KinaseCancerGrid, pair_ids=None) -> None:
+        self._grid = grid
+        if pair_ids is None:
+            pair_ids = np.empty(0, dtype=grid.dtype)
+        pair_ids = np.asarray(pair_ids, dtype=np.int64)
+        self._pair_ids = np.unique(pair_ids[pair_ids >= 0]).astype(grid.dtype)
+
+    @staticmethod
+    def from_pairs(grid: KinaseCancerGrid, gene_ids, mesh_ids) -> 'LinkSet':
+        return LinkSet(grid=grid, pair_ids=grid.encode(gene_ids=gene_ids, mesh_ids=mesh_ids))
+
+    @staticmethod
+    def from_data_frame(grid: KinaseCancerGrid, df: pd.DataFrame) -> 'LinkSet':
+        """
+        Create a link set from a data frame with the columns gene_id and mesh_id
+        """
+        return LinkSet.from_pairs(grid=grid, gene_ids=df['gene_id'].values, mesh_ids=df['mesh_id'].values)
+
+    @staticmethod
+    def from_labels(grid: KinaseCancerGrid, labels: Iterable[str]) -> 'LinkSet':
+        """
+        Create a link set from labels such as ncbigene7010-meshd018195, e.g., the index of a difference vector data frame
+        """
+        return LinkSet(grid=grid, pair_ids=grid.encode_labels(labels))
+
+    @staticmethod
+    def from_mask(grid: KinaseCancerGrid, mask: np.ndarray) -> 'LinkSet':
+        """
+        Create a link set from a boolean array (bitset) with one entry per pair of the grid
+        """
+        return LinkSet(grid=grid, pair_ids=np.flatnonzero(np.asarray(mask).ravel()))
+
+    @property
+    def grid(self) -> KinaseCancerGrid:
+        return self._grid
+
+    @property
+    def pair_ids(self) -> np.ndarray:
+        return self._pair_ids
+
+    def __len__(self) -> int:
+        return len(self._pair_ids)
+
+    def __iter__(self):
+        gene_ids, mesh_ids = self._grid.decode(self._pair_ids)
+        for k, c in zip(gene_ids, mesh_ids):
+            yield Link(kinase=k, cancer=c)
+
+    def __contains__(self, item) -> bool:
+        """
+        item can be a Link, a label such as ncbigene7010-meshd018195, or an integer pair id
+        """
+        if isinstance(item, Link):
+            pair_id = self._grid.encode(gene_ids=[item.kinase], mesh_ids=[item.cancer])
+        elif isinstance(item, str):
+            pair_id = self._grid.encode_labels([item])
+        else:
+            pair_id = [item]
+        return bool(self.contains(pair_id)[0])
+
+    def contains(self, pair_ids) -> np.ndarray:
+        """
+        Vectorized membership test; return a boolean array with one entry per pair id
+        """
+        pair_ids = np.asarray(pair_ids, dtype=np.int64)
+        if len(self._pair_ids) == 0:
+            return np.zeros(pair_ids.shape, dtype=bool)
+        pos = np.minimum(np.searchsorted(self._pair_ids, pair_ids), len(self._pair_ids) - 1)
+        return self._pair_ids[pos] == pair_ids
+
+    def _check_grid(self, other: 'LinkSet') -> None:
+        if other.grid is not self._grid:
+            raise ValueError("Cannot combine link sets that are defined on different grids")
+
+    def union(self, other: 'LinkSet') -> 'LinkSet':
+        self._check_grid(other)
+        return LinkSet(grid=self._grid, pair_ids=np.union1d(self._pair_ids, other.pair_ids))
+
+    def difference(self, other: 'LinkSet') -> 'LinkSet':
+        self._check_grid(other)
+        return LinkSet(grid=self._grid, pair_ids=np.setdiff1d(self._pair_ids, other.pair_ids, assume_unique=True))
+
+    def intersection(self, other: 'LinkSet') -> 'LinkSet':
+        self._check_grid(other)
+        return LinkSet(grid=self._grid,
+                       pair_ids=np.intersect1d(self._pair_ids, other.pair_ids, assume_unique=True))
+
+    def __or__(self, other: 'LinkSet') -> 'LinkSet':
+        return self.union(other)
+
+    def __sub__(self, other: 'LinkSet') -> 'LinkSet':
+        return self.difference(other)
+
+    def __and__(self, other: 'LinkSet') -> 'LinkSet':
+        return self.intersection(other)
+
+    def to_mask(self) -> np.ndarray:
+        """
+        Return a boolean array (bitset) with one entry per pair of the grid
+        """
+        mask = np.zeros(self._grid.size, dtype=bool)
+        mask[self._pair_ids] = True
+        return mask
+
+    def to_labels(self) -> List[str]:
+        return self._grid.to_labels(self._pair_ids)
+
+    def to_data_frame(self) -> pd.DataFrame:
+        gene_ids, mesh_ids = self._grid.decode(self._pair_ids)
+        return pd.DataFrame({'gene_id': gene_ids, 'mesh_id': mesh_ids})
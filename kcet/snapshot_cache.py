@@ -0,0 +1,123 @@
+from .embedding_store import file_checksum
+
+import os
+import hashlib
+import numpy as np
+import pandas as pd
+from typing import Callable, List
+import logging
+
+logging.basicConfig(format='%(asctime)s,%(msecs)d %(levelname)-8s [%(filename)s:%(lineno)d] %(message)s',
+                    datefmt='%Y-%m-%d:%H:%M:%S',
+                    filename='kcet.log',
+                    level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# The on-disk cache is opt-in; set this environment variable (or call set_cache_dir) to enable it
+CACHE_DIR_ENV = 'KCET_CACHE_DIR'
+# Increment if the layout of the cached tables changes, so that old snapshots are not used
+SNAPSHOT_VERSION = 1
+
+_cache_dir = None
+# map from path to ((mtime, size), checksum), so that unchanged sources are not hashed again
+_checksums = {}
+
+
+def set_cache_dir(cache_dir: str) -> None:
+    """
+    Enable the snapshot cache for this process and store the snapshots in cache_dir (None disables the cache,
+    unless the KCET_CACHE_DIR environment variable is set)
+    """
+    global _cache_dir
+    _cache_dir = cache_dir
+
+
+def get_cache_dir() -> str:
+    """
+    Return the snapshot cache directory, or None if the cache is disabled
+    """
+    if _cache_dir is not None:
+        return _cache_dir
+    return os.environ.get(CACHE_DIR_ENV)
+
+
+def save_frame(path: str, df: pd.DataFrame) -> None:
+    """
+    Write the columns of a data frame to an uncompressed NPZ file. String columns are stored as fixed-width
+    unicode arrays, so that the file can be read without pickle. The index is not stored.
+    """
+    arrays = {'__columns__': np.array(list(df.columns), dtype=np.str_)}
+    for i, col in enumerate(df.columns):
+        values = df[col].values
+        if values.dtype.kind in 'biuf':
+            arrays['c%d' % i] = values
+        else:
+            missing = pd.isna(values)
+            arrays['c%d' % i] = np.array(['' if m else str(v) for v, m in zip(values, missing)], dtype=np.str_)
+            if missing.any():
+                arrays['m%d' % i] = missing
+    # write to a temporary file first so that an interrupted write does not leave a corrupt snapshot behind
+    tmp_path = "%s.%d.tmp" % (path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, path)
+
+
+def load_frame(path: str) -> pd.DataFrame:
+    """
+    Read a data frame that was written by save_frame
+    """
+    with np.load(path, allow_pickle=False) as data:
+        columns = list(data['__columns__'])
+        frame = {}
+        for i, col in enumerate(columns):
+            values = data['c%d' % i]
+            if values.dtype.kind == 'U':
+                values = values.astype(object)
+                if 'm%d' % i in data:
+                    values[data['m%d' % i]] = np.nan
+            frame[col] = values
+    return pd.DataFrame(frame, columns=columns)
+
+
+def source_checksum(path: str) -> str:
+    """
+    Return the SHA-1 checksum of a source file, hashing the file only if it changed since the last call
+    """
+    path = os.path.realpath(path)
+    st = os.stat(path)
+    stamp = (st.st_mtime_ns, st.st_size)
+    entry = _checksums.get(path)
+    if entry is None or entry[0] != stamp:
+        entry = (stamp, file_checksum(path))
+        _checksums[path] = entry
+    return entry[1]
+
+
+def get_snapshot_path(cache_dir: str, name: str, sources: List[str], params: str = '') -> str:
+    """
+    Return the path of the snapshot of the table called name that was built from the source files with the
+    given parameters. The file name contains a hash of the contents of the sources, so that the snapshot is
+    rebuilt automatically if any of the sources change
+    """
+    key = "%s|%d|%s|%s" % (name, SNAPSHOT_VERSION, params, "|".join(source_checksum(s) for s in sources))
+    return os.path.join(cache_dir, "%s-%s.npz" % (name, hashlib.sha1(key.encode('utf-8')).hexdigest()))
+
+
+def get_frame(name: str, sources: List[str], builder: Callable[[], pd.DataFrame], params: str = '') -> pd.DataFrame:
+    """
+    Return the table builder() from the snapshot cache, or build it (and store a snapshot) if there is no valid
+    snapshot. If the cache is disabled, this is simply builder()
+    """
+    cache_dir = get_cache_dir()
+    if cache_dir is None:
+        return builder()
+    path = get_snapshot_path(cache_dir=cache_dir, name=name, sources=sources, params=params)
+    if os.path.exists(path):
+        logger.info("Reading snapshot %s" % path)
+        return load_frame(path)
+    df = builder()
+    os.makedirs(cache_dir, exist_ok=True)
+    save_frame(path, df)
+    logger.info("Wrote snapshot %s (%d rows)" % (path, len(df)))
+    return df
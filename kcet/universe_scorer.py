@@ -0,0 +1,361 @@
+from .kcet_dataset_generator import KcetDatasetGenerator, iter_difference_vector_chunks
+from .execution_config import ExecutionConfig
+from .link_set import KinaseCancerGrid
+
+import os
+import json
+import time
+import joblib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+from typing import Dict, Tuple
+import logging
+
+logging.basicConfig(format='%(asctime)s,%(msecs)d %(levelname)-8s [%(filename)s:%(lineno)d] %(message)s',
+                    datefmt='%Y-%m-%d:%H:%M:%S',
+                    filename='kcet.log',
+                    level=logging.DEBUG)
+logger = logging.getLogger(__name__)
+
+# The columns of a score file and their (little-endian) dtypes. Each column is a raw binary file in the score
+# directory; the kinase and cancer columns are indices into the kinase_ids and cancer_ids lists of the metadata
+SCORE_COLUMNS = [('kinase_index', '<i4'), ('cancer_index', '<i4'), ('probability', '<f4')]
+SCORE_METADATA = 'scores.json'
+
+# Estimated peak bytes per pair of a chunk in addition to the two float32 copies of the difference vector (the
+# broadcast block and the kept rows): pair ids and mask, the float64 class probabilities of the forest and of one
+# tree, and the float32 probability
+CHUNK_OVERHEAD_BYTES_PER_PAIR = 64
+TOP_K_PLAN = 'plan.json'
+
+# the model of a worker process of score_universe (sent once per process by the pool initializer)
+_worker_model = None
+
+
+class ScoreWriter:
+    """
+    Write (kinase, cancer, probability) rows incrementally to a columnar score directory with one raw binary file
+    per column (see SCORE_COLUMNS) and a JSON file with the kinase and cancer ids and the number of rows. Rows are
+    appended chunk by chunk, so that the scores never have to be held in memory; read_scores memory-maps the columns.
+    Attributes:
+        _path  the score directory
+        _grid  the kinase/cancer grid that the pair ids refer to
+        _metadata  additional entries of the JSON file (e.g., the target year)
+        _files  open column files
+        _n_rows  number of rows written so far
+    """
+
+    def __init__(self, path: str, grid: KinaseCancerGrid, metadata: Dict = None) -> None:
+        os.makedirs(path, exist_ok=True)
+        self._path = path
+        self._grid = grid
+        self._metadata = dict(metadata) if metadata is not None else {}
+        self._files = {name: open(os.path.join(path, name), 'wb') for name, _ in SCORE_COLUMNS}
+        self._n_rows = 0
+
+    @property
+    def n_rows(self) -> int:
+        return self._n_rows
+
+    def write(self, pair_ids: np.ndarray, probabilities: np.ndarray) -> None:
+        """
+        Append the probabilities of the pairs with the given pair ids (see KinaseCancerGrid)
+        """
+        pair_ids = np.asarray(pair_ids, dtype=np.int64)
+        if len(pair_ids) != len(probabilities):
+            raise ValueError("The number of pair ids and probabilities do not match!")
+        columns = {'kinase_index': pair_ids // self._grid.n_cancers,
+                   'cancer_index': pair_ids % self._grid.n_cancers,
+                   'probability': probabilities}
+        for name, dtype in SCORE_COLUMNS:
+            self._files[name].write(np.ascontiguousarray(columns[name], dtype=dtype).tobytes())
+        self._n_rows += len(pair_ids)
+
+    def close(self) -> None:
+        """
+        Close the column files and write the metadata. The score directory is complete only after close
+        """
+        for f in self._files.values():
+            f.close()
+        metadata = dict(self._metadata)
+        metadata.update({'n_rows': self._n_rows,
+                         'columns': [[name, dtype] for name, dtype in SCORE_COLUMNS],
+                         'kinase_ids': list(self._grid.kinase_ids),
+                         'cancer_ids': list(self._grid.cancer_ids)})
+        with open(os.path.join(self._path, SCORE_METADATA), 'w') as f:
+            json.dump(metadata, f)
+
+    def __enter__(self) -> 'ScoreWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            # no metadata, so that the incomplete score directory cannot be read
+            for f in self._files.values():
+                f.close()
+
+
+def read_scores(path: str) -> pd.DataFrame:
+    """
+    Read a score directory written by ScoreWriter (e.g., by score_universe) into a data frame with the columns
+    gene_id, mesh_id and probability, in the order in which the rows were written
+    """
+    with open(os.path.join(path, SCORE_METADATA)) as f:
+        metadata = json.load(f)
+    n_rows = metadata['n_rows']
+    columns = {}
+    for name, dtype in metadata['columns']:
+        if n_rows == 0:
+            columns[name] = np.empty(0, dtype=dtype)
+        else:
+            columns[name] = np.memmap(os.path.join(path, name), dtype=dtype, mode='r', shape=(n_rows,))
+    kinase_ids = np.asarray(metadata['kinase_ids'], dtype=object)
+    cancer_ids = np.asarray(metadata['cancer_ids'], dtype=object)
+    return pd.DataFrame({'gene_id': kinase_ids[columns['kinase_index']],
+                         'mesh_id': cancer_ids[columns['cancer_index']],
+                         'probability': np.array(columns['probability'])})
+
+
+def _predict(model, vectors: np.ndarray) -> np.ndarray:
+    return model.predict_proba(vectors)[:, 1].astype(np.float32)
+
+
+def _init_worker(model) -> None:
+    global _worker_model
+    _worker_model = model
+    # the pool provides the parallelism, so each worker predicts with one thread
+    if 'n_jobs' in model.get_params():
+        model.set_params(n_jobs=1)
+
+
+def _predict_in_worker(vectors: np.ndarray) -> np.ndarray:
+    return _predict(_worker_model, vectors)
+
+
+def score_universe(data_gen: KcetDatasetGenerator, model, target_year: int, output: str,
+                   negative_training_df: pd.DataFrame = None, chunk_size: int = 100000,
+                   config: ExecutionConfig = None) -> Dict:
+    """
+    Score all kinase/cancer pairs that are candidates for novel predictions (see
+    KcetDatasetGenerator.iter_novel_prediction_chunks) with a fitted model and write the probabilities to the
+    score directory output (see ScoreWriter and read_scores).
+    The difference vectors are generated in chunks of at most chunk_size pairs and scored by a pool of workers
+    (config.n_jobs workers; threads if config.backend is 'threading', processes otherwise; no pool for one worker).
+    At most two chunks per worker are in flight, so that memory use is bounded by the chunk size, whatever the number
+    of kinases and cancers. The chunks are written in the order in which they were generated.
+    Return a dictionary with n_pairs, n_chunks, seconds and pairs_per_second
+    """
+    if config is None:
+        config = ExecutionConfig()
+    n_workers = config.n_workers
+    chunks = data_gen.iter_novel_prediction_chunks(target_year=target_year,
+                                                   negative_training_df=negative_training_df, chunk_size=chunk_size)
+    n_chunks = 0
+    start = time.perf_counter()
+    with ScoreWriter(output, grid=data_gen.get_grid(), metadata={'target_year': target_year}) as writer:
+        if n_workers == 1:
+            for pair_ids, vectors in chunks:
+                writer.write(pair_ids, _predict(model, vectors))
+                n_chunks += 1
+        else:
+            if config.backend == 'threading':
+                executor = ThreadPoolExecutor(max_workers=n_workers)
+            else:
+                executor = ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker, initargs=(model,))
+            with executor:
+                pending = deque()
+                for pair_ids, vectors in chunks:
+                    if config.backend == 'threading':
+                        future = executor.submit(_predict, model, vectors)
+                    else:
+                        future = executor.submit(_predict_in_worker, vectors)
+                    pending.append((pair_ids, future))
+                    if len(pending) >= 2 * n_workers:
+                        done_ids, done = pending.popleft()
+                        writer.write(done_ids, done.result())
+                        n_chunks += 1
+                while pending:
+                    done_ids, done = pending.popleft()
+                    writer.write(done_ids, done.result())
+                    n_chunks += 1
+        n_pairs = writer.n_rows
+    seconds = time.perf_counter() - start
+    pairs_per_second = n_pairs / seconds if seconds > 0 else float('inf')
+    logger.info("Scored %d pairs in %d chunks with %d worker(s) in %.1f seconds (%.0f pairs/second)" % (
+        n_pairs, n_chunks, n_workers, seconds, pairs_per_second))
+    return {'n_pairs': n_pairs, 'n_chunks': n_chunks, 'seconds': seconds, 'pairs_per_second': pairs_per_second}
+
+
+def get_chunk_size(memory_budget: int, dimension: int, n_cancers: int, n_workers: int = 1,
+                   fixed_bytes: int = 0) -> int:
+    """
+    Derive the number of pairs per chunk from a memory budget (bytes) for n_workers workers that each score one
+    chunk at a time. fixed_bytes is memory that is needed independently of the chunk size (e.g., the cancer
+    embeddings). Chunks consist of whole kinases, i.e., the chunk size is a multiple of n_cancers.
+    Raise a ValueError if the budget does not suffice for one kinase per worker
+    """
+    bytes_per_pair = 8 * dimension + CHUNK_OVERHEAD_BYTES_PER_PAIR
+    n_pairs = (memory_budget - fixed_bytes) // (n_workers * bytes_per_pair)
+    if n_pairs < n_cancers:
+        raise ValueError("A memory budget of %d bytes is too small for %d worker(s) and %d cancers (at least %d bytes "
+                         "are needed)" % (memory_budget, n_workers, n_cancers,
+                                          fixed_bytes + n_workers * n_cancers * bytes_per_pair))
+    return int(n_pairs // n_cancers * n_cancers)
+
+
+def _merge_top_k(pair_ids: np.ndarray, probabilities: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Keep the k pairs with the highest probabilities (ties are broken by the smaller pair id), sorted by decreasing
+    probability
+    """
+    if len(pair_ids) > k:
+        kth = np.partition(probabilities, len(probabilities) - k)[len(probabilities) - k]
+        keep = probabilities >= kth
+        pair_ids, probabilities = pair_ids[keep], probabilities[keep]
+    order = np.lexsort((pair_ids, -probabilities))[:k]
+    return pair_ids[order], probabilities[order]
+
+
+def _score_shard(model, shard: Dict, chunk_size: int, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Score all pairs of a shard (a block of kinases against all cancers) chunk by chunk and return the running top k
+    """
+    top_ids = np.empty(0, dtype=np.int64)
+    top_probabilities = np.empty(0, dtype=np.float32)
+    for pair_ids, vectors in iter_difference_vector_chunks(chunk_size=chunk_size, **shard):
+        probabilities = _predict(model, vectors)
+        top_ids, top_probabilities = _merge_top_k(np.concatenate((top_ids, pair_ids)),
+                                                  np.concatenate((top_probabilities, probabilities)), k)
+    return top_ids, top_probabilities
+
+
+def _score_shard_in_worker(shard: Dict, chunk_size: int, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    return _score_shard(_worker_model, shard, chunk_size, k)
+
+
+def _get_shard_path(output: str, shard: int) -> str:
+    return os.path.join(output, "shard-%05d.npz" % shard)
+
+
+def _save_shard(output: str, shard: int, pair_ids: np.ndarray, probabilities: np.ndarray) -> None:
+    path = _get_shard_path(output, shard)
+    # write to a temporary file first so that a killed job does not leave a corrupt checkpoint behind
+    tmp_path = "%s.%d.tmp" % (path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, pair_ids=pair_ids, probabilities=probabilities)
+    os.replace(tmp_path, path)
+
+
+def _load_shard(output: str, shard: int) -> Tuple[np.ndarray, np.ndarray]:
+    with np.load(_get_shard_path(output, shard)) as data:
+        return data['pair_ids'], data['probabilities']
+
+
+def _check_plan(output: str, plan: Dict) -> None:
+    """
+    Write the plan of a top-k run to the checkpoint directory, or check that it is the same as the plan of the
+    run that wrote the existing checkpoints
+    """
+    path = os.path.join(output, TOP_K_PLAN)
+    if os.path.exists(path):
+        with open(path) as f:
+            existing = json.load(f)
+        if existing != plan:
+            raise ValueError("The checkpoints in %s were written by a different run (other model, data, k or "
+                             "number of shards); use another directory" % output)
+        return
+    os.makedirs(output, exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(plan, f)
+
+
+def score_universe_top_k(data_gen: KcetDatasetGenerator, model, target_year: int, output: str, k: int = 1000,
+                         memory_budget: int = 2 ** 30, negative_training_df: pd.DataFrame = None,
+                         n_shards: int = None, config: ExecutionConfig = None) -> pd.DataFrame:
+    """
+    Score all kinase/cancer pairs that are candidates for novel predictions and return the k pairs with the highest
+    probabilities as a data frame with the columns gene_id, mesh_id and probability (sorted by decreasing
+    probability). This is meant for universes that are too large to be scored into a file (e.g., all genes against
+    all diseases).
+    The kinases are split into n_shards blocks (default: four per worker) that are scored by config.n_jobs workers
+    (threads if config.backend is 'threading', processes otherwise). Each shard keeps only its running top k, and the
+    chunk size is derived from memory_budget (bytes, for all workers together, see get_chunk_size).
+    The top k of each shard is checkpointed in the directory output as soon as the shard is done. If the job is
+    killed, calling score_universe_top_k again with the same arguments scores only the remaining shards
+    """
+    if config is None:
+        config = ExecutionConfig()
+    if k < 1:
+        raise ValueError("k must be at least 1 but was %d" % k)
+    n_workers = config.n_workers
+    grid = data_gen.get_grid()
+    embeddings = data_gen.get_embedding_store()
+    kinase_idx, cancer_idx, excluded_links = data_gen.get_novel_prediction_candidates(
+        target_year=target_year, negative_training_df=negative_training_df)
+    if len(kinase_idx) == 0 or len(cancer_idx) == 0:
+        return pd.DataFrame({'gene_id': [], 'mesh_id': [], 'probability': np.empty(0, dtype=np.float32)})
+    cancer_vectors = np.asarray(embeddings.get_rows(embeddings.get_row_indices(grid.cancer_ids[cancer_idx])),
+                                dtype=np.float32)
+    chunk_size = get_chunk_size(memory_budget=memory_budget, dimension=embeddings.dimension,
+                                n_cancers=len(cancer_idx), n_workers=n_workers,
+                                fixed_bytes=n_workers * cancer_vectors.nbytes)
+    if n_shards is None:
+        n_shards = 4 * n_workers
+    boundaries = np.linspace(0, len(kinase_idx), min(n_shards, len(kinase_idx)) + 1).astype(np.int64)
+    excluded = np.asarray(excluded_links.pair_ids, dtype=np.int64)
+    _check_plan(output, {'target_year': target_year,
+                        'k': k,
+                        'boundaries': boundaries.tolist(),
+                        'fingerprint': joblib.hash((model, grid.n_cancers, kinase_idx, cancer_idx, excluded))})
+    shards = []
+    for shard in range(len(boundaries) - 1):
+        if not os.path.exists(_get_shard_path(output, shard)):
+            shards.append(shard)
+    logger.info("Scoring %d of %d shards (%d kinases x %d cancers, %d pairs per chunk) with %d worker(s)" % (
+        len(shards), len(boundaries) - 1, len(kinase_idx), len(cancer_idx), chunk_size, n_workers))
+
+    def get_shard(shard: int) -> Dict:
+        block = kinase_idx[boundaries[shard]:boundaries[shard + 1]]
+        lo = block[0] * grid.n_cancers
+        hi = (block[-1] + 1) * grid.n_cancers
+        return {'kinase_idx': block,
+                'kinase_vectors': np.asarray(embeddings.get_rows(embeddings.get_row_indices(grid.kinase_ids[block])),
+                                             dtype=np.float32),
+                'cancer_idx': cancer_idx,
+                'cancer_vectors': cancer_vectors,
+                'n_cancers': grid.n_cancers,
+                'excluded': excluded[(excluded >= lo) & (excluded < hi)]}
+
+    start = time.perf_counter()
+    if n_workers == 1:
+        for shard in shards:
+            _save_shard(output, shard, *_score_shard(model, get_shard(shard), chunk_size, k))
+    else:
+        if config.backend == 'threading':
+            executor = ThreadPoolExecutor(max_workers=n_workers)
+        else:
+            executor = ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker, initargs=(model,))
+        with executor:
+            futures = {}
+            for shard in shards:
+                if config.backend == 'threading':
+                    futures[executor.submit(_score_shard, model, get_shard(shard), chunk_size, k)] = shard
+                else:
+                    futures[executor.submit(_score_shard_in_worker, get_shard(shard), chunk_size, k)] = shard
+            for future in as_completed(futures):
+                _save_shard(output, futures[future], *future.result())
+    seconds = time.perf_counter() - start
+    logger.info("Scored %d shards in %.1f seconds" % (len(shards), seconds))
+    top_ids = []
+    top_probabilities = []
+    for shard in range(len(boundaries) - 1):
+        pair_ids, probabilities = _load_shard(output, shard)
+        top_ids.append(pair_ids)
+        top_probabilities.append(probabilities)
+    pair_ids, probabilities = _merge_top_k(np.concatenate(top_ids), np.concatenate(top_probabilities), k)
+    gene_ids, mesh_ids = grid.decode(pair_ids)
+    return pd.DataFrame({'gene_id': gene_ids, 'mesh_id': mesh_ids, 'probability': probabilities})
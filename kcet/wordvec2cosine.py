@@ -1,76 +1,382 @@
 import pandas as pd
 import numpy as np
-from itertools import islice
-from collections import defaultdict
-from scipy.spatial.distance import cosine
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Tuple
+
+from .embedding_store import EmbeddingStore, iter_row_blocks
+from .execution_config import ExecutionConfig
+from .ivf_index import IvfIndex
+
+
+class SimilarityCache:
+    """
+    Bounded least-recently-used cache of similarity query results. The keys contain the checksum of the embedding
+    and words files (see EmbeddingStore.get_source_checksum), the kind of query, the target word and the number of
+    words, so that results of different embeddings never mix. When the cache holds max_size results, the least
+    recently used result is evicted.
+    Attributes:
+        _entries  map from key to result, in order of use (most recently used last)
+        _hits  number of queries that were answered from the cache
+        _misses  number of queries that were computed
+    """
+
+    def __init__(self, max_size: int = 256) -> None:
+        if max_size < 0:
+            raise ValueError("max_size must not be negative but was %d" % max_size)
+        self._max_size = max_size
+        self._entries = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+        self._lock = threading.RLock()
+
+    def get(self, key: Tuple, compute: Callable):
+        """
+        Return the cached result for the key, or compute(), store and return it
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return self._entries[key]
+            self._misses += 1
+        value = compute()
+        with self._lock:
+            if self._max_size > 0:
+                self._entries[key] = value
+                self._entries.move_to_end(key)
+                while len(self._entries) > self._max_size:
+                    self._entries.popitem(last=False)
+        return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._hits = 0
+            self._misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def max_size(self) -> int:
+        return self._max_size
+
+    @property
+    def hits(self) -> int:
+        return self._hits
+
+    @property
+    def misses(self) -> int:
+        return self._misses
+
+    def __str__(self) -> str:
+        return "SimilarityCache(size=%d, max_size=%d, hits=%d, misses=%d)" % (
+            len(self._entries), self._max_size, self._hits, self._misses)
+
+
+# shared by all Wordvec2Cosine objects that are not given their own cache
+_SIMILARITY_CACHE = SimilarityCache()
+
+
+def get_similarity_cache() -> SimilarityCache:
+    return _SIMILARITY_CACHE
 
 
 class Wordvec2Cosine:
+    """
+    Find the words of an embedding that are most similar, least similar or nearly orthogonal to a target word
+    (cosine similarity). The rows of the embedding matrix are normalized to unit length once (float32), so that the
+    similarities of a target word to the whole vocabulary are a single matrix-vector product, and the top n words
+    are selected with np.argpartition instead of sorting the vocabulary.
+    For interactive use, an approximate nearest-neighbour index (IvfIndex) can be built, saved and memory-mapped
+    (see build_index, save_index, load_index and n_most_similar_words_approx).
+    Attributes:
+        _store  the memory-mapped embeddings
+        _normalized  unit-length float32 copy of the embedding matrix (zero vectors stay zero), built at first use
+        _rows  rows of the matrix that are considered (the first occurrence of each word if the vocabulary has
+               duplicates, which is also the row a target word resolves to), in increasing order
+        _index  approximate nearest-neighbour index (None until build_index or load_index is called)
+        _cache  LRU cache of the results of n_most_similar_words, n_least_similar_words and
+                n_close_to_zero_similar_words (default: the cache that is shared by all instances)
+    """
 
-    def __init__(self, embeddings, words) -> None:
-        embedding = np.load(embeddings, mmap_mode=None, allow_pickle=False, fix_imports=True, encoding='ASCII')
-        word_list = []
-        with open(words) as f:
-            for line in f:
-                word = line[2:-3]
-                word_list.append(word)
-        self._df = pd.DataFrame(data=embedding, index=word_list)
+    def __init__(self, embeddings, words, cache: SimilarityCache = None) -> None:
+        self._embeddings_path = embeddings
+        self._store = EmbeddingStore(embeddings=embeddings, words=words)
+        self._cache = cache if cache is not None else get_similarity_cache()
+        self._df = None
+        self._normalized = None
+        self._rows = None
+        self._index = None
 
     def get_embeddings(self) -> pd.DataFrame:
+        if self._df is None:
+            self._df = self._store.to_data_frame()
         return self._df
 
+    def get_embedding_store(self) -> EmbeddingStore:
+        return self._store
+
+    def get_cache(self) -> SimilarityCache:
+        return self._cache
+
+    def _cached(self, key: Tuple, compute: Callable):
+        """
+        Return a copy of the cached result of a query (the key without the embedding checksum), computing it if needed
+        """
+        return list(self._cache.get((self._store.get_source_checksum(),) + key, compute))
+
+    def _get_normalized_matrix(self) -> np.ndarray:
+        """
+        Return the embedding matrix with rows normalized to unit length (float32)
+        """
+        if self._normalized is None:
+            matrix = np.array(self._store.matrix, dtype=np.float32)
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            norms[norms == 0] = 1
+            matrix /= norms
+            words = self._store.words
+            # a duplicated word resolves to its first row (see EmbeddingStore.get_row_indices)
+            _, first = np.unique(words, return_index=True)
+            self._rows = np.sort(first)
+            self._normalized = matrix
+        return self._normalized
+
+    def _cosine_similarities(self, target_word) -> np.ndarray:
+        """
+        Return the cosine similarities of the target word to the words in the rows self._rows (float32)
+        """
+        row = self._store.get_row_indices([target_word])[0]
+        if row < 0:
+            raise KeyError("Could not find '%s' in the embeddings" % target_word)
+        matrix = self._get_normalized_matrix()
+        return (matrix @ matrix[row])[self._rows]
+
     @staticmethod
-    def _take(n, iterable):
+    def _top_n(scores: np.ndarray, n: int, largest: bool = True) -> np.ndarray:
         """
-        Return the first n items of the iterable as a listsource kcet
+        Return the positions of the n highest (or lowest) scores, sorted by score; ties are in the order of the
+        positions, as with a stable sort of all scores
         """
-        return list(islice(iterable, n))
+        keys = -scores if largest else scores
+        n = min(n, len(keys))
+        if n <= 0:
+            return np.empty(0, dtype=np.int64)
+        if n < len(keys):
+            kth = np.partition(keys, n - 1)[n - 1]
+            candidates = np.flatnonzero(keys <= kth)
+        else:
+            candidates = np.arange(len(keys))
+        order = np.lexsort((candidates, keys[candidates]))
+        return candidates[order[:n]]
+
+    def _to_items(self, positions: np.ndarray, scores: np.ndarray):
+        words = self._store.words[self._rows[positions]]
+        return [(str(w), float(s)) for w, s in zip(words, scores[positions])]
 
     def n_most_similar_words(self, target_word, n):
         """
         Returns a list with the top n words most similar to the target word
         """
-        cosine_similarities = defaultdict()
-        for word in self._df.index:
-            cosine_similarity = 1 - cosine(self._df.loc[target_word], self._df.loc[word])
-            cosine_similarities[word] = cosine_similarity
-        sorted_cosin_similarities = {k: v for k, v in
-                                     sorted(cosine_similarities.items(), key=lambda item: item[1], reverse=True)}
-        n_items = Wordvec2Cosine._take(n, sorted_cosin_similarities.items())
-        return n_items
+        def compute():
+            scores = self._cosine_similarities(target_word)
+            return self._to_items(Wordvec2Cosine._top_n(scores, n, largest=True), scores)
+
+        return self._cached(('most', target_word, n), compute)
 
     def n_most_similar_words_df(self, target_word, n):
         n_items = self.n_most_similar_words(target_word=target_word, n=n)
         return pd.DataFrame(n_items, columns=["word", "similarity"])
 
     def n_least_similar_words(self, target_word, n):
-        cosine_similarities = defaultdict()
-        for word in self._df.index:
-            cosine_similarity = 1 - cosine(self._df.loc[target_word], self._df.loc[word])
-            cosine_similarities[word] = cosine_similarity
-        sorted_cosin_similarities = {k: v for k, v in
-                                     sorted(cosine_similarities.items(), key=lambda item: item[1], reverse=False)}
-        n_items = Wordvec2Cosine._take(n, sorted_cosin_similarities.items())
-        return n_items
+        def compute():
+            scores = self._cosine_similarities(target_word)
+            return self._to_items(Wordvec2Cosine._top_n(scores, n, largest=False), scores)
+
+        return self._cached(('least', target_word, n), compute)
 
     def n_least_similar_words_df(self, target_word, n):
         n_items = self.n_least_similar_words(target_word=target_word, n=n)
         return pd.DataFrame(n_items, columns=["word", "similarity"])
 
-    def n_close_to_zero_similar_words(self, target_word, n, e):
-        cosine_similarities = defaultdict()
-        for word in self._df.index:
-            cosine_similarity = 1 - cosine(self._df.loc[target_word], self._df.loc[word])
-            if np.abs(cosine_similarity) < e:
-                cosine_similarities[word] = cosine_similarity
-
-        sorted_cosin_similarities = {k: v for k, v in
-                                     sorted(cosine_similarities.items(), key=lambda item: item[1], reverse=False)}
-        if n < len(sorted_cosin_similarities):
-            n_items = Wordvec2Cosine._take(n, sorted_cosin_similarities.items())
+    def most_similar_batch(self, words: List[str], k: int, block_size: int = 128,
+                           config: ExecutionConfig = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find the k most similar words of each of the target words. The similarities are computed block by block
+        (block_size targets against the whole vocabulary, i.e., block_size x n_words float32 scores in memory per
+        worker) with matrix-matrix products; the blocks are processed by config.n_jobs threads.
+        Return two arrays of shape (n_targets, k): the rows of the embedding matrix of the neighbours (see
+        get_embedding_store().words) and their similarities, sorted by decreasing similarity. The target word itself
+        is included, as with n_most_similar_words. Raises a KeyError if any of the words are not in the vocabulary
+        """
+        if config is None:
+            config = ExecutionConfig()
+        if block_size < 1:
+            raise ValueError("block_size must be at least 1 but was %d" % block_size)
+        target_rows = self._store.get_row_indices(words)
+        if np.any(target_rows < 0):
+            missing = [w for w, row in zip(words, target_rows) if row < 0]
+            raise KeyError("Could not find %d words in the embeddings, e.g., '%s'" % (len(missing), missing[0]))
+        matrix = self._get_normalized_matrix()
+        k = min(k, len(self._rows))
+        has_duplicates = len(self._rows) < matrix.shape[0]
+        indices = np.empty((len(target_rows), k), dtype=np.int64)
+        scores = np.empty((len(target_rows), k), dtype=np.float32)
+
+        def search_block(start: int) -> None:
+            block = slice(start, start + block_size)
+            block_scores = matrix[target_rows[block]] @ matrix.T
+            if has_duplicates:
+                block_scores = block_scores[:, self._rows]
+            top = np.argpartition(-block_scores, k - 1, axis=1)[:, :k]
+            top_scores = np.take_along_axis(block_scores, top, axis=1)
+            top_rows = self._rows[top]
+            # ties are broken by row, as in most_similar_streaming (argpartition does not keep the row order)
+            order = np.lexsort((top_rows, -top_scores), axis=1)
+            indices[block] = np.take_along_axis(top_rows, order, axis=1)
+            scores[block] = np.take_along_axis(top_scores, order, axis=1)
+
+        starts = range(0, len(target_rows), block_size)
+        if config.n_workers == 1 or len(starts) == 1:
+            for start in starts:
+                search_block(start)
         else:
-            n_items = Wordvec2Cosine._take(len(sorted_cosin_similarities), sorted_cosin_similarities.items())
-        return n_items
+            with ThreadPoolExecutor(max_workers=config.n_workers) as executor:
+                # numpy releases the GIL in the matrix products, so the threads run in parallel
+                list(executor.map(search_block, starts))
+        return indices, scores
+
+    def most_similar_streaming(self, words: List[str], k: int, block_rows: int = 65536) -> \
+            Tuple[np.ndarray, np.ndarray, Dict]:
+        """
+        Find the k most similar words of each of the target words without loading or normalizing the whole
+        embedding matrix: the embedding file is read in blocks of block_rows rows (see iter_row_blocks), and a
+        running top k is kept per target word. Memory use does not depend on the size of the vocabulary: the peak
+        per block is about block_rows x (4 x dimension + 12 x n_targets) bytes (the block, its float32 scores and
+        the int64 positions of np.argpartition), e.g., about 1 GB for 1,200 targets and 65,536 rows, so block_rows
+        should be reduced for large batches of targets. Unlike the other queries, duplicated words are not merged.
+        Return the rows of the neighbours and their similarities as (n_targets, k) arrays (sorted by decreasing
+        similarity, see most_similar_batch) and a dictionary with the statistics blocks, bytes_read and seconds
+        """
+        start_time = time.perf_counter()
+        queries = np.array(self._store.get_vectors(words), dtype=np.float32)
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        queries /= norms
+        k = min(k, len(self._store))
+        top_rows = np.full((len(queries), k), -1, dtype=np.int64)
+        top_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        n_blocks = 0
+        bytes_read = 0
+        for start, block in iter_row_blocks(self._embeddings_path, block_rows=block_rows):
+            n_blocks += 1
+            bytes_read += block.nbytes
+            vectors = np.asarray(block, dtype=np.float32)
+            block_norms = np.linalg.norm(vectors, axis=1)
+            block_norms[block_norms == 0] = 1
+            scores = queries @ vectors.T
+            scores /= block_norms
+            # top k of the block first, then merge these n_targets x k candidates with the top k so far
+            if scores.shape[1] > k:
+                kth = scores.shape[1] - k
+                idx = np.argpartition(scores, kth, axis=1)[:, kth:]
+                scores = np.take_along_axis(scores, idx, axis=1)
+            else:
+                idx = np.arange(scores.shape[1])[None, :]
+            rows = np.concatenate((top_rows, np.broadcast_to(start + idx, scores.shape)), axis=1)
+            scores = np.concatenate((top_scores, scores), axis=1)
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            top_rows = np.take_along_axis(rows, top, axis=1)
+            top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.lexsort((top_rows, -top_scores), axis=1)
+        top_rows = np.take_along_axis(top_rows, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+        stats = {'blocks': n_blocks, 'bytes_read': bytes_read, 'seconds': time.perf_counter() - start_time}
+        return top_rows, top_scores, stats
+
+    def build_index(self, n_lists: int = None, n_iter: int = 10, random_state: int = 42) -> IvfIndex:
+        """
+        Build an approximate nearest-neighbour index of the embeddings (see IvfIndex.build) and use it for
+        n_most_similar_words_approx
+        """
+        matrix = self._get_normalized_matrix()
+        self._index = IvfIndex.build(vectors=matrix[self._rows], ids=self._rows, n_lists=n_lists, n_iter=n_iter,
+                                     random_state=random_state,
+                                     metadata={'source_checksum': self._store.get_source_checksum()})
+        return self._index
+
+    def save_index(self, path: str) -> None:
+        if self._index is None:
+            raise ValueError("There is no index to save; call build_index first")
+        self._index.save(path)
+
+    def load_index(self, path: str) -> IvfIndex:
+        """
+        Memory-map an index that was saved with save_index. The index must have been built from the same embedding
+        and words files
+        """
+        index = IvfIndex.load(path)
+        if index.metadata.get('source_checksum') != self._store.get_source_checksum():
+            raise ValueError("The index at %s was built from different embeddings" % path)
+        self._index = index
+        return index
+
+    def n_most_similar_words_approx(self, target_word, n, n_probe: int = 8):
+        """
+        Returns a list with (approximately) the top n words most similar to the target word, using the index
+        (see build_index and load_index). More probes give results that are closer to n_most_similar_words
+        """
+        if self._index is None:
+            raise ValueError("There is no index; call build_index or load_index first")
+        row = self._store.get_row_indices([target_word])[0]
+        if row < 0:
+            raise KeyError("Could not find '%s' in the embeddings" % target_word)
+        rows, scores = self._index.search(np.asarray(self._store.matrix[row], dtype=np.float32), k=n, n_probe=n_probe)
+        return [(str(w), float(s)) for w, s in zip(self._store.words[rows], scores)]
+
+    def benchmark_index(self, n_queries: int = 100, k: int = 10, n_probes: List[int] = None,
+                        random_state: int = 0) -> pd.DataFrame:
+        """
+        Compare the index with the exact search for n_queries random words of the vocabulary. Return a data frame
+        with one row per probe count and the columns n_probe, recall (fraction of the exact top k that is found),
+        ms_per_query and exact_ms_per_query
+        """
+        if self._index is None:
+            raise ValueError("There is no index; call build_index or load_index first")
+        if n_probes is None:
+            n_probes = [1, 2, 4, 8, 16, 32]
+        matrix = self._get_normalized_matrix()
+        rng = np.random.default_rng(random_state)
+        queries = rng.choice(self._rows, size=min(n_queries, len(self._rows)), replace=False)
+        start = time.perf_counter()
+        exact = []
+        for row in queries:
+            scores = (matrix @ matrix[row])[self._rows]
+            exact.append(set(self._rows[Wordvec2Cosine._top_n(scores, k)]))
+        exact_ms = 1000 * (time.perf_counter() - start) / len(queries)
+        results = []
+        for n_probe in n_probes:
+            start = time.perf_counter()
+            found = [self._index.search(matrix[row], k=k, n_probe=n_probe)[0] for row in queries]
+            ms = 1000 * (time.perf_counter() - start) / len(queries)
+            recall = np.mean([len(expected.intersection(rows)) / len(expected) for expected, rows in zip(exact, found)])
+            results.append({'n_probe': n_probe, 'recall': recall, 'ms_per_query': ms, 'exact_ms_per_query': exact_ms})
+        return pd.DataFrame(results)
+
+    def n_close_to_zero_similar_words(self, target_word, n, e):
+        """
+        Returns a list with up to n words whose similarity to the target word is in the band (-e, e), in increasing
+        order of similarity
+        """
+        def compute():
+            scores = self._cosine_similarities(target_word)
+            band = np.flatnonzero(np.abs(scores) < e)
+            return self._to_items(band[Wordvec2Cosine._top_n(scores[band], n, largest=False)], scores)
+
+        return self._cached(('zero', target_word, n, e), compute)
 
     def n_close_to_zero_similar_words_df(self, target_word, n, e):
         n_items = self.n_close_to_zero_similar_words(target_word=target_word, n=n, e=e)
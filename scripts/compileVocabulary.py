@@ -0,0 +1,18 @@
+import argparse
+import os
+import sys
+sys.path.insert(0, os.path.abspath('..'))
+
+# Write a compiled vocabulary next to an embedding file (one-time step).
+# KcetDatasetGenerator and Wordvec2Cosine then load the vocabulary in one bulk read
+# instead of parsing the words file line by line.
+
+from kcet.embedding_store import compile_vocabulary
+
+parser = argparse.ArgumentParser(description='Compile the vocabulary of a word/concept embedding')
+parser.add_argument('--embeddings', type=str, required=True, help='e.g., embedding_SG_dim100_upto2010.npy')
+parser.add_argument('--words', type=str, required=True, help='e.g., words_SG_upto2010.txt')
+args = parser.parse_args()
+
+vocabulary = compile_vocabulary(embeddings=args.embeddings, words=args.words)
+print("Wrote compiled vocabulary to {}".format(vocabulary))
@@ -0,0 +1,22 @@
+import argparse
+import os
+import sys
+sys.path.insert(0, os.path.abspath('..'))
+
+# Extract the protein kinase (ncbigene) and cancer (meshd) rows of an embedding into a compact file
+# that can be passed to KcetDatasetGenerator instead of the full embedding, e.g.,
+# KcetDatasetGenerator(clinical_trials=ctfile, embeddings='embedding_SG_dim100_upto2010.kinase_cancer.npz')
+
+from kcet.embedding_extract import extract_kinase_cancer_embeddings
+
+parser = argparse.ArgumentParser(description='Extract kinase and cancer embeddings')
+parser.add_argument('--embeddings', type=str, required=True, help='e.g., embedding_SG_dim100_upto2010.npy')
+parser.add_argument('--words', type=str, required=True, help='e.g., words_SG_upto2010.txt')
+parser.add_argument('--outfilename', type=str, default=None)
+parser.add_argument('--overwrite', action='store_true')
+args = parser.parse_args()
+
+extract, coverage = extract_kinase_cancer_embeddings(embeddings=args.embeddings, words=args.words,
+                                                     extract=args.outfilename, overwrite=args.overwrite)
+print("Wrote kinase/cancer embeddings to {}".format(extract))
+print(coverage.to_string(index=False))
@@ -8,6 +8,7 @@ import matplotlib
 import matplotlib.pyplot as plt
 sys.path.insert(0, os.path.abspath('..'))
 from kcet import KcetDatasetGenerator, KcetRandomForest
+from kcet.embedding_extract import extract_kinase_cancer_embeddings
 
 
 plt.rc('axes', labelsize=18)
@@ -32,6 +33,10 @@ if not os.path.isfile(embeddings2014):
 if not os.path.isfile(words2014):
     raise FileNotFoundError("Could not find 2014 words file at %s" % words2014)
 
+# The classifier only needs the kinase and cancer rows of the embeddings; extract them once (cached on disk)
+extract2010, coverage2010 = extract_kinase_cancer_embeddings(embeddings=embeddings2010, words=words2010)
+print(coverage2010)
+
 
 def year_label(begin_year: int, end_year: int):
     if begin_year == end_year:
@@ -75,17 +80,27 @@ def plot_one_precision_recall_curve(axis, y_test, y_pred, begin_year: int, end_y
     return best_threshold, best_f1, precision_at_threshold, recall_at_threshold, auc_recall_precision
 
 
-def rrf(targetyear: int, test_years: list, outname: str, n_pk: int, phase4: bool):
+# The training data depends only on the target year and n_pk, so we train one forest for each combination and
+# evaluate it for all figures (phase 4/all phases and all test windows)
+random_forests = {}
+
+
+def get_random_forest(targetyear: int, n_pk: int) -> KcetRandomForest:
     if targetyear == 2010:
-        embeddings = embeddings2010
-        words = words2010
+        extract = extract2010
     elif targetyear == 2014:
-        embeddings = embeddings2010
-        words = words2010
+        extract = extract2010
     else:
         raise ValueError("Invalid target year {}".format(targetyear))
-    datagen = KcetDatasetGenerator(clinical_trials=ctfile, embeddings=embeddings, words=words, n_pk=n_pk)
-    krf = KcetRandomForest(data_gen=datagen, target=targetyear, embedddingfile=embeddings2010, wordsfile=words2010)
+    if (targetyear, n_pk) not in random_forests:
+        datagen = KcetDatasetGenerator(clinical_trials=ctfile, embeddings=extract, n_pk=n_pk)
+        random_forests[(targetyear, n_pk)] = KcetRandomForest(data_gen=datagen, target=targetyear,
+                                                              embedddingfile=embeddings2010, wordsfile=words2010)
+    return random_forests[(targetyear, n_pk)]
+
+
+def rrf(targetyear: int, test_years: list, outname: str, n_pk: int, phase4: bool):
+    krf = get_random_forest(targetyear=targetyear, n_pk=n_pk)
     fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(16, 8))
     font = {'family': 'normal', 'size': 18}
     matplotlib.rc('font', **font)
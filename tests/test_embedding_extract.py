@@ -0,0 +1,77 @@
+from kcet.embedding_extract import extract_kinase_cancer_embeddings
+from kcet.embedding_store import EmbeddingStore
+from kcet.kcet_dataset_generator import KcetDatasetGenerator
+import os
+import tempfile
+import numpy as np
+from unittest import TestCase
+
+
+class TestEmbeddingExtract(TestCase):
+    """
+    The fake embedding has two protein kinases (EGFR, ERBB2) and one cancer (NSCLC) among other words
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls._tmpdir = tempfile.TemporaryDirectory()
+        words = ['cell', 'ncbigene1956', 'meshd002289', 'patient', 'ncbigene2064']
+        cls.matrix = np.arange(len(words) * 4, dtype=np.float32).reshape(len(words), 4)
+        cls.embeddings_path = os.path.join(cls._tmpdir.name, 'embeddings.npy')
+        cls.words_path = os.path.join(cls._tmpdir.name, 'words.txt')
+        np.save(cls.embeddings_path, cls.matrix)
+        with open(cls.words_path, 'w') as f:
+            for w in words:
+                f.write("['%s']\n" % w)
+        cls.extract, cls.coverage = extract_kinase_cancer_embeddings(embeddings=cls.embeddings_path,
+                                                                     words=cls.words_path)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._tmpdir.cleanup()
+
+    def test_coverage(self):
+        coverage = self.coverage.set_index('category')
+        self.assertEqual(2, coverage.loc['protein kinase', 'found'])
+        self.assertEqual(1, coverage.loc['cancer', 'found'])
+
+    def test_extract_contains_only_kinases_and_cancers(self):
+        store = EmbeddingStore.from_extract(self.extract)
+        self.assertEqual(3, len(store))
+        self.assertFalse('cell' in store)
+        self.assertTrue(np.array_equal(self.matrix[2], store.get_vector('meshd002289')))
+
+    def test_reuse_extract(self):
+        extract, coverage = extract_kinase_cancer_embeddings(embeddings=self.embeddings_path, words=self.words_path)
+        self.assertEqual(self.extract, extract)
+        self.assertTrue(self.coverage.equals(coverage))
+
+    def test_stale_extract(self):
+        other_path = os.path.join(self._tmpdir.name, 'other_embeddings.npy')
+        np.save(other_path, self.matrix + 1)
+        with self.assertRaises(ValueError):
+            EmbeddingStore.from_extract(self.extract, embeddings=other_path, words=self.words_path)
+        store = EmbeddingStore.from_extract(self.extract, embeddings=self.embeddings_path, words=self.words_path)
+        self.assertEqual(3, len(store))
+
+    def test_extract_validated_by_stamp(self):
+        # the source files are not hashed if their modification time and size match the stamp of the extract
+        with tempfile.TemporaryDirectory() as tmpdir:
+            embeddings_path = os.path.join(tmpdir, 'embeddings.npy')
+            np.save(embeddings_path, self.matrix)
+            extract, _ = extract_kinase_cancer_embeddings(embeddings=embeddings_path, words=self.words_path)
+            st = os.stat(embeddings_path)
+            np.save(embeddings_path, self.matrix + 1)
+            os.utime(embeddings_path, ns=(st.st_atime_ns, st.st_mtime_ns))
+            EmbeddingStore.from_extract(extract, embeddings=embeddings_path, words=self.words_path)
+            os.utime(embeddings_path, ns=(st.st_atime_ns, st.st_mtime_ns + 1))
+            with self.assertRaises(ValueError):
+                EmbeddingStore.from_extract(extract, embeddings=embeddings_path, words=self.words_path)
+
+    def test_dataset_generator_from_extract(self):
+        current_dir = os.path.dirname(__file__)
+        ct_by_phase_path = os.path.join(current_dir, 'data', 'small_ct_by_phase.tsv')
+        data_generator = KcetDatasetGenerator(clinical_trials=ct_by_phase_path, embeddings=self.extract)
+        # EGFR/NSCLC and ERBB2/NSCLC (phase 4, 2014) have embeddings; ERBB4 does not
+        df_pos_training = data_generator.get_pos_training_embeddings(target_year=2015)
+        self.assertEqual(2, df_pos_training.shape[0])
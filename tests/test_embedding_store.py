@@ -0,0 +1,82 @@
+from kcet.embedding_store import EmbeddingStore, compile_vocabulary, get_vocabulary_path
+import os
+import tempfile
+import numpy as np
+from unittest import TestCase
+
+
+class TestEmbeddingStore(TestCase):
+    """
+    Check word lookup and vector retrieval for a small embedding written to a temporary directory.
+    The words file stores each label as line[2:-3], e.g., ['cell']
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls._tmpdir = tempfile.TemporaryDirectory()
+        cls.words = ['cell', 'ncbigene1956', 'meshd002289', 'patient', 'ncbigene2064', 'cell']
+        cls.matrix = np.arange(len(cls.words) * 4, dtype=np.float32).reshape(len(cls.words), 4)
+        cls.embeddings_path = os.path.join(cls._tmpdir.name, 'embeddings.npy')
+        cls.words_path = os.path.join(cls._tmpdir.name, 'words.txt')
+        np.save(cls.embeddings_path, cls.matrix)
+        with open(cls.words_path, 'w') as f:
+            for w in cls.words:
+                f.write("['%s']\n" % w)
+        cls.store = EmbeddingStore(embeddings=cls.embeddings_path, words=cls.words_path)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.store = None
+        cls._tmpdir.cleanup()
+
+    def test_shape(self):
+        self.assertEqual(6, len(self.store))
+        self.assertEqual(4, self.store.dimension)
+        self.assertEqual(self.words, list(self.store.words))
+
+    def test_contains(self):
+        self.assertTrue('meshd002289' in self.store)
+        self.assertFalse('meshd999999' in self.store)
+
+    def test_row_indices(self):
+        rows = self.store.get_row_indices(['ncbigene2064', 'FAKE', 'ncbigene1956', 'cell'])
+        # a duplicated word resolves to its first row
+        self.assertEqual([4, -1, 1, 0], list(rows))
+
+    def test_get_vector(self):
+        vec = self.store.get_vector('patient')
+        self.assertTrue(np.array_equal(self.matrix[3], vec))
+        with self.assertRaises(KeyError):
+            self.store.get_vector('FAKE')
+
+    def test_get_vectors(self):
+        vecs = self.store.get_vectors(['meshd002289', 'ncbigene1956'])
+        self.assertTrue(np.array_equal(self.matrix[[2, 1]], vecs))
+
+    def test_to_data_frame(self):
+        df = self.store.to_data_frame()
+        self.assertEqual((6, 4), df.shape)
+        self.assertTrue(np.array_equal(self.matrix[3], df.loc['patient'].values))
+
+    def test_compiled_vocabulary(self):
+        vocabulary = compile_vocabulary(embeddings=self.embeddings_path, words=self.words_path)
+        try:
+            self.assertEqual(get_vocabulary_path(self.embeddings_path), vocabulary)
+            store = EmbeddingStore(embeddings=self.embeddings_path, words=self.words_path)
+            self.assertEqual(self.words, list(store.words))
+            self.assertEqual([4, -1, 0], list(store.get_row_indices(['ncbigene2064', 'FAKE', 'cell'])))
+        finally:
+            os.remove(vocabulary)
+
+    def test_stale_compiled_vocabulary_is_ignored(self):
+        words_path = os.path.join(self._tmpdir.name, 'words_stale.txt')
+        with open(words_path, 'w') as f:
+            for w in reversed(self.words):
+                f.write("['%s']\n" % w)
+        vocabulary = compile_vocabulary(embeddings=self.embeddings_path, words=words_path)
+        try:
+            # the sidecar was compiled from a different words file and must not be used
+            store = EmbeddingStore(embeddings=self.embeddings_path, words=self.words_path)
+            self.assertEqual(self.words, list(store.words))
+        finally:
+            os.remove(vocabulary)
@@ -0,0 +1,42 @@
+from kcet.first_occurrence_index import FirstOccurrenceIndex, NEVER
+from kcet.link_set import KinaseCancerGrid
+import pandas as pd
+from unittest import TestCase
+
+
+class TestFirstOccurrenceIndex(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.grid = KinaseCancerGrid(kinase_ids=['ncbigene1956', 'ncbigene2064'],
+                                    cancer_ids=['meshd002289', 'meshd009101', 'meshd001749'])
+        links = pd.DataFrame([
+            ['ncbigene1956', 'meshd002289', 'Phase 1', 2009],
+            ['ncbigene1956', 'meshd002289', 'Phase 2', 2007],
+            ['ncbigene1956', 'meshd002289', 'Phase 4', 2014],
+            ['ncbigene2064', 'meshd009101', 'Phase 1', 2020],
+            ['ncbigene2064', 'meshd009101', 'Phase 2', 2015],
+            ['ncbigene2064', 'meshd001749', 'Phase 4', 2016],
+            ['ncbigene2064', 'meshd001749', 'Phase 4', 2018],
+            ['ncbigeneFAKE', 'meshd001749', 'Phase 4', 2010],
+        ], columns=['gene_id', 'mesh_id', 'phase', 'year'])
+        cls.index = FirstOccurrenceIndex(grid=cls.grid, links=links)
+
+    def test_earliest_year(self):
+        self.assertEqual((2, 3, 4), self.index.years.shape)
+        self.assertEqual(2007, self.index.get_first_years()[0, 0])
+        self.assertEqual(2014, self.index.get_first_years(phase4=True)[0, 0])
+        self.assertEqual(2016, self.index.get_first_years(phase4=True)[1, 2])
+        self.assertEqual(NEVER, self.index.get_first_years()[0, 1])
+
+    def test_links_up_to(self):
+        self.assertEqual(['ncbigene1956-meshd002289'], self.index.get_links_up_to(2010).to_labels())
+        self.assertEqual(0, len(self.index.get_links_up_to(2010, phase4=True)))
+        self.assertEqual(3, len(self.index.get_links_up_to(2020)))
+
+    def test_new_links(self):
+        new_links = self.index.get_new_links(target_year=2010, begin_year=2011, end_year=2016)
+        self.assertEqual(['ncbigene2064-meshd009101', 'ncbigene2064-meshd001749'], new_links.to_labels())
+        # NSCLC/EGFR is a new phase 4 link, but it was already tested before the target year
+        new_links = self.index.get_new_links(target_year=2010, begin_year=2011, end_year=2020, phase4=True)
+        self.assertEqual(['ncbigene2064-meshd001749'], new_links.to_labels())
@@ -0,0 +1,61 @@
+from kcet import KcetParser, CTParserByPhase
+from kcet.input_registry import InputRegistry, get_registry, get_target_level_df, parse_neoplasms_labels
+import os
+import tempfile
+from unittest import TestCase
+
+
+class TestInputRegistry(TestCase):
+    """
+    Check that each input file is parsed once per process and re-parsed if it changes
+    """
+
+    def test_parsers_share_inputs(self):
+        KcetParser()
+        n_parsed = get_registry().n_parsed
+        kcet_parser = KcetParser()
+        self.assertEqual(n_parsed, get_registry().n_parsed)
+        current_dir = os.path.dirname(__file__)
+        ct_by_phase_path = os.path.join(current_dir, 'data', 'small_ct_by_phase.tsv')
+        ct_parser = CTParserByPhase(clinical_trials=ct_by_phase_path)
+        n_parsed = get_registry().n_parsed
+        CTParserByPhase(clinical_trials=ct_by_phase_path)
+        self.assertEqual(n_parsed, get_registry().n_parsed)
+        # both parsers use the same (read-only) symbol to NCBI gene id map
+        self.assertIs(kcet_parser.get_symbol_to_id_map(), ct_parser.gene_symbol_to_ncbigene_map)
+        with self.assertRaises(TypeError):
+            kcet_parser.get_symbol_to_id_map()['FAKE'] = 'ncbigene0'
+
+    def test_changed_file_is_parsed_again(self):
+        registry = InputRegistry()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'neoplasms_labels.tsv')
+            with open(path, 'w') as f:
+                f.write("D000008\tAbdominal Neoplasms\n")
+            first = registry.get(path, parse_neoplasms_labels)
+            self.assertTrue(first.equals(registry.get(path, parse_neoplasms_labels)))
+            self.assertEqual(1, registry.n_parsed)
+            with open(path, 'w') as f:
+                f.write("D000008\tAbdominal Neoplasms\nD000069293\tPlasmablastic Lymphoma\n")
+            second = registry.get(path, parse_neoplasms_labels)
+            self.assertEqual(2, registry.n_parsed)
+            self.assertEqual(['meshd000008', 'meshd000069293'], list(second['mesh_id']))
+            self.assertEqual(['Abdominal Neoplasms', 'Plasmablastic Lymphoma'], list(second['disease']))
+
+    def test_modified_table_does_not_leak_into_cache(self):
+        registry = InputRegistry()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'neoplasms_labels.tsv')
+            with open(path, 'w') as f:
+                f.write("D000008\tAbdominal Neoplasms\n")
+            first = registry.get(path, parse_neoplasms_labels)
+            first.loc[0, 'disease'] = 'Modified'
+            first['extra'] = 1
+            second = registry.get(path, parse_neoplasms_labels)
+            self.assertEqual(1, registry.n_parsed)
+            self.assertEqual(['mesh_id', 'disease'], list(second.columns))
+            self.assertEqual('Abdominal Neoplasms', second.loc[0, 'disease'])
+        target_levels = get_target_level_df()
+        sym = target_levels['Sym'].iloc[0]
+        target_levels.loc[target_levels.index[0], 'Sym'] = 'MODIFIED'
+        self.assertEqual(sym, get_target_level_df()['Sym'].iloc[0])
@@ -0,0 +1,69 @@
+from kcet.ivf_index import IvfIndex
+from kcet.wordvec2cosine import Wordvec2Cosine
+import os
+import tempfile
+import numpy as np
+from unittest import TestCase
+
+
+class TestIvfIndex(TestCase):
+    """
+    Build an IVF index of 2000 vectors around 20 random centres (10 dimensions)
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls._tmpdir = tempfile.TemporaryDirectory()
+        rng = np.random.default_rng(0)
+        centres = rng.normal(size=(20, 10))
+        cls.matrix = (centres[rng.integers(0, 20, size=2000)] + 0.3 * rng.normal(size=(2000, 10))).astype(np.float32)
+        cls.embeddings = os.path.join(cls._tmpdir.name, 'embeddings.npy')
+        cls.words = os.path.join(cls._tmpdir.name, 'words.txt')
+        np.save(cls.embeddings, cls.matrix)
+        with open(cls.words, 'w') as f:
+            for i in range(len(cls.matrix)):
+                f.write("['word%d']\n" % i)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._tmpdir.cleanup()
+
+    def test_exhaustive_search_is_exact(self):
+        index = IvfIndex.build(self.matrix, n_lists=16)
+        self.assertEqual(16, index.n_lists)
+        self.assertEqual(2000, len(index))
+        normalized = self.matrix / np.linalg.norm(self.matrix, axis=1, keepdims=True)
+        expected = np.argsort(-(normalized @ normalized[3]), kind='stable')[:10]
+        ids, scores = index.search(self.matrix[3], k=10, n_probe=16)
+        self.assertEqual(3, ids[0])
+        self.assertEqual(set(expected), set(ids))
+        self.assertTrue(np.all(np.diff(scores) <= 0))
+
+    def test_save_and_load(self):
+        index = IvfIndex.build(self.matrix, n_lists=16, metadata={'name': 'test'})
+        path = os.path.join(self._tmpdir.name, 'index')
+        index.save(path)
+        loaded = IvfIndex.load(path)
+        self.assertEqual('test', loaded.metadata['name'])
+        self.assertIsInstance(loaded._vectors, np.memmap)
+        for probe in (1, 4):
+            a = index.search(self.matrix[5], k=5, n_probe=probe)
+            b = loaded.search(self.matrix[5], k=5, n_probe=probe)
+            self.assertTrue(np.array_equal(a[0], b[0]))
+
+    def test_wordvec2cosine_index(self):
+        w2c = Wordvec2Cosine(embeddings=self.embeddings, words=self.words)
+        with self.assertRaises(ValueError):
+            w2c.n_most_similar_words_approx('word1', 5)
+        w2c.build_index(n_lists=16)
+        approx = w2c.n_most_similar_words_approx('word1', 5, n_probe=16)
+        self.assertEqual([w for w, _ in w2c.n_most_similar_words('word1', 5)], [w for w, _ in approx])
+        benchmark = w2c.benchmark_index(n_queries=20, k=5, n_probes=[1, 16])
+        self.assertEqual([1, 16], list(benchmark['n_probe']))
+        self.assertAlmostEqual(1.0, benchmark['recall'].iloc[1])
+        self.assertLessEqual(benchmark['recall'].iloc[0], benchmark['recall'].iloc[1])
+        path = os.path.join(self._tmpdir.name, 'w2c_index')
+        w2c.save_index(path)
+        w2c2 = Wordvec2Cosine(embeddings=self.embeddings, words=self.words)
+        w2c2.load_index(path)
+        self.assertEqual(approx, w2c2.n_most_similar_words_approx('word1', 5, n_probe=16))
@@ -1,5 +1,8 @@
 from kcet.kcet_dataset_generator import KcetDatasetGenerator
+from kcet.kcet_parser import KcetParser
 import os
+import tempfile
+import numpy as np
 from unittest import TestCase
 
 
@@ -122,3 +125,77 @@ class TestKCETDatasetGenerator(TestCase):
         df_pos_training = self.data_generator._get_positive_training_data_set(2008)
         df_neg_training = self.data_generator.get_neg_training_embeddings(target_year=2008, n_neg_examples=10*len(df_pos_training))
         self.assertEqual(0, df_neg_training.shape[0])
+
+
+class TestKCETNegativeSampling(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        """
+        Fake embedding with 22 protein kinases and 31 cancers, i.e., a grid of 682 pairs
+        """
+        cls._tmpdir = tempfile.TemporaryDirectory()
+        kcet_parser = KcetParser()
+        kinases = [k for k in dict.fromkeys(kcet_parser.get_symbol_to_id_map().values())
+                   if k not in ('ncbigene1956', 'ncbigene2064')][:20]
+        cancers = kcet_parser.get_mesh_id_list()[:30]
+        # make sure that the NSCLC/EGFR links of the test data are part of the grid
+        words = kinases + ['ncbigene1956', 'ncbigene2064'] + cancers + ['meshd002289']
+        matrix = np.random.default_rng(0).normal(size=(len(words), 8)).astype(np.float32)
+        embeddings = os.path.join(cls._tmpdir.name, 'embeddings.npy')
+        words_path = os.path.join(cls._tmpdir.name, 'words.txt')
+        np.save(embeddings, matrix)
+        with open(words_path, 'w') as f:
+            for w in words:
+                f.write("['%s']\n" % w)
+        current_dir = os.path.dirname(__file__)
+        cls.ct_by_phase_path = os.path.join(current_dir, 'data', 'small_ct_by_phase.tsv')
+        cls.embeddings = embeddings
+        cls.words = words_path
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._tmpdir.cleanup()
+
+    def _get_generator(self, random_state=42):
+        return KcetDatasetGenerator(clinical_trials=self.ct_by_phase_path, embeddings=self.embeddings,
+                                    words=self.words, random_state=random_state)
+
+    def test_negatives_are_reproducible(self):
+        neg1 = self._get_generator().get_neg_training_embeddings(target_year=2015, n_neg_examples=50)
+        neg2 = self._get_generator().get_neg_training_embeddings(target_year=2015, n_neg_examples=50)
+        self.assertEqual(50, len(neg1))
+        self.assertEqual(list(neg1.index), list(neg2.index))
+        self.assertTrue(np.array_equal(neg1.values, neg2.values))
+
+    def test_negatives_exclude_positives(self):
+        # there are 22 x 31 = 682 pairs in the grid, and 2 positive links up to 2015 have embeddings
+        neg = self._get_generator().get_neg_training_embeddings(target_year=2015, n_neg_examples=1000)
+        self.assertEqual(680, len(neg))
+        self.assertEqual(680, len(set(neg.index)))
+        self.assertFalse('ncbigene1956-meshd002289' in neg.index)
+        self.assertFalse('ncbigene2064-meshd002289' in neg.index)
+
+    def test_negative_test_set_is_distinct_from_training(self):
+        data_generator = self._get_generator()
+        neg_train = data_generator.get_neg_training_embeddings(target_year=2015, n_neg_examples=300)
+        neg_test = data_generator.get_negative_test_embeddings(negative_df=neg_train, year=2015, n_negative_test=300)
+        self.assertEqual(300, len(neg_test))
+        self.assertEqual(0, len(set(neg_train.index).intersection(neg_test.index)))
+
+    def test_novel_prediction_chunks(self):
+        data_generator = self._get_generator()
+        neg_train = data_generator.get_neg_training_embeddings(target_year=2015, n_neg_examples=20)
+        chunks = list(data_generator.iter_novel_prediction_chunks(target_year=2015, negative_training_df=neg_train,
+                                                                  chunk_size=100))
+        # 100 pairs per chunk is 3 kinases x 31 cancers
+        self.assertEqual(8, len(chunks))
+        pair_ids = np.concatenate([p for p, _ in chunks])
+        vectors = np.concatenate([v for _, v in chunks])
+        # 682 pairs minus 2 positives minus 20 negative training examples
+        self.assertEqual(660, len(pair_ids))
+        labels = data_generator.get_pair_labels(pair_ids)
+        self.assertEqual(0, len(set(labels).intersection(neg_train.index)))
+        self.assertFalse('ncbigene1956-meshd002289' in labels)
+        store = data_generator.get_embedding_store()
+        kinase, cancer = labels[0].split('-')
+        self.assertTrue(np.allclose(store.get_vector(kinase) - store.get_vector(cancer), vectors[0]))
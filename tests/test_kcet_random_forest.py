@@ -0,0 +1,145 @@
+from kcet.kcet_parser import KcetParser
+from kcet.kcet_dataset_generator import KcetDatasetGenerator
+from kcet.kcet_random_forest import KcetRandomForest, load_model
+from kcet.execution_config import ExecutionConfig
+import os
+import tempfile
+import numpy as np
+from unittest import TestCase
+
+
+class TestKcetRandomForest(TestCase):
+    """
+    Fake embedding with 20 protein kinases (including EGFR, ERBB2 and ERBB4, which are inhibited by afatinib) and
+    30 cancers (including the five cancers of the test data). There are 3 positive training links (phase 4, NSCLC)
+    up to 2014 and 3 new links for multiple myeloma in 2015.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls._tmpdir = tempfile.TemporaryDirectory()
+        kcet_parser = KcetParser()
+        afatinib_kinases = ['ncbigene1956', 'ncbigene2064', 'ncbigene2066']
+        test_cancers = ['meshd002289', 'meshd001749', 'meshd014523', 'meshd014516', 'meshd009101']
+        kinases = [k for k in dict.fromkeys(kcet_parser.get_symbol_to_id_map().values())
+                   if k not in afatinib_kinases][:17]
+        cancers = [c for c in kcet_parser.get_mesh_id_list() if c not in test_cancers][:25]
+        words = afatinib_kinases + kinases + test_cancers + cancers
+        matrix = np.random.default_rng(0).normal(size=(len(words), 8)).astype(np.float32)
+        cls.embeddings = os.path.join(cls._tmpdir.name, 'embeddings.npy')
+        cls.words = os.path.join(cls._tmpdir.name, 'words.txt')
+        np.save(cls.embeddings, matrix)
+        with open(cls.words, 'w') as f:
+            for w in words:
+                f.write("['%s']\n" % w)
+        current_dir = os.path.dirname(__file__)
+        cls.ct_by_phase_path = os.path.join(current_dir, 'data', 'small_ct_by_phase.tsv')
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._tmpdir.cleanup()
+
+    def _get_random_forest(self, config: ExecutionConfig = None) -> KcetRandomForest:
+        data_generator = KcetDatasetGenerator(clinical_trials=self.ct_by_phase_path, embeddings=self.embeddings,
+                                              words=self.words)
+        return KcetRandomForest(data_gen=data_generator, embedddingfile=self.embeddings, wordsfile=self.words,
+                                target=2014, config=config)
+
+    def test_fit_once_evaluate_many(self):
+        krf = self._get_random_forest()
+        model = krf.fit()
+        self.assertIs(model, krf.fit())
+        y_pred, y_test, yproba, n_pos_train, n_neg_train, n_pos_test, n_neg_test = krf.classify(begin_year=2015,
+                                                                                                end_year=2020)
+        self.assertIs(model, krf.fit())
+        self.assertEqual(3, n_pos_train)
+        self.assertEqual(30, n_neg_train)
+        self.assertEqual(3, n_pos_test)
+        self.assertEqual(30, n_neg_test)
+        self.assertEqual(33, len(yproba))
+        _, _, _, n_pos_train2, n_neg_train2, n_pos_test2, _ = krf.evaluate(begin_year=2015, end_year=2015)
+        self.assertEqual((3, 30, 3), (n_pos_train2, n_neg_train2, n_pos_test2))
+
+    def test_bad_test_window(self):
+        krf = self._get_random_forest()
+        with self.assertRaises(ValueError):
+            krf.evaluate(begin_year=2013, end_year=2020)
+
+    def test_parallel_config(self):
+        config = ExecutionConfig(n_jobs=2, backend='threading', mmap_data=True, n_iter=2, cv=3)
+        krf = self._get_random_forest(config=config)
+        model = krf.fit()
+        # the search is parallel, the forests are not
+        self.assertEqual(1, model.get_params()['n_jobs'])
+        self.assertEqual(2, krf._get_search().get_params()['n_jobs'])
+        _, y_test, yproba, _, _, n_pos_test, n_neg_test = krf.evaluate(begin_year=2015, end_year=2020)
+        self.assertEqual(n_pos_test + n_neg_test, len(yproba))
+
+    def test_bad_config(self):
+        with self.assertRaises(ValueError):
+            ExecutionConfig(backend='dask')
+        with self.assertRaises(ValueError):
+            ExecutionConfig(cv=1)
+        with self.assertRaises(ValueError):
+            ExecutionConfig(search='grid')
+
+    def test_halving_search(self):
+        config = ExecutionConfig(n_iter=4, cv=3, search='halving', halving_factor=2)
+        krf = self._get_random_forest(config=config)
+        with self.assertRaises(ValueError):
+            krf.get_search_report()
+        krf.fit()
+        report = krf.get_search_report()
+        self.assertEqual([0, 1], list(report['rung']))
+        self.assertEqual([4, 2], list(report['n_candidates']))
+        self.assertEqual([12, 24], list(report['n_resources']))
+        self.assertTrue((report['fit_time'] > 0).all())
+        self.assertEqual(0, report['n_failed'].sum())
+        _, _, yproba, _, _, n_pos_test, n_neg_test = krf.evaluate(begin_year=2015, end_year=2020)
+        self.assertEqual(n_pos_test + n_neg_test, len(yproba))
+
+    def test_random_search_report(self):
+        krf = self._get_random_forest(config=ExecutionConfig(n_iter=2, cv=3))
+        krf.fit()
+        report = krf.get_search_report()
+        self.assertEqual(1, len(report))
+        self.assertEqual(2, report['n_candidates'][0])
+        self.assertEqual(33, report['n_resources'][0])
+
+    def test_random_grid_fits(self):
+        # every setting of the grid must be accepted by scikit-learn, otherwise its fits fail and score NaN
+        config = ExecutionConfig(n_iter=12, cv=3, search='halving', halving_factor=2)
+        krf = self._get_random_forest(config=config)
+        krf.fit()
+        self.assertEqual(0, krf.get_search_report()['n_failed'].sum())
+
+    def test_save_and_load(self):
+        krf = self._get_random_forest()
+        path = os.path.join(self._tmpdir.name, 'rf2014.joblib')
+        krf.save(path)
+        model, metadata = load_model(path)
+        self.assertEqual(2014, metadata['target_year'])
+        self.assertEqual(5, metadata['n_pk'])
+        self.assertEqual(10, metadata['factor'])
+        self.assertEqual(42, metadata['random_state'])
+        self.assertEqual(3, len(metadata['positive_training_pairs']))
+        self.assertEqual(30, len(metadata['negative_training_pairs']))
+        krf2 = self._get_random_forest()
+        krf2.load(path)
+        _, _, yproba, _, _, _, _ = krf.evaluate(begin_year=2015, end_year=2020)
+        _, _, yproba2, n_pos_train, n_neg_train, _, _ = krf2.evaluate(begin_year=2015, end_year=2020)
+        self.assertEqual((3, 30), (n_pos_train, n_neg_train))
+        self.assertEqual(len(yproba), len(yproba2))
+        X = np.random.default_rng(1).normal(size=(5, 8)).astype(np.float32)
+        self.assertTrue(np.array_equal(krf.fit().predict_proba(X), model.predict_proba(X)))
+
+    def test_load_mismatch(self):
+        krf = self._get_random_forest()
+        path = os.path.join(self._tmpdir.name, 'rf2014-mismatch.joblib')
+        krf.save(path)
+        data_generator = KcetDatasetGenerator(clinical_trials=self.ct_by_phase_path, embeddings=self.embeddings,
+                                              words=self.words)
+        krf2015 = KcetRandomForest(data_gen=data_generator, embedddingfile=self.embeddings, wordsfile=self.words,
+                                   target=2015)
+        with self.assertRaises(ValueError):
+            krf2015.load(path)
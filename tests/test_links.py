@@ -1,4 +1,5 @@
 from kcet.kcet_dataset_generator import Link
+from kcet.link_set import KinaseCancerGrid, LinkSet
 import os
 from unittest import TestCase
 
@@ -53,3 +54,45 @@ class TestLinks(TestCase):
 
 
 
+
+
+class TestLinkSet(TestCase):
+    """
+    Check the integer-encoded link sets
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.grid = KinaseCancerGrid(kinase_ids=['ncbigene9263', 'ncbigene780', 'ncbigene27'],
+                                    cancer_ids=['meshd016411', 'meshd016066', 'meshd012208', 'meshd002295'])
+        cls.link_set = LinkSet.from_labels(grid=cls.grid, labels=['ncbigene9263-meshd016411',
+                                                                  'ncbigene780-meshd016066',
+                                                                  'ncbigene27-meshd012208',
+                                                                  'ncbigene27-meshd012208'])
+
+    def test_encode_decode(self):
+        pair_ids = self.grid.encode(gene_ids=['ncbigene780', 'ncbigene27', 'ncbigeneFAKE'],
+                                    mesh_ids=['meshd016066', 'meshd002295', 'meshd016066'])
+        self.assertEqual([5, 11, -1], list(pair_ids))
+        self.assertEqual(['ncbigene780-meshd016066', 'ncbigene27-meshd002295'], self.grid.to_labels(pair_ids[:2]))
+
+    def test_membership(self):
+        self.assertEqual(3, len(self.link_set))
+        self.assertTrue(Link(cancer='meshd016411', kinase='ncbigene9263') in self.link_set)
+        self.assertTrue('ncbigene780-meshd016066' in self.link_set)
+        self.assertFalse(Link(cancer='meshd016066', kinase='ncbigene9263') in self.link_set)
+        self.assertFalse(Link(cancer='meshd0FAKE', kinase='ncbigene9263') in self.link_set)
+        self.assertEqual([True, False, True], list(self.link_set.contains([0, 1, 5])))
+
+    def test_set_operations(self):
+        other = LinkSet.from_pairs(grid=self.grid, gene_ids=['ncbigene780', 'ncbigene780'],
+                                   mesh_ids=['meshd016066', 'meshd002295'])
+        self.assertEqual(4, len(self.link_set | other))
+        self.assertEqual(['ncbigene780-meshd016066'], (self.link_set & other).to_labels())
+        self.assertEqual(['ncbigene9263-meshd016411', 'ncbigene27-meshd012208'], (self.link_set - other).to_labels())
+
+    def test_mask_round_trip(self):
+        mask = self.link_set.to_mask()
+        self.assertEqual(12, len(mask))
+        self.assertEqual(3, int(mask.sum()))
+        self.assertEqual(list(self.link_set.pair_ids), list(LinkSet.from_mask(self.grid, mask).pair_ids))
@@ -1,5 +1,6 @@
 from kcet.ct_by_phase_parser import CTParserByPhase
 import os
+import tempfile
 from unittest import TestCase
 
 
@@ -56,4 +57,59 @@ class TestParseCTbyPhase(TestCase):
             pki = row['pki']
             key = "%s-%s" % (cancer, pki)
             seen.add(key)
-        self.assertEqual(1, len(seen))
\ No newline at end of file
+        self.assertEqual(1, len(seen))
+
+class TestParseCTbyPhaseTable(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        current_dir = os.path.dirname(__file__)
+        cls.ct_by_phase_path = os.path.join(current_dir, 'data', "small_ct_by_phase.tsv")
+        cls.ct_parser = CTParserByPhase(clinical_trials=cls.ct_by_phase_path)
+
+    def test_all_phases_table(self):
+        """
+        There are 9 trial lines for afatinib, which inhibits 3 protein kinases (EGFR, ERBB2, ERBB4)
+        """
+        df = self.ct_parser.get_all_phases()
+        self.assertEqual(27, len(df))
+        self.assertEqual(['cancer', 'mesh_id', 'kinase', 'gene_id', 'pki', 'nct', 'phase', 'year'], list(df.columns))
+        self.assertEqual({'meshd002289', 'meshd001749', 'meshd014523', 'meshd014516', 'meshd009101'},
+                         set(df['mesh_id']))
+
+    def test_phase_4_table(self):
+        df = self.ct_parser.get_phase_4()
+        self.assertEqual(3, len(df))
+        self.assertEqual({2014}, set(df['year']))
+
+    def test_n_pk(self):
+        """
+        At the 30 nM threshold, afatinib inhibits EGFR (0.1 nM), ERBB2 (5 nM) and ERBB4 (6.3 nM)
+        """
+        df = self.ct_parser.get_all_phases(n_pk=1)
+        self.assertEqual(9, len(df))
+        self.assertEqual({'EGFR'}, set(df['kinase']))
+        df = self.ct_parser.get_all_phases(n_pk=2)
+        self.assertEqual({'EGFR', 'ERBB2'}, set(df['kinase']))
+        self.assertEqual(1, len(self.ct_parser.get_phase_4(n_pk=1)))
+
+    def test_ranked_links(self):
+        ranked = self.ct_parser.get_ranked_links()
+        self.assertEqual(27, len(ranked))
+        ranks = ranked.drop_duplicates(subset='kinase').set_index('kinase')['pk_rank']
+        self.assertEqual({'EGFR': 1, 'ERBB2': 2, 'ERBB4': 3}, ranks.to_dict())
+        for n_pk in [1, 2, 3]:
+            ranked_n = self.ct_parser.get_ranked_links(max_n_pk=n_pk)
+            df = self.ct_parser.get_all_phases(n_pk=n_pk)
+            self.assertEqual(len(df), len(ranked_n))
+            self.assertEqual(set(zip(df['nct'], df['gene_id'])), set(zip(ranked_n['nct'], ranked_n['gene_id'])))
+
+    def test_bad_phase(self):
+        with open(self.ct_by_phase_path) as f:
+            lines = f.readlines()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            bad_path = os.path.join(tmpdir, 'bad_ct_by_phase.tsv')
+            with open(bad_path, 'w') as f:
+                f.writelines(lines[:2] + [lines[2].replace('Phase 2', 'Phase 5')] + lines[3:])
+            with self.assertRaises(ValueError):
+                CTParserByPhase(clinical_trials=bad_path)
@@ -0,0 +1,60 @@
+from kcet import DrugCentralPkPkiParser
+from kcet.drugcentral_pk_pki_parser import AFFINITY_LADDER
+from unittest import TestCase
+
+
+class TestPkPkiLadder(TestCase):
+    """
+    Check the affinity ladder (30 nM, 300 nM, 3 uM) with the DrugCentral data in the input directory
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.pkpki = DrugCentralPkPkiParser()
+        cls.ladder = cls.pkpki.get_pk_pki_ladder(n_pki_limits=[1, 5])
+
+    def _get_links(self, pki: str, n_pki_limit: int):
+        df = self.ladder
+        return df[(df['pki'] == pki) & (df['n_pki_limit'] == n_pki_limit)]
+
+    def test_afatinib_first_rung(self):
+        """
+        afatinib	EGFR	18408761	0.0001	Kd	INHIBITOR
+        afatinib	ERBB2	18408761	0.005011872336273	Kd	INHIBITOR
+        afatinib	ERBB4	22888144	0.006309573444802	Kd	INHIBITOR
+        """
+        links = self._get_links('afatinib', 5)
+        self.assertEqual(['EGFR', 'ERBB2', 'ERBB4'], list(links['pk']))
+        self.assertEqual({0}, set(links['rung']))
+        self.assertEqual(['EGFR'], list(self._get_links('afatinib', 1)['pk']))
+
+    def test_upadacitinib_second_rung(self):
+        """
+        upadacitinib	JAK1	27272171	0.04677351412872	IC50	INHIBITOR
+        upadacitinib	JAK2	n/a	0.120226443461741	IC50
+        upadacitinib	JAK3	n/a	2.34422881531992	IC50
+        """
+        links = self._get_links('upadacitinib', 5)
+        self.assertEqual(['JAK1', 'JAK2'], list(links['pk']))
+        self.assertEqual({1}, set(links['rung']))
+        self.assertEqual({AFFINITY_LADDER[1]}, set(links['cutoff']))
+
+    def test_temsirolimus_third_rung(self):
+        """
+        temsirolimus	MTOR	12912932	1.77827941003892	IC50
+        """
+        links = self._get_links('temsirolimus', 1)
+        self.assertEqual(['MTOR'], list(links['pk']))
+        self.assertEqual({2}, set(links['rung']))
+
+    def test_single_rung(self):
+        # with the 30 nM cutoff only, upadacitinib has no valid links
+        thresholded = self.pkpki.get_pk_pki_with_threshold(n_pki_limit=5)
+        self.assertFalse('upadacitinib' in thresholded)
+        self.assertEqual(['EGFR', 'ERBB2', 'ERBB4'], thresholded['afatinib'])
+        ladder = self.ladder[self.ladder['n_pki_limit'] == 5]
+        self.assertEqual(sum(len(v) for v in thresholded.values()), int((ladder['rung'] == 0).sum()))
+
+    def test_bad_ladder(self):
+        with self.assertRaises(ValueError):
+            self.pkpki.get_ranked_pk_pki(ladder=[0.3, 0.03])
@@ -0,0 +1,71 @@
+from kcet import CTParserByPhase
+from kcet import snapshot_cache
+from kcet.input_registry import get_registry
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+from unittest import TestCase
+
+
+class TestSnapshotCache(TestCase):
+    """
+    Check the round trip of tables through the NPZ snapshots and the invalidation by content hash
+    """
+
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self._tmpdir.name, 'cache')
+        self.n_built = 0
+
+    def tearDown(self):
+        snapshot_cache.set_cache_dir(None)
+        self._tmpdir.cleanup()
+
+    def _build(self) -> pd.DataFrame:
+        self.n_built += 1
+        return pd.DataFrame({'gene_id': ['ncbigene1956', 'ncbigene2064'], 'disease': ['Lung Neoplasms', np.nan],
+                             'year': [2008, 2011], 'act_value': [0.01, np.nan]})
+
+    def test_round_trip(self):
+        path = os.path.join(self._tmpdir.name, 'frame.npz')
+        df = self._build()
+        snapshot_cache.save_frame(path, df)
+        pd.testing.assert_frame_equal(df, snapshot_cache.load_frame(path))
+
+    def test_cache_disabled(self):
+        source = os.path.join(self._tmpdir.name, 'source.tsv')
+        with open(source, 'w') as f:
+            f.write("a\n")
+        snapshot_cache.get_frame(name='test', sources=[source], builder=self._build)
+        snapshot_cache.get_frame(name='test', sources=[source], builder=self._build)
+        self.assertEqual(2, self.n_built)
+        self.assertFalse(os.path.exists(self.cache_dir))
+
+    def test_snapshot_is_rebuilt_if_source_changes(self):
+        snapshot_cache.set_cache_dir(self.cache_dir)
+        source = os.path.join(self._tmpdir.name, 'source.tsv')
+        with open(source, 'w') as f:
+            f.write("a\n")
+        first = snapshot_cache.get_frame(name='test', sources=[source], builder=self._build)
+        second = snapshot_cache.get_frame(name='test', sources=[source], builder=self._build)
+        self.assertEqual(1, self.n_built)
+        pd.testing.assert_frame_equal(first, second)
+        snapshot_cache.get_frame(name='test', sources=[source], builder=self._build, params='n_pk=1')
+        self.assertEqual(2, self.n_built)
+        with open(source, 'w') as f:
+            f.write("a\nb\n")
+        snapshot_cache.get_frame(name='test', sources=[source], builder=self._build)
+        self.assertEqual(3, self.n_built)
+
+    def test_ct_parser_with_snapshots(self):
+        current_dir = os.path.dirname(__file__)
+        ct_by_phase_path = os.path.join(current_dir, 'data', 'small_ct_by_phase.tsv')
+        expected = CTParserByPhase(clinical_trials=ct_by_phase_path).get_all_phases()
+        snapshot_cache.set_cache_dir(self.cache_dir)
+        for _ in range(2):
+            # parse again in the second iteration, i.e., read the snapshots written in the first
+            get_registry().clear()
+            df = CTParserByPhase(clinical_trials=ct_by_phase_path).get_all_phases()
+            pd.testing.assert_frame_equal(expected, df)
+        self.assertTrue(any(f.startswith('expand_ranked_trial_links-') for f in os.listdir(self.cache_dir)))
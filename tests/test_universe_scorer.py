@@ -0,0 +1,91 @@
+from kcet.kcet_parser import KcetParser
+from kcet.kcet_dataset_generator import KcetDatasetGenerator
+from kcet.execution_config import ExecutionConfig
+from kcet.universe_scorer import score_universe, score_universe_top_k, read_scores, get_chunk_size
+import os
+import tempfile
+import numpy as np
+from sklearn.ensemble import RandomForestClassifier
+from unittest import TestCase
+
+
+class TestUniverseScorer(TestCase):
+    """
+    Score the candidate pairs of a fake embedding with 20 protein kinases and 30 cancers (600 pairs)
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls._tmpdir = tempfile.TemporaryDirectory()
+        kcet_parser = KcetParser()
+        kinases = list(dict.fromkeys(kcet_parser.get_symbol_to_id_map().values()))[:20]
+        cancers = kcet_parser.get_mesh_id_list()[:30]
+        words = kinases + cancers
+        matrix = np.random.default_rng(0).normal(size=(len(words), 8)).astype(np.float32)
+        embeddings = os.path.join(cls._tmpdir.name, 'embeddings.npy')
+        words_path = os.path.join(cls._tmpdir.name, 'words.txt')
+        np.save(embeddings, matrix)
+        with open(words_path, 'w') as f:
+            for w in words:
+                f.write("['%s']\n" % w)
+        current_dir = os.path.dirname(__file__)
+        ct_by_phase_path = os.path.join(current_dir, 'data', 'small_ct_by_phase.tsv')
+        cls.data_gen = KcetDatasetGenerator(clinical_trials=ct_by_phase_path, embeddings=embeddings, words=words_path)
+        rng = np.random.default_rng(1)
+        cls.model = RandomForestClassifier(n_estimators=5, random_state=0).fit(
+            rng.normal(size=(40, 8)), rng.integers(0, 2, size=40))
+        _, _, prediction_df = cls.data_gen.get_data_for_novel_prediction(target_year=2014)
+        cls.expected = prediction_df.index, cls.model.predict_proba(prediction_df.values)[:, 1].astype(np.float32)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._tmpdir.cleanup()
+
+    def _score(self, name: str, config: ExecutionConfig = None):
+        output = os.path.join(self._tmpdir.name, name)
+        stats = score_universe(data_gen=self.data_gen, model=self.model, target_year=2014, output=output,
+                               chunk_size=100, config=config)
+        return stats, read_scores(output)
+
+    def _check_scores(self, scores):
+        labels, probabilities = self.expected
+        self.assertEqual(list(labels), ["%s-%s" % (g, m) for g, m in zip(scores['gene_id'], scores['mesh_id'])])
+        self.assertTrue(np.array_equal(probabilities, scores['probability'].values))
+
+    def test_serial(self):
+        stats, scores = self._score('serial')
+        self.assertEqual(len(self.expected[0]), stats['n_pairs'])
+        self.assertEqual(7, stats['n_chunks'])  # 3 kinases (90 pairs) per chunk
+        self.assertGreater(stats['pairs_per_second'], 0)
+        self._check_scores(scores)
+
+    def test_threads(self):
+        _, scores = self._score('threads', config=ExecutionConfig(n_jobs=3, backend='threading'))
+        self._check_scores(scores)
+
+    def test_processes(self):
+        _, scores = self._score('processes', config=ExecutionConfig(n_jobs=2, backend='loky'))
+        self._check_scores(scores)
+
+    def test_top_k(self):
+        _, scores = self._score('all')
+        expected = scores.sort_values(by='probability', ascending=False, kind='mergesort')['probability'].values[:25]
+        output = os.path.join(self._tmpdir.name, 'top_k')
+        top_k = score_universe_top_k(data_gen=self.data_gen, model=self.model, target_year=2014, output=output, k=25,
+                                     memory_budget=2 ** 20, n_shards=4)
+        self.assertEqual(25, len(top_k))
+        self.assertTrue(np.array_equal(expected, top_k['probability'].values))
+        # resume after a killed job: only the missing shard is scored again
+        os.remove(os.path.join(output, 'shard-00002.npz'))
+        resumed = score_universe_top_k(data_gen=self.data_gen, model=self.model, target_year=2014, output=output,
+                                       k=25, memory_budget=2 ** 20, n_shards=4,
+                                       config=ExecutionConfig(n_jobs=2, backend='loky'))
+        self.assertTrue(top_k.equals(resumed))
+        with self.assertRaises(ValueError):
+            score_universe_top_k(data_gen=self.data_gen, model=self.model, target_year=2014, output=output, k=10,
+                                 n_shards=4)
+
+    def test_memory_budget(self):
+        self.assertEqual(30 * 10, get_chunk_size(memory_budget=10 * 30 * (8 * 8 + 64), dimension=8, n_cancers=30))
+        with self.assertRaises(ValueError):
+            get_chunk_size(memory_budget=1000, dimension=8, n_cancers=30)
@@ -0,0 +1,143 @@
+from kcet.wordvec2cosine import Wordvec2Cosine, SimilarityCache
+from kcet.execution_config import ExecutionConfig
+import os
+import tempfile
+import numpy as np
+from scipy.spatial.distance import cosine
+from unittest import TestCase
+
+
+class TestWordvec2Cosine(TestCase):
+    """
+    Compare the vectorized similarity queries with scipy's cosine distance on a random embedding with 500 words
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls._tmpdir = tempfile.TemporaryDirectory()
+        cls.matrix = np.random.default_rng(0).normal(size=(500, 10)).astype(np.float32)
+        cls.words = ['word%d' % i for i in range(500)]
+        embeddings = os.path.join(cls._tmpdir.name, 'embeddings.npy')
+        words = os.path.join(cls._tmpdir.name, 'words.txt')
+        np.save(embeddings, cls.matrix)
+        with open(words, 'w') as f:
+            for w in cls.words:
+                f.write("['%s']\n" % w)
+        cls.w2c = Wordvec2Cosine(embeddings=embeddings, words=words)
+        target = cls.matrix[7]
+        cls.similarities = np.array([1 - cosine(target, v) for v in cls.matrix])
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.w2c = None
+        cls._tmpdir.cleanup()
+
+    def test_most_similar(self):
+        items = self.w2c.n_most_similar_words('word7', 5)
+        expected = np.argsort(-self.similarities, kind='stable')[:5]
+        self.assertEqual([self.words[i] for i in expected], [w for w, _ in items])
+        self.assertEqual('word7', items[0][0])
+        self.assertTrue(np.allclose(self.similarities[expected], [s for _, s in items], atol=1e-6))
+
+    def test_least_similar(self):
+        df = self.w2c.n_least_similar_words_df('word7', 5)
+        expected = np.argsort(self.similarities, kind='stable')[:5]
+        self.assertEqual([self.words[i] for i in expected], list(df['word']))
+        self.assertEqual(['word', 'similarity'], list(df.columns))
+
+    def test_close_to_zero(self):
+        items = self.w2c.n_close_to_zero_similar_words('word7', 1000, 0.05)
+        band = [i for i in np.argsort(self.similarities, kind='stable') if abs(self.similarities[i]) < 0.05]
+        self.assertEqual([self.words[i] for i in band], [w for w, _ in items])
+        self.assertEqual(3, len(self.w2c.n_close_to_zero_similar_words('word7', 3, 0.05)))
+
+    def test_unknown_word(self):
+        with self.assertRaises(KeyError):
+            self.w2c.n_most_similar_words('unknown', 5)
+
+    def test_most_similar_batch(self):
+        targets = ['word%d' % i for i in range(0, 500, 7)]
+        indices, scores = self.w2c.most_similar_batch(targets, k=4, block_size=16)
+        self.assertEqual((len(targets), 4), indices.shape)
+        self.assertEqual(np.float32, scores.dtype)
+        for i, target in enumerate(targets):
+            expected = self.w2c.n_most_similar_words(target, 4)
+            self.assertEqual([w for w, _ in expected], [self.words[j] for j in indices[i]])
+            self.assertTrue(np.allclose([s for _, s in expected], scores[i], atol=1e-6))
+        threaded = self.w2c.most_similar_batch(targets, k=4, block_size=16, config=ExecutionConfig(n_jobs=3))
+        self.assertTrue(np.array_equal(indices, threaded[0]))
+        with self.assertRaises(KeyError):
+            self.w2c.most_similar_batch(['word1', 'unknown'], k=4)
+
+    def test_cache(self):
+        cache = SimilarityCache(max_size=2)
+        w2c = Wordvec2Cosine(embeddings=os.path.join(self._tmpdir.name, 'embeddings.npy'),
+                             words=os.path.join(self._tmpdir.name, 'words.txt'), cache=cache)
+        first = w2c.n_most_similar_words('word7', 5)
+        self.assertEqual((0, 1), (cache.hits, cache.misses))
+        first.append(('mutated', 0.0))
+        self.assertEqual(first[:5], w2c.n_most_similar_words('word7', 5))
+        self.assertEqual((1, 1), (cache.hits, cache.misses))
+        w2c.n_most_similar_words('word7', 6)
+        w2c.n_least_similar_words('word7', 5)
+        self.assertEqual(2, len(cache))
+        # the least recently used result (word7, 5) was evicted
+        w2c.n_most_similar_words('word7', 5)
+        self.assertEqual((1, 4), (cache.hits, cache.misses))
+        cache.clear()
+        self.assertEqual((0, 0, 0), (len(cache), cache.hits, cache.misses))
+
+    def test_most_similar_streaming(self):
+        targets = ['word7', 'word42', 'word499']
+        rows, scores, stats = self.w2c.most_similar_streaming(targets, k=5, block_rows=64)
+        self.assertEqual((3, 5), rows.shape)
+        self.assertEqual(8, stats['blocks'])
+        self.assertEqual(self.matrix.nbytes, stats['bytes_read'])
+        expected_rows, expected_scores = self.w2c.most_similar_batch(targets, k=5)
+        self.assertTrue(np.array_equal(expected_rows, rows))
+        self.assertTrue(np.allclose(expected_scores, scores, atol=1e-6))
+        # blocks with fewer rows than k
+        small_rows, _, small_stats = self.w2c.most_similar_streaming(targets, k=5, block_rows=3)
+        self.assertTrue(np.array_equal(expected_rows, small_rows))
+        self.assertEqual(167, small_stats['blocks'])
+
+
+class TestWordvec2CosineDuplicates(TestCase):
+    """
+    A duplicated word is scored with the same (first) row that it resolves to as a target word
+    """
+
+    def test_duplicated_word(self):
+        matrix = np.array([[1, 0], [0, 1], [1, 1], [-1, 0]], dtype=np.float32)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            embeddings = os.path.join(tmpdir, 'embeddings.npy')
+            words = os.path.join(tmpdir, 'words.txt')
+            np.save(embeddings, matrix)
+            with open(words, 'w') as f:
+                for w in ['a', 'b', 'c', 'a']:
+                    f.write("['%s']\n" % w)
+            w2c = Wordvec2Cosine(embeddings=embeddings, words=words, cache=SimilarityCache())
+            items = w2c.n_most_similar_words('a', 3)
+            self.assertEqual(['a', 'c', 'b'], [w for w, _ in items])
+            self.assertAlmostEqual(1.0, items[0][1], places=6)
+            rows, scores = w2c.most_similar_batch(['a'], k=3)
+            self.assertEqual([0, 2, 1], list(rows[0]))
+            self.assertAlmostEqual(1.0, scores[0, 0], places=6)
+
+    def test_ties_are_broken_by_row(self):
+        # identical vectors have the same similarity to every target
+        matrix = np.tile(np.array([[1, 0]], dtype=np.float32), (40, 1))
+        matrix[0] = [0, 1]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            embeddings = os.path.join(tmpdir, 'embeddings.npy')
+            words = os.path.join(tmpdir, 'words.txt')
+            np.save(embeddings, matrix)
+            with open(words, 'w') as f:
+                for i in range(len(matrix)):
+                    f.write("['w%d']\n" % i)
+            w2c = Wordvec2Cosine(embeddings=embeddings, words=words, cache=SimilarityCache())
+            rows, scores = w2c.most_similar_batch(['w5'], k=10)
+            # argpartition picks any 10 of the 39 tied rows, but they are returned in increasing order
+            self.assertTrue(np.all(scores[0] == 1))
+            self.assertTrue(np.all(np.diff(rows[0]) > 0))
+            self.assertNotIn(0, rows[0])